@@ -0,0 +1,294 @@
+import os
+import sys
+import glob
+import json
+import time
+import struct
+import random
+import platform
+import tempfile
+import numpy as np
+import pigpio
+from waveform import compile_pulses, create_wave, airtime_us, wait_tx_done, CountingPi, TxMeter
+from fake_pigpio import FakePi, VirtualClock
+from sub_converter import PROTOCOLS, REGISTRY, encode_file, send_wave_chained
+from sub_parser import FlipperSubParser
+from pulsetrain import PulseTrain
+import normalize
+import fidelity
+# Benchmarks for the hot paths, runs without pigpiod (only measures the python side)
+# Usage: python3 benchmark.py waveform [pulse_count]
+#        python3 benchmark.py protocols [encodes]
+#        python3 benchmark.py completion [pulse_count]
+#        python3 benchmark.py fidelity [frames]
+#        python3 benchmark.py suite [results.json] [--synthetic 100000,1000000]
+#        python3 benchmark.py compare old.json new.json
+
+def timed(func, *args, rounds=5):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def synthetic_raw(count, seed=1):
+    rnd = random.Random(seed)
+    pulses = []
+    for i in range(count):
+        duration = rnd.randint(100, 2000)
+        pulses.append(duration if i % 2 == 0 else -duration)
+    return pulses
+
+# =======================
+# Waveform build
+# =======================
+def per_pulse_message(pulses, pin):
+    # Old path: pigpio.pulse per edge + what wave_add_generic does with it
+    waveform = []
+    for pulse in pulses:
+        duration = abs(pulse)
+        if pulse > 0:
+            waveform.append(pigpio.pulse(1 << pin, 0, duration))
+        else:
+            waveform.append(pigpio.pulse(0, 1 << pin, duration))
+    ext = bytearray()
+    for p in waveform:
+        ext.extend(struct.pack("III", p.gpio_on, p.gpio_off, p.delay))
+    return bytes(ext)
+
+def compiled_message(pulses, pin):
+    return compile_pulses(pulses, pin).tobytes()
+
+def bench_waveform(count):
+    pin = 13
+    pulses = synthetic_raw(count)
+    assert per_pulse_message(pulses, pin) == compiled_message(pulses, pin)
+    old = timed(per_pulse_message, pulses, pin)
+    new = timed(compiled_message, pulses, pin)
+    airtime = sum(abs(p) for p in pulses) / 1e6
+    print(f"Waveform build for {count} pulses ({airtime:.2f} s of airtime):")
+    print(f"  per-pulse path: {old * 1000:.2f} ms")
+    print(f"  compiled path:  {new * 1000:.2f} ms ({old / new:.1f}X faster)")
+
+# =======================
+# Protocol encode
+# =======================
+def per_bit_encode(proto_def, key_hex, te_override=None):
+    # Old encode_protocol, bit by bit from zfill'd string
+    pulses = []
+    short = te_override if te_override else proto_def["short"]
+    for h in proto_def.get("header", []):
+        pulses.extend(val * short for val in h)
+    key_bin = bin(int(key_hex.replace(" ", ""), 16))[2:].zfill(proto_def["bit_len"])
+    for b in key_bin:
+        for seg in proto_def["bit_map"].get(b, []):
+            pulses.extend(val * short for val in seg)
+    for s in proto_def.get("stop", []):
+        pulses.extend(val * short for val in s)
+    return pulses
+
+def bench_protocols(count):
+    rnd = random.Random(1)
+    print(f"{'Protocol':<14}{'per-bit enc/s':>16}{'table enc/s':>16}{'speedup':>10}")
+    for name, proto_def in PROTOCOLS.items():
+        encoder = REGISTRY[name]
+        keys = [f"{rnd.getrandbits(proto_def['bit_len']):016X}" for _ in range(count)]
+        assert all(per_bit_encode(proto_def, k) == list(encoder.encode(k)) for k in keys[:50])
+
+        def run_old():
+            for k in keys:
+                per_bit_encode(proto_def, k)
+
+        def run_new():
+            for k in keys:
+                np.asarray(encoder.encode(k))  # encode() is lazy, materialise like a send does
+
+        old = count / timed(run_old, rounds=3)
+        new = count / timed(run_new, rounds=3)
+        print(f"{name:<14}{old:>16.0f}{new:>16.0f}{new / old:>9.1f}X")
+
+# =======================
+# Transmit completion
+# =======================
+def bench_completion(count):
+    pulses = synthetic_raw(count)
+    pi = CountingPi(FakePi())
+    wave_id = create_wave(pi, 13, pulses)
+    airtime = airtime_us(pulses)
+    print(f"{count} pulses, {airtime / 1000:.0f} ms airtime")
+
+    def busy_wait():
+        while pi.wave_tx_busy():
+            pass
+
+    for name, wait in (("busy poll", busy_wait), ("wait_tx_done", lambda: wait_tx_done(pi, airtime))):
+        with TxMeter(pi) as meter:
+            pi.wave_send_once(wave_id)
+            wait()
+        print(f"{name:<14}{meter.summary()}")
+
+# =======================
+# Fidelity alignment
+# =======================
+def jittered(pulses, jitter_us, seed=1):
+    # Every edge moved by up to jitter_us, durations do not add the error up
+    rng = np.random.default_rng(seed)
+    t = np.concatenate(([0], np.cumsum(np.abs(pulses))))
+    t[1:-1] += rng.integers(-jitter_us, jitter_us + 1, len(t) - 2)
+    return np.diff(t) * np.sign(pulses)
+
+def bench_fidelity(frames):
+    # Repeated frames correlate the same at every repeat, capture must still align to the first one
+    ref = normalize.merge_same_sign(np.tile(np.asarray(REGISTRY["Princeton"].encode("123456")), frames))
+    for lead_us, jitter_us in ((5000, 0), (30000, 20)):
+        cap = normalize.merge_same_sign(np.concatenate(([-lead_us], jittered(ref, jitter_us) if jitter_us else ref)))
+        result, _, _ = fidelity.analyse(ref, cap)
+        assert abs(result["lag_us"] - lead_us) <= jitter_us and result["dropped"] == 0 and result["extra"] == 0, result
+        elapsed = timed(fidelity.analyse, ref, cap, rounds=3)
+        print(f"{frames} frames, {lead_us / 1000:.0f} ms lead-in, {jitter_us} uS jitter: aligned at {result['lag_us']} uS "
+              f"in {elapsed * 1000:.1f} ms")
+
+# =======================
+# End-to-end suite
+# =======================
+SUITE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sub_custom_files")
+SUITE_PIN = 13
+SUITE_ROUNDS = 3
+SYNTHETIC_COUNTS = [100000, 1000000]
+STAGES = ["parse_ms", "encode_ms", "compile_ms", "transmit_ms"]
+
+def write_synthetic_sub(path, count, seed=1):
+    rng = np.random.default_rng(seed)
+    pulses = rng.integers(100, 2000, count)
+    pulses[1::2] *= -1
+    with open(path, "w") as f:
+        f.write("Filetype: Flipper SubGhz RAW File\nVersion: 1\nFrequency: 433920000\n"
+                "Preset: FuriHalSubGhzPresetOok650Async\nProtocol: RAW\n")
+        f.write(PulseTrain(pulses).to_sub_raw())
+
+def transmit(pulses):
+    # Whole send on fake pigpiod with virtual clock, so only host side work is timed
+    fake = FakePi(VirtualClock())
+    pi = CountingPi(fake)
+    with TxMeter(pi) as meter:
+        plan = send_wave_chained(pi, SUITE_PIN, pulses, None, 1 << 30, 1)
+    return fake, plan, meter
+
+def bench_file(path, name):
+    parser = FlipperSubParser(path)
+    result = {"name": name, "protocol": parser.meta.get("Protocol", "RAW")}
+    try:
+        pulses = encode_file(parser)
+    except ValueError as e:
+        result["error"] = str(e)
+        return result
+
+    fake, plan, meter = transmit(pulses)
+    ticks, _ = fake.timeline(SUITE_PIN)
+    result.update({
+        "pulses": len(pulses),
+        "airtime_us": airtime_us(pulses),
+        "parse_ms": timed(lambda: list(FlipperSubParser(path).iter_blocks()), rounds=SUITE_ROUNDS) * 1000,
+        "encode_ms": timed(lambda: np.asarray(encode_file(parser)), rounds=SUITE_ROUNDS) * 1000,
+        "compile_ms": timed(compile_pulses, pulses, SUITE_PIN, rounds=SUITE_ROUNDS) * 1000,
+        "transmit_ms": timed(transmit, pulses, rounds=SUITE_ROUNDS) * 1000,
+        "transmit_cpu_ms": meter.cpu * 1000,
+        "pigpio_calls": sum(meter.calls.values()),
+        "waves": plan["chunks"],
+        "edges": len(ticks),
+        "emitted_us": int(ticks[-1] - ticks[0]) if len(ticks) else 0,
+    })
+    total = sum(result[stage] for stage in STAGES)
+    result["pulses_per_s"] = len(pulses) / (total / 1000) if total else 0
+    for key, value in result.items():
+        if isinstance(value, float):
+            result[key] = round(value, 3)
+    return result
+
+def bench_suite(out_path, synthetic):
+    results = []
+    for path in sorted(glob.glob(os.path.join(SUITE_DIR, "*.sub"))):
+        results.append(bench_file(path, os.path.basename(path)))
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in synthetic:
+            path = os.path.join(tmp, f"synthetic_{count}.sub")
+            write_synthetic_sub(path, count)
+            results.append(bench_file(path, f"synthetic_{count}"))
+
+    print(f"{'File':<32}{'pulses':>9}{'parse':>9}{'encode':>9}{'compile':>9}{'transmit':>10}{'calls':>7}{'Mpulse/s':>10}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['name']:<32} skipped: {r['error']}")
+            continue
+        print(f"{r['name']:<32}{r['pulses']:>9}{r['parse_ms']:>9.2f}{r['encode_ms']:>9.2f}{r['compile_ms']:>9.2f}"
+              f"{r['transmit_ms']:>10.2f}{r['pigpio_calls']:>7}{r['pulses_per_s'] / 1e6:>10.2f}")
+
+    report = {
+        "schema": 1,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "rounds": SUITE_ROUNDS,
+        "results": results,
+    }
+    if out_path:
+        with open(out_path, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"Results written to {out_path}")
+    return report
+
+def compare(old_path, new_path):
+    # Time ratio new/old per file and stage, < 1 is faster
+    with open(old_path) as f:
+        old = {r["name"]: r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print(f"{'File':<32}" + "".join(f"{stage[:-3]:>10}" for stage in STAGES))
+    for r in new:
+        before = old.get(r["name"])
+        if before is None or "error" in r or "error" in before:
+            continue
+        ratios = [r[s] / before[s] if before[s] else 0 for s in STAGES]
+        print(f"{r['name']:<32}" + "".join(f"{x:>9.2f}X" for x in ratios))
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python3 benchmark.py waveform [pulse_count]")
+        print("       python3 benchmark.py protocols [encodes]")
+        print("       python3 benchmark.py completion [pulse_count]")
+        print("       python3 benchmark.py fidelity [frames]")
+        print("       python3 benchmark.py suite [results.json] [--synthetic 100000,1000000]")
+        print("       python3 benchmark.py compare old.json new.json")
+        sys.exit(1)
+
+    if sys.argv[1] == "waveform":
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+        bench_waveform(count)
+    elif sys.argv[1] == "protocols":
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+        bench_protocols(count)
+    elif sys.argv[1] == "completion":
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        bench_completion(count)
+    elif sys.argv[1] == "fidelity":
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        bench_fidelity(count)
+    elif sys.argv[1] == "suite":
+        args = sys.argv[2:]
+        synthetic = SYNTHETIC_COUNTS
+        if "--synthetic" in args:
+            i = args.index("--synthetic")
+            synthetic = [int(c) for c in args[i + 1].split(",") if c]
+            del args[i:i + 2]
+        bench_suite(args[0] if args else None, synthetic)
+    elif sys.argv[1] == "compare" and len(sys.argv) == 4:
+        compare(sys.argv[2], sys.argv[3])
+    else:
+        print(f"Unknown benchmark '{sys.argv[1]}'")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
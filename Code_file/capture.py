@@ -0,0 +1,171 @@
+import os
+import time
+import struct
+import select
+import socket
+import numpy as np
+import pigpio
+import profiler
+# Bulk edge capture from pigpio notification pipe (/dev/pigpioN), no python callback per edge.
+# Reports are read in chunks into one preallocated buffer and level changes are found with numpy.
+# Pipe only exists on the machine running pigpiod, otherwise the same reports come over own socket
+# (in-band notification, like pigpio callbacks use), so remote pigpiod and fake_pigpio work too.
+
+# ==== CONFIG ====
+REPORT_SIZE = 12              # H seqno, H flags, I tick, I level
+BUFFER_REPORTS = 1 << 16      # Preallocated read buffer, 768 kB
+INBAND = None                 # None: pipe when pigpiod runs on this machine (/dev/pigpio exists), else socket
+# ================
+
+REPORT = np.dtype([("seqno", "<u2"), ("flags", "<u2"), ("tick", "<u4"), ("level", "<u4")])
+
+class BulkCapture:
+    def __init__(self, pi, gpio, buffer_reports=BUFFER_REPORTS, inband=INBAND, prime=False):
+        # prime: level and tick are read at start, so the first edge is reported too (duration from start)
+        self.pi = pi
+        self.gpio = gpio
+        self.inband = not os.path.exists("/dev/pigpio") if inband is None else inband
+        self.prime = prime
+        self.buffer = bytearray(buffer_reports * REPORT_SIZE)
+        self.view = memoryview(self.buffer)
+        self.fill = 0           # Bytes of partial report kept from last read
+        self.handle = None
+        self.fd = None
+        self.sock = None
+        self.last_level = None
+        self.last_tick = None
+        self.last_seqno = None
+        self.edges = 0
+        self.dropped = 0
+        self.started = None
+        self.stopped = None
+
+    def start(self):
+        if self.inband:
+            self.handle = self.open_inband()
+        else:
+            self.handle = self.pi.notify_open()
+            if self.handle < 0:
+                raise RuntimeError(f"Cannot open pigpio notification ({self.handle})")
+            self.fd = os.open(f"/dev/pigpio{self.handle}", os.O_RDONLY | os.O_NONBLOCK)
+        if self.prime:
+            self.last_level, self.last_tick = self.pi.read(self.gpio), self.pi.get_current_tick()
+        self.pi.notify_begin(self.handle, 1 << self.gpio)
+        self.started = time.monotonic()
+
+    def open_inband(self):
+        # Second socket to the same pigpiod turned into notification stream, reply to NOIB comes first
+        self.sock = socket.create_connection((self.pi._host, self.pi._port))
+        self.sock.sendall(struct.pack("IIII", pigpio._PI_CMD_NOIB, 0, 0, 0))
+        reply = b""
+        while len(reply) < 16:
+            chunk = self.sock.recv(16 - len(reply))
+            if not chunk:
+                raise RuntimeError("pigpiod closed notification socket")
+            reply += chunk
+        handle = struct.unpack("IIIi", reply)[3]
+        if handle < 0:
+            raise RuntimeError(f"Cannot open pigpio notification ({handle})")
+        self.sock.setblocking(False)
+        self.fd = self.sock.fileno()
+        return handle
+
+    def stop(self):
+        if self.handle is not None:
+            self.pi.notify_close(self.handle)
+            self.handle = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        elif self.fd is not None:
+            os.close(self.fd)
+        self.fd = None
+        self.stopped = time.monotonic()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def read(self, timeout):
+        # Waits up to timeout seconds, returns (levels, durations, ticks) of edges in this chunk.
+        # Same meaning as pigpio callback: line went to level after duration uS at the other level.
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return self.decode(b"")
+        with profiler.stage("capture_read") as st:
+            try:
+                if self.sock is not None:
+                    count = self.sock.recv_into(self.view[self.fill:])
+                else:
+                    count = os.readv(self.fd, [self.view[self.fill:]])
+            except BlockingIOError:
+                count = 0
+            total = self.fill + count
+            usable = total - total % REPORT_SIZE
+            edges = self.decode(self.view[:usable])
+            st.nbytes, st.pulses = count, len(edges[0])
+        # Partial report goes to the start of the buffer for next read
+        self.fill = total - usable
+        self.buffer[:self.fill] = self.buffer[usable:total]
+        return edges
+
+    def decode(self, data):
+        reports = np.frombuffer(data, dtype=REPORT)
+        if len(reports) == 0:
+            return np.empty(0, np.uint8), np.empty(0, np.uint32), np.empty(0, np.uint32)
+
+        # Lost reports show up as holes in seqno
+        seqno = reports["seqno"].astype(np.int32)
+        if self.last_seqno is not None:
+            seqno = np.concatenate(([self.last_seqno], seqno))
+        self.dropped += int(np.sum((np.diff(seqno) - 1) & 0xFFFF))
+        self.last_seqno = int(seqno[-1])
+
+        reports = reports[reports["flags"] == 0]  # Skip keep alive, watchdog and event reports
+        if len(reports) == 0:
+            return np.empty(0, np.uint8), np.empty(0, np.uint32), np.empty(0, np.uint32)
+        levels = ((reports["level"] >> self.gpio) & 1).astype(np.uint8)
+        ticks = reports["tick"]
+        if self.last_level is None:
+            self.last_level, self.last_tick = int(levels[0]), int(ticks[0])
+            levels, ticks = levels[1:], ticks[1:]
+            if len(levels) == 0:
+                return levels, np.empty(0, np.uint32), ticks
+
+        changed = levels != np.concatenate(([self.last_level], levels[:-1]))
+        self.last_level = int(levels[-1])
+        levels, ticks = levels[changed], ticks[changed]
+        if len(ticks) == 0:
+            return levels, np.empty(0, np.uint32), ticks
+        # uint32 subtraction wraps the same way as pigpio.tickDiff
+        durations = np.diff(ticks, prepend=np.uint32(self.last_tick)).astype(np.uint32)
+        self.last_tick = int(ticks[-1])
+        self.edges += len(ticks)
+        return levels, durations, ticks
+
+    def summary(self):
+        elapsed = (self.stopped or time.monotonic()) - (self.started or time.monotonic())
+        rate = self.edges / elapsed if elapsed > 0 else 0
+        return {"edges": self.edges, "dropped": self.dropped, "seconds": round(elapsed, 3), "edge_rate": round(rate)}
+
+def signed_durations(levels, durations):
+    # rfrp convention, same as PulseTrain.from_levels
+    d = durations.astype(np.int32)
+    return np.where(levels == 1, d, -d).astype(np.int32)
+
+def capture(pi, gpio, seconds, on_edges, poll=0.05, stop=None):
+    # Runs bulk capture for given time and hands every chunk to on_edges(levels, durations, ticks),
+    # stop() returning True ends it early
+    with BulkCapture(pi, gpio) as cap:
+        deadline = cap.started + seconds
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0 or (stop and stop()):
+                break
+            levels, durations, ticks = cap.read(min(poll, left))
+            if len(durations):
+                on_edges(levels, durations, ticks)
+    return cap.summary()
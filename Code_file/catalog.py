@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+from concurrent.futures import ProcessPoolExecutor
+import profiler
+import pulse_cache
+from sub_parser import FlipperSubParser
+from sub_converter import load_pulses
+from waveform import airtime_us
+# Metadata catalog of a .sub library, so menu and searches do not have to parse thousands of files.
+# Kept in the library directory, only files with changed mtime or size are parsed again on refresh.
+# Pulse count and airtime are of the encoded, normalised train (what sub_converter.py sends), it ends up in pulse_cache.
+# Usage: python3 catalog.py /path/to/sub_dir [--freq 433.92] [--preset Ook] [--protocol RAW] [--max-airtime MS]
+#        [--sort name|frequency|protocol|bit|te|pulses|airtime] [--reverse] [--menu] [--workers N] [--profile]
+
+# ==== CONFIG ====
+CATALOG_NAME = ".sub_catalog.json"
+CATALOG_VERSION = 1
+FREQ_TOLERANCE_MHZ = 0.01
+SORT_FIELDS = ("name", "frequency", "protocol", "bit", "te", "pulses", "airtime")
+# ================
+
+def _int(text):
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+def describe_file(path):
+    entry = {}
+    try:
+        meta = FlipperSubParser(path).meta
+        entry.update(
+            frequency=_int(meta.get("Frequency")),
+            preset=meta.get("Preset"),
+            protocol=meta.get("Protocol", "RAW"),
+            bit=_int(meta.get("Bit")),
+            te=_int(meta.get("TE")),
+        )
+        pulses = load_pulses(path, evict=False)
+        entry.update(pulses=len(pulses), airtime=airtime_us(pulses))
+    except Exception as e:
+        entry["error"] = str(e)
+    return entry
+
+def load(directory):
+    try:
+        with open(os.path.join(directory, CATALOG_NAME), "r") as f:
+            saved = json.load(f)
+        if saved.get("version") == CATALOG_VERSION:
+            return saved["files"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+def save(directory, files):
+    path = os.path.join(directory, CATALOG_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"version": CATALOG_VERSION, "files": files}, f)
+    os.replace(tmp, path)
+
+def scan(directory):
+    # relative path -> (mtime_ns, size) of every .sub file, stat comes with scandir
+    found = {}
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".sub"):
+                    st = entry.stat()
+                    found[os.path.relpath(entry.path, directory)] = (st.st_mtime_ns, st.st_size)
+    return found
+
+def refresh(directory, workers=None):
+    # Returns (files, report {files, parsed, removed})
+    files = load(directory)
+    found = scan(directory)
+    stale = [name for name, (mtime, size) in found.items()
+             if name not in files or files[name].get("mtime") != mtime or files[name].get("size") != size]
+    removed = [name for name in files if name not in found]
+    for name in removed:
+        del files[name]
+    if stale:
+        with profiler.stage("catalog_parse") as st:
+            paths = [os.path.join(directory, name) for name in stale]
+            if len(stale) > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    entries = list(pool.map(describe_file, paths, chunksize=16))
+            else:
+                entries = [describe_file(paths[0])]
+            st.pulses = sum(e.get("pulses", 0) for e in entries)
+        for name, entry in zip(stale, entries):
+            entry["mtime"], entry["size"] = found[name]
+            files[name] = entry
+        pulse_cache.evict()  # Workers only add to the cache, size limit is applied once here
+    if stale or removed:
+        save(directory, files)
+    return files, {"files": len(files), "parsed": len(stale), "removed": len(removed)}
+
+def query(files, freq_mhz=None, preset=None, protocol=None, max_airtime_ms=None, sort="name", reverse=False):
+    rows = []
+    for name, entry in files.items():
+        if "error" in entry:
+            continue
+        if freq_mhz is not None and (entry["frequency"] is None
+                                     or abs(entry["frequency"] / 1e6 - freq_mhz) > FREQ_TOLERANCE_MHZ):
+            continue
+        if preset and preset.lower() not in (entry["preset"] or "").lower():
+            continue
+        if protocol and protocol.lower() != entry["protocol"].lower():
+            continue
+        if max_airtime_ms is not None and entry["airtime"] > max_airtime_ms * 1000:
+            continue
+        rows.append(dict(entry, name=name))
+    # Missing values (no Bit/TE in RAW files) go last
+    key = (lambda r: r["name"]) if sort == "name" else (lambda r: (r[sort] is None, r[sort] or 0, r["name"]))
+    rows.sort(key=key, reverse=reverse)
+    return rows
+
+def short_text(row):
+    # One word description for whiptail menu
+    freq = f"{row['frequency'] / 1e6:.2f}MHz" if row["frequency"] else "?MHz"
+    return f"{freq}_{row['protocol']}_{row['airtime'] / 1e6:.2f}s"
+
+def main():
+    profiler.take_flag(sys.argv)
+    args = sys.argv[1:]
+    opts = {"--freq": None, "--preset": None, "--protocol": None, "--max-airtime": None, "--sort": "name", "--workers": None}
+    for opt in opts:
+        if opt in args:
+            i = args.index(opt)
+            opts[opt] = args[i + 1]
+            del args[i:i + 2]
+    flags = {flag: flag in args for flag in ("--reverse", "--menu")}
+    args = [a for a in args if a not in flags]
+    if len(args) != 1 or opts["--sort"] not in SORT_FIELDS:
+        print("Usage: python3 catalog.py /path/to/sub_dir [--freq 433.92] [--preset Ook] [--protocol RAW] [--max-airtime MS]\n"
+              "       [--sort name|frequency|protocol|bit|te|pulses|airtime] [--reverse] [--menu] [--workers N] [--profile]")
+        sys.exit(1)
+
+    directory = args[0].rstrip("/")
+    files, report = refresh(directory, int(opts["--workers"]) if opts["--workers"] else None)
+    rows = query(files,
+                 float(opts["--freq"]) if opts["--freq"] else None,
+                 opts["--preset"], opts["--protocol"],
+                 float(opts["--max-airtime"]) if opts["--max-airtime"] else None,
+                 opts["--sort"], flags["--reverse"])
+    if flags["--menu"]:
+        # "file description" per line, for menu.sh
+        for row in rows:
+            print(f"{row['name']} {short_text(row)}")
+        return
+
+    for row in rows:
+        freq = f"{row['frequency'] / 1e6:.2f}" if row["frequency"] else "?"
+        print(f"{row['name']}  {freq} MHz  {row['preset'] or '?'}  {row['protocol']}  bit {row['bit'] or '-'}  TE {row['te'] or '-'}  "
+              f"{row['pulses']} pulses  {row['airtime'] / 1000:.1f} ms")
+    broken = sum("error" in e for e in files.values())
+    print(f"{len(rows)} of {report['files']} files ({report['parsed']} parsed, {report['removed']} removed, {broken} unsupported)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import zlib
+import struct
+import numpy as np
+import profiler
+from pulsetrain import PulseTrain
+from sub_converter import encode_protocol, resolve_protocol
+# Append-only code store replacing saved_codes.json.
+# Raw codes are stored as zigzag varints of signed durations (+ high, - low), so level is implicit.
+# Raw code can carry frame boundaries (index of first pulse of every frame), they go in front of the durations.
+# Small name -> offset index next to the log makes lookup and listing cheap, compact removes old records.
+# Usage: python3 code_store.py list|delete NAME|compact|import saved_codes.json [--store saved_codes.db]
+
+# ==== CONFIG ====
+DEFAULT_STORE = "saved_codes.db"
+# ================
+
+RECORD = struct.Struct("<2sBHII")  # magic, kind, name length, payload length, crc32 of name + payload
+MAGIC = b"RC"
+KIND_RAW = 0
+KIND_DECODED = 1
+KIND_DELETED = 2
+KIND_RAW_FRAMED = 3  # varints: frame count, frame starts, durations
+
+# =======================
+# Varint coding
+# =======================
+def encode_varints(pulses):
+    x = np.asarray(pulses, dtype=np.int64)
+    z = ((x << 1) ^ (x >> 63)).astype(np.uint64)  # zigzag, small +/- values stay small
+    shifts = np.arange(5, dtype=np.uint64) * np.uint64(7)
+    groups = ((z[:, None] >> shifts) & np.uint64(0x7F)).astype(np.uint8)
+    nbytes = 1 + sum((z >= np.uint64(1 << (7 * i))).astype(np.int64) for i in range(1, 5))
+    cols = np.arange(5)
+    groups |= np.where(cols < (nbytes - 1)[:, None], 0x80, 0).astype(np.uint8)
+    return groups[cols < nbytes[:, None]].tobytes()
+
+def decode_varints(data):
+    b = np.frombuffer(data, dtype=np.uint8)
+    if len(b) == 0:
+        return np.empty(0, dtype=np.int32)
+    ends = np.flatnonzero((b & 0x80) == 0)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    pos = np.arange(len(b)) - np.repeat(starts, ends - starts + 1)
+    z = np.add.reduceat((b & 0x7F).astype(np.uint64) << (pos.astype(np.uint64) * np.uint64(7)), starts)
+    return ((z >> np.uint64(1)).astype(np.int64) ^ -(z & np.uint64(1)).astype(np.int64)).astype(np.int32)
+
+# =======================
+# Store
+# =======================
+class CodeStore:
+    def __init__(self, path=DEFAULT_STORE):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.index = {}  # name -> [offset, kind]
+        self.end = 0
+        self.load_index()
+
+    def load_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                saved = json.load(f)
+            self.index, self.end = saved["codes"], saved["end"]
+        except (OSError, ValueError, KeyError):
+            self.index, self.end = {}, 0
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size != self.end:
+            # Index is behind the log (crash between append and index write), scan only the missing tail
+            if size < self.end:
+                self.index, self.end = {}, 0
+            self.scan(self.end)
+            self.save_index()
+
+    def scan(self, offset):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while True:
+                head = f.read(RECORD.size)
+                if len(head) < RECORD.size:
+                    break
+                magic, kind, name_len, payload_len, crc = RECORD.unpack(head)
+                body = f.read(name_len + payload_len)
+                if magic != MAGIC or len(body) < name_len + payload_len or zlib.crc32(body) != crc:
+                    break  # Torn write at the end, later append overwrites it
+                name = body[:name_len].decode()
+                if kind == KIND_DELETED:
+                    self.index.pop(name, None)
+                else:
+                    self.index[name] = [offset, kind]
+                offset += RECORD.size + name_len + payload_len
+        self.end = offset
+
+    def save_index(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"end": self.end, "codes": self.index}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+
+    def _append(self, records):
+        with open(self.path, "ab") as f, profiler.stage("store_append") as st:
+            f.truncate(self.end)  # Drop torn tail if any
+            start = self.end
+            f.seek(self.end)
+            for name, kind, payload in records:
+                name_b = name.encode()
+                body = name_b + payload
+                if kind == KIND_DELETED:
+                    self.index.pop(name, None)
+                else:
+                    self.index[name] = [self.end, kind]
+                f.write(RECORD.pack(MAGIC, kind, len(name_b), len(payload), zlib.crc32(body)) + body)
+                self.end += RECORD.size + len(body)
+            st.nbytes = self.end - start
+            f.flush()
+            os.fsync(f.fileno())
+        self.save_index()
+
+    def names(self):
+        return sorted(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def _read(self, name):
+        offset, kind = self.index[name]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            _, kind, name_len, payload_len, _ = RECORD.unpack(f.read(RECORD.size))
+            f.seek(name_len, os.SEEK_CUR)
+            return kind, f.read(payload_len)
+
+    def get(self, name):
+        # Decoded code comes back as dict, raw code as PulseTrain of signed durations
+        kind, payload = self._read(name)
+        if kind == KIND_DECODED:
+            return json.loads(payload)
+        values = decode_varints(payload)
+        if kind == KIND_RAW_FRAMED:
+            return PulseTrain(values[1 + values[0]:])
+        return PulseTrain(values)
+
+    def frames(self, name):
+        # Frame starts of raw code, None when they were not saved
+        kind, payload = self._read(name)
+        if kind != KIND_RAW_FRAMED:
+            return None
+        values = decode_varints(payload)
+        return values[1:1 + values[0]]
+
+    def put(self, name, code, frames=None):
+        self._append([self._record(name, code, frames)])
+
+    def put_many(self, codes):
+        # [(name, code), ...] or [(name, code, frames), ...]
+        self._append([self._record(*item) for item in codes])
+
+    def _record(self, name, code, frames=None):
+        if isinstance(code, dict):
+            return name, KIND_DECODED, json.dumps(code).encode()
+        code = np.asarray(code)
+        if code.ndim == 2:  # rfrp [[level, duration], ...]
+            code = PulseTrain.from_levels(code)
+        if frames is not None:
+            head = np.concatenate(([len(frames)], np.asarray(frames, dtype=np.int64)))
+            return name, KIND_RAW_FRAMED, encode_varints(head) + encode_varints(code)
+        return name, KIND_RAW, encode_varints(code)
+
+    def delete(self, name):
+        if name in self.index:
+            self._append([(name, KIND_DELETED, b"")])
+
+    def compact(self):
+        # Rewrite only live records, then swap files
+        live = [(name, self.get(name), self.frames(name)) for name in self.names()]
+        before = self.end
+        for leftover in (self.path + ".compact", self.path + ".compact.idx"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        tmp = CodeStore(self.path + ".compact")
+        tmp.put_many(live)
+        os.replace(tmp.path, self.path)
+        os.replace(tmp.index_path, self.index_path)
+        self.load_index()
+        return before, self.end
+
+def signal_pulses(signal):
+    # Saved code is either raw signed durations or decoded frame
+    if isinstance(signal, dict):
+        name = resolve_protocol(signal["protocol"], signal["bit"])
+        return encode_protocol(name, signal["key"], signal.get("te"))
+    return signal
+
+def import_json(store, json_path):
+    with open(json_path, "r") as f:
+        data = json.load(f)
+    store.put_many(sorted(data.items()))
+    return len(data)
+
+def main():
+    args = sys.argv[1:]
+    path = DEFAULT_STORE
+    if "--store" in args:
+        i = args.index("--store")
+        path = args[i + 1]
+        del args[i:i + 2]
+    if not args:
+        print("Usage: python3 code_store.py list|delete NAME|compact|import saved_codes.json [--store saved_codes.db]")
+        sys.exit(1)
+
+    store = CodeStore(path)
+    cmd = args[0]
+    if cmd == "list":
+        for name in store.names():
+            print(name)
+    elif cmd == "delete" and len(args) == 2:
+        if args[1] not in store:
+            print(f"No code named '{args[1]}' found!")
+            sys.exit(1)
+        store.delete(args[1])
+    elif cmd == "compact":
+        before, after = store.compact()
+        print(f"Compacted '{path}' from {before} to {after} bytes")
+    elif cmd == "import" and len(args) == 2:
+        count = import_json(store, args[1])
+        print(f"Imported {count} codes from '{args[1]}' into '{path}'")
+    else:
+        print(f"Unknown command '{' '.join(args)}'")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
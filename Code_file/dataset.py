@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import normalize
+import profiler
+from sub_parser import FlipperSubParser
+from sub_converter import encode_file
+from code_store import CodeStore, signal_pulses
+# Pulse train dataset for analysis outside these scripts (numpy, pandas, SigMF-like tools).
+# Dataset is a directory of flat little-endian column files, one row per pulse, all records appended after
+# each other, and meta.json sidecar with columns and one entry per record (source, offset, count, frequency,
+# preset, protocol, TE ...). Columns open with numpy.memmap, nothing is copied or parsed:
+#   durations.int32   pulse length in uS
+#   levels.uint8      1 high, 0 low (.sub polarity)
+#   timestamps.int64  start of the pulse in uS from start of its record
+# New records are only appended, files longer than meta.json says (interrupted export) are cut back on open.
+# Usage: python3 dataset.py export DATASET sub_dir|file.sub|saved_codes.db[:NAME]|capture.bin [...] [--workers N] [--profile]
+#        python3 dataset.py info DATASET
+
+# ==== CONFIG ====
+DATASET_VERSION = 1
+META_NAME = "meta.json"
+CHUNK_PULSES = 1 << 20  # Captures are streamed in chunks this big
+TE_SAMPLE = 4096        # TE is estimated from the start of a record when file does not give it
+# ================
+
+COLUMNS = {
+    "durations": {"file": "durations.int32", "dtype": "<i4"},
+    "levels": {"file": "levels.uint8", "dtype": "u1"},
+    "timestamps": {"file": "timestamps.int64", "dtype": "<i8"},
+}
+
+# =======================
+# Writing
+# =======================
+class DatasetWriter:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.meta = {"version": DATASET_VERSION, "columns": COLUMNS, "rows": 0, "records": []}
+        try:
+            with open(os.path.join(path, META_NAME), "r") as f:
+                saved = json.load(f)
+            if saved.get("version") == DATASET_VERSION:
+                self.meta = saved
+        except (OSError, ValueError):
+            pass
+        self.files = {}
+        for name, col in COLUMNS.items():
+            f = open(os.path.join(path, col["file"]), "ab")
+            f.truncate(self.meta["rows"] * np.dtype(col["dtype"]).itemsize)  # Rows meta.json does not know about
+            self.files[name] = f
+
+    def append(self, chunks, **info):
+        # chunks: signed trains (+ high, - low, uS) making one record, written as they come
+        offset = count = 0
+        start = self.meta["rows"]
+        first = None
+        with profiler.stage("dataset_append") as st:
+            for chunk in chunks:
+                p = np.asarray(chunk, dtype=np.int64)
+                if len(p) == 0:
+                    continue
+                if first is None:
+                    first = p[:TE_SAMPLE]
+                d = np.abs(p)
+                stamps = offset + np.concatenate(([0], np.cumsum(d)[:-1]))
+                self.files["durations"].write(d.astype("<i4").tobytes())
+                self.files["levels"].write((p > 0).astype("u1").tobytes())
+                self.files["timestamps"].write(stamps.astype("<i8").tobytes())
+                offset += int(d.sum())
+                count += len(p)
+            st.pulses = count
+        if info.get("te") is None and first is not None:
+            info["te"] = normalize.estimate_te(first)
+        record = dict(info, offset=start, count=count, airtime_us=offset)
+        self.meta["rows"] += count
+        self.meta["records"].append(record)
+        return record
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        path = os.path.join(self.path, META_NAME)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.meta, f)
+        os.replace(path + ".tmp", path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# =======================
+# Reading
+# =======================
+def open_dataset(path):
+    # (columns {name: numpy.memmap}, records), record i is columns[...][offset:offset + count]
+    with open(os.path.join(path, META_NAME), "r") as f:
+        meta = json.load(f)
+    columns = {}
+    for name, col in meta["columns"].items():
+        dtype = np.dtype(col["dtype"])
+        if meta["rows"] == 0:
+            columns[name] = np.empty(0, dtype=dtype)
+        else:
+            columns[name] = np.memmap(os.path.join(path, col["file"]), dtype=dtype, mode="r", shape=(meta["rows"],))
+    return columns, meta["records"]
+
+def record_pulses(columns, record):
+    # Signed train of one record (view arithmetic, only this record is read)
+    sl = slice(record["offset"], record["offset"] + record["count"])
+    d = columns["durations"][sl]
+    return np.where(columns["levels"][sl] == 1, d, -d)
+
+# =======================
+# Sources
+# =======================
+def _int(text):
+    try:
+        return int(text)
+    except (TypeError, ValueError):
+        return None
+
+def sub_record(path):
+    # .sub file -> (info, chunks), RAW blocks as they are in the file, protocol files encoded like sub_converter does
+    parser = FlipperSubParser(path)
+    meta = parser.meta
+    info = {
+        "source": path,
+        "kind": "sub",
+        "frequency": _int(meta.get("Frequency")),
+        "preset": meta.get("Preset"),
+        "protocol": meta.get("Protocol", "RAW"),
+        "bit": _int(meta.get("Bit")),
+        "te": _int(meta.get("TE")),
+        "key": meta.get("Key"),
+    }
+    if info["protocol"] == "RAW":
+        return info, parser.iter_blocks()
+    return info, [encode_file(parser)]
+
+def _convert_sub(path):
+    # Worker: whole file as one int32 array, so only finished records travel back
+    try:
+        info, chunks = sub_record(path)
+        chunks = [np.asarray(c, dtype=np.int32) for c in chunks]
+        return info, np.concatenate(chunks) if chunks else np.empty(0, np.int32)
+    except Exception as e:
+        return {"source": path, "error": str(e)}, None
+
+def export_subs(writer, paths, workers=None):
+    # Parallel parse, records are appended in path order, at most 2 x workers files are in memory at once
+    counts = {"added": 0, "failed": 0}
+    window = 2 * (workers or os.cpu_count() or 1)
+    pending = deque()
+
+    def take():
+        info, pulses = pending.popleft().result()
+        if pulses is None:
+            print(f"Skipped {info['source']}: {info['error']}")
+            counts["failed"] += 1
+        else:
+            writer.append([pulses], **info)
+            counts["added"] += 1
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path in paths:
+            pending.append(pool.submit(_convert_sub, path))
+            if len(pending) >= window:
+                take()
+        while pending:
+            take()
+    return counts["added"], counts["failed"]
+
+def store_records(path):
+    # Codes of saved_codes.db (or saved_codes.db:NAME), raw codes are turned to .sub polarity
+    name = None
+    if not os.path.exists(path) and ":" in path:
+        path, name = path.rsplit(":", 1)
+    store = CodeStore(path)
+    for code_name in ([name] if name else store.names()):
+        code = store.get(code_name)
+        info = {"source": f"{path}:{code_name}", "kind": "store"}
+        if isinstance(code, dict):
+            info.update(protocol=code["protocol"], bit=code["bit"], te=code.get("te"), key=code["key"])
+            yield info, [signal_pulses(code)]
+        else:
+            frames = store.frames(code_name)
+            info["frames"] = None if frames is None else frames.tolist()
+            yield info, [-np.asarray(code)]
+
+def capture_chunks(path):
+    # rfrp --bulk --out file (int32, + when line went high after the duration), read in chunks
+    data = np.memmap(path, dtype="<i4", mode="r") if os.path.getsize(path) else np.empty(0, np.int32)
+    for i in range(0, len(data), CHUNK_PULSES):
+        yield -np.asarray(data[i:i + CHUNK_PULSES], dtype=np.int32)
+
+def is_store(path):
+    base = path.rsplit(":", 1)[0] if not os.path.exists(path) else path
+    return os.path.exists(base + ".idx") or base.endswith(".db")
+
+def export(dataset_path, sources, workers=None):
+    with DatasetWriter(dataset_path) as writer:
+        added = failed = 0
+        for source in sources:
+            if os.path.isdir(source):
+                paths = sorted(os.path.join(root, f) for root, _, files in os.walk(source) for f in files if f.endswith(".sub"))
+                a, b = export_subs(writer, paths, workers)
+                added, failed = added + a, failed + b
+            elif source.endswith(".sub"):
+                info, chunks = sub_record(source)
+                writer.append(chunks, **info)
+                added += 1
+            elif is_store(source):
+                for info, chunks in store_records(source):
+                    writer.append(chunks, **info)
+                    added += 1
+            else:
+                writer.append(capture_chunks(source), source=source, kind="capture")
+                added += 1
+        rows = writer.meta["rows"]
+    return added, failed, rows
+
+def main():
+    profiler.take_flag(sys.argv)
+    args = sys.argv[1:]
+    workers = None
+    if "--workers" in args:
+        i = args.index("--workers")
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+    if len(args) < 2 or args[0] not in ("export", "info") or (args[0] == "export" and len(args) < 3):
+        print("Usage: python3 dataset.py export DATASET sub_dir|file.sub|saved_codes.db[:NAME]|capture.bin [...] [--workers N] [--profile]")
+        print("       python3 dataset.py info DATASET")
+        sys.exit(1)
+
+    if args[0] == "export":
+        try:
+            added, failed, rows = export(args[1], args[2:], workers)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Export failed: {e}")
+            sys.exit(1)
+        print(f"Exported {added} records ({failed} skipped), '{args[1]}' has {rows} pulses")
+        return
+
+    try:
+        columns, records = open_dataset(args[1])
+    except (OSError, ValueError) as e:
+        print(f"Cannot open dataset '{args[1]}': {e}")
+        sys.exit(1)
+    airtime = sum(r["airtime_us"] for r in records)
+    print(f"{len(records)} records, {len(columns['durations'])} pulses, {airtime / 1e6:.1f} s airtime")
+    kinds = {}
+    for r in records:
+        kinds[r.get("kind")] = kinds.get(r.get("kind"), 0) + 1
+    print(", ".join(f"{count} {kind}" for kind, count in sorted(kinds.items(), key=lambda kv: str(kv[0]))))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import profiler
+from sub_converter import PROTOCOLS, CAME_VARIANTS
+# Streaming decoder, inverse of encode_protocol. Edges are fed one by one as they come from pigpio,
+# frames are cut at long low gaps and only then matched against PROTOCOLS, so per edge cost is just an append.
+
+# ==== CONFIG ====
+GAP_MIN_US = 5000        # Low longer than this ends a frame
+GAP_MIN_UNITS = 8        # Protocol needs a low of at least this many TE between frames to be decodable
+DEFAULT_TOLERANCE = 0.35 # Allowed relative timing error per element, PROTOCOLS entry can set its own "tolerance"
+# ================
+
+FILE_NAMES = {name: "CAME" for name in CAME_VARIANTS.values()}
+
+def _merge(units):
+    merged = []
+    for u in units:
+        if merged and (u > 0) == (merged[-1] > 0):
+            merged[-1] += u
+        else:
+            merged.append(u)
+    return merged
+
+class FrameTemplate:
+    # Frame as receiver sees it between two gaps: lead (rest of header), bits, tail (stop before gap)
+    def __init__(self, name, proto_def):
+        self.name = name
+        self.file_name = FILE_NAMES.get(name, name)
+        self.short = proto_def["short"]
+        self.bit_len = proto_def["bit_len"]
+        self.tolerance = proto_def.get("tolerance", DEFAULT_TOLERANCE)
+        self.bits = [[v for seg in proto_def["bit_map"][b] for v in seg] for b in "01"]
+
+        # Stop of one frame and header of the next one merge on air, longest low in between is the gap
+        junction = _merge([v for seg in proto_def.get("stop", []) + proto_def.get("header", []) for v in seg])
+        lows = [i for i, u in enumerate(junction) if u < 0]
+        gap_idx = min(lows, key=lambda i: junction[i]) if lows else None
+        if gap_idx is None or -junction[gap_idx] < GAP_MIN_UNITS:
+            raise ValueError(f"{name} has no gap between frames")
+        self.gap = -junction[gap_idx]
+        self.tail = junction[:gap_idx]
+        self.lead = junction[gap_idx + 1:]
+
+        bit_start, bit_end = self.bits[0][0], self.bits[0][-1]
+        if any((b[0] > 0) != (bit_start > 0) or (b[-1] > 0) != (bit_end > 0) for b in self.bits):
+            raise ValueError(f"{name} bit patterns do not start and end with same level")
+        if (self.lead and (self.lead[-1] > 0) == (bit_start > 0)) or (not self.lead and bit_start < 0):
+            raise ValueError(f"{name} first bit merges with header")
+        if self.tail and (self.tail[0] > 0) == (bit_end > 0):
+            raise ValueError(f"{name} last bit merges with stop")
+        # Last bit ending low right before the gap loses its last element into the gap
+        self.absorbed = not self.tail and bit_end < 0
+
+        self.seg_len = len(self.bits[0])
+        self.length = len(self.lead) + self.bit_len * self.seg_len - self.absorbed + len(self.tail)
+        self.bit_units = sum(abs(v) for v in self.bits[0])
+        self.fixed_units = sum(abs(v) for v in self.lead + self.tail)
+
+    def match(self, core, gap_us):
+        # Returns (score, frame) or None, lower score is better
+        lead_len = len(self.lead)
+        full_bits = self.bit_len - self.absorbed
+        units = self.fixed_units + full_bits * self.bit_units
+        body_end = lead_len + full_bits * self.seg_len
+        measured = sum(abs(d) for d in core[:body_end]) + sum(abs(d) for d in core[len(core) - len(self.tail):] if self.tail)
+        te = measured / units
+        if not 0.6 * self.short <= te <= 1.6 * self.short or gap_us < 0.5 * self.gap * te:
+            return None
+
+        tol = self.tolerance
+        error = 0.0
+
+        def element_error(d, unit):
+            if (d > 0) != (unit > 0):
+                return None
+            return abs(abs(d) / te - abs(unit)) / abs(unit)
+
+        for d, unit in zip(core[:lead_len], self.lead):
+            e = element_error(d, unit)
+            if e is None or e > tol:
+                return None
+            error += e
+        for d, unit in zip(core[len(core) - len(self.tail):] if self.tail else [], self.tail):
+            e = element_error(d, unit)
+            if e is None or e > tol:
+                return None
+            error += e
+
+        key = 0
+        pos = lead_len
+        for i in range(self.bit_len):
+            # Absorbed last bit is decided by its first element only
+            seg = core[pos:pos + self.seg_len] if i < full_bits else core[pos:pos + self.seg_len - 1]
+            best = None
+            for value, pattern in enumerate(self.bits):
+                e = 0.0
+                for d, unit in zip(seg, pattern):
+                    el = element_error(d, unit)
+                    if el is None:
+                        e = None
+                        break
+                    e = max(e, el)
+                if e is not None and (best is None or e < best[0]):
+                    best = (e, value)
+            if best is None or best[0] > tol:
+                return None
+            error += best[0]
+            key = (key << 1) | best[1]
+            pos += self.seg_len
+
+        score = error / max(1, self.length) + abs(te / self.short - 1) * 0.1 + abs(gap_us / te - self.gap) / self.gap * 0.05
+        frame = {
+            "protocol": self.file_name,
+            "key": " ".join(f"{b:02X}" for b in key.to_bytes(8, "big")),
+            "bit": self.bit_len,
+            "te": round(te),
+        }
+        return score, frame
+
+def build_templates(protocols=PROTOCOLS):
+    by_length = {}
+    for name, proto_def in protocols.items():
+        try:
+            template = FrameTemplate(name, proto_def)
+        except ValueError:
+            continue  # Protocol without gap (Honeywell, SMC5326) cannot be framed this way
+        by_length.setdefault(template.length, []).append(template)
+    return by_length
+
+class ProtocolDecoder:
+    def __init__(self, protocols=PROTOCOLS, gap_min_us=GAP_MIN_US):
+        self.templates = build_templates(protocols)
+        self.max_len = max(self.templates) if self.templates else 0
+        self.gap_min_us = gap_min_us
+        self.core = []
+        self.overflow = False
+        self.frames = []
+        self.edges = 0
+
+    def feed(self, level, duration):
+        # pigpio callback order: line changed to level after being at the other level for duration
+        self.edges += 1
+        if level:
+            if duration >= self.gap_min_us:
+                return self._end_frame(duration)
+            duration = -duration
+        if self.overflow:
+            return None
+        core = self.core
+        core.append(duration)
+        if len(core) > self.max_len:
+            self.overflow = True  # Noise burst, nothing to decode until next gap
+            core.clear()
+        return None
+
+    def feed_many(self, pairs):
+        found = []
+        with profiler.stage("decode") as st:
+            edges = self.edges
+            for level, duration in pairs:
+                frame = self.feed(level, duration)
+                if frame:
+                    found.append(frame)
+            st.pulses = self.edges - edges
+        return found
+
+    def _end_frame(self, gap_us):
+        core = self.core
+        self.core = []
+        overflow, self.overflow = self.overflow, False
+        if overflow or not core:
+            return None
+        best = None
+        for template in self.templates.get(len(core), ()):
+            result = template.match(core, gap_us)
+            if result and (best is None or result[0] < best[0]):
+                best = result
+        if best is None:
+            return None
+        self.frames.append(best[1])
+        return best[1]
+
+def most_common(frames):
+    # Most repeated decoded frame and how many times it was seen
+    counts = {}
+    for frame in frames:
+        key = (frame["protocol"], frame["key"], frame["bit"])
+        counts.setdefault(key, []).append(frame)
+    if not counts:
+        return None, 0
+    seen = max(counts.values(), key=len)
+    frame = dict(seen[0])
+    frame["te"] = round(sum(f["te"] for f in seen) / len(seen))
+    return frame, len(seen)
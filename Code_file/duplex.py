@@ -0,0 +1,219 @@
+import sys
+import json
+import time
+import numpy as np
+import pigpio
+import profiler
+import framerepeat
+import fidelity
+import normalize
+import txd
+from capture import BulkCapture
+from waveform import CountingPi, pi_clock
+from fingerprint import load_source
+# Full-duplex TX/RX session on one pigpio connection: bulk capture runs on RX gpio (and on TX gpio, which gives
+# exact tick the transmission started) while pulse train is sent on TX gpio. Every round trip returns captured
+# edges with times from TX start, soak() repeats it and checks every capture with fidelity.analyse().
+# Without a Pi: python3 fake_pigpio.py 8889 --wire 13:25, then PIGPIO_PORT=8889 python3 duplex.py ...
+# Usage: python3 duplex.py file.sub|saved_codes.db:NAME [--tx 13] [--rx 25] [--rounds 10] [--repeat 1]
+#        [--pause-ms 200] [--glitch US] [--json] [--profile]
+
+# ==== CONFIG ====
+TX_GPIO = 13
+RX_GPIO = 25
+TAIL_MS = 50            # Capture keeps running this long after transmission (receiver latency)
+POLL_S = 0.02
+PAUSE_MS = 200          # Between soak rounds
+MIN_MATCHED = 0.9       # Round fails when smaller share of sent edges is received
+# ================
+
+def capture_pulses(levels, offsets, end_us):
+    # Edges (level after, uS from TX start) -> signed train from TX start to end_us in .sub polarity (+ high)
+    if len(levels) == 0:
+        return np.empty(0, dtype=np.int32)
+    d = np.diff(np.concatenate(([0], offsets, [max(end_us, offsets[-1])]))).astype(np.int32)
+    return normalize.merge_same_sign(np.where(np.concatenate((levels, [1 - levels[-1]])) == 0, d, -d))
+
+def lead_us(pulses):
+    # Time from start of the train to its first rising edge (pin is low before sending)
+    p = np.asarray(pulses, dtype=np.int64)
+    high = np.flatnonzero(p > 0)
+    return int(np.abs(p[:high[0]]).sum()) if len(high) else 0
+
+class DuplexSession:
+    def __init__(self, pi, tx_gpio=TX_GPIO, rx_gpio=RX_GPIO, glitch_us=0):
+        self.pi = pi
+        self.tx_gpio = tx_gpio
+        self.rx_gpio = rx_gpio
+        self.glitch_us = glitch_us
+        self.rx = None
+        self.tx = None
+
+    def open(self):
+        self.pi.set_mode(self.tx_gpio, pigpio.OUTPUT)
+        self.pi.write(self.tx_gpio, 0)
+        self.pi.set_mode(self.rx_gpio, pigpio.INPUT)
+        if self.glitch_us:
+            self.pi.set_glitch_filter(self.rx_gpio, self.glitch_us)
+        self.rx = BulkCapture(self.pi, self.rx_gpio, prime=True)
+        self.tx = BulkCapture(self.pi, self.tx_gpio, prime=True)
+        self.rx.start()
+        self.tx.start()
+        return self
+
+    def close(self):
+        for cap in (self.rx, self.tx):
+            if cap is not None:
+                cap.stop()
+        self.rx = self.tx = None
+        if self.glitch_us:
+            self.pi.set_glitch_filter(self.rx_gpio, 0)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, timeout=0):
+        # New RX and TX edges as (levels, ticks) pairs
+        rx_levels, _, rx_ticks = self.rx.read(timeout)
+        tx_levels, _, tx_ticks = self.tx.read(0)
+        return (rx_levels, rx_ticks), (tx_levels, tx_ticks)
+
+    def drain(self):
+        # Edges seen between round trips (noise, tail of last one) are thrown away
+        while True:
+            (rx_levels, _), (tx_levels, _) = self.read(0)
+            if len(rx_levels) == 0 and len(tx_levels) == 0:
+                return
+
+    def round_trip(self, pulses, repeat=1, tail_ms=TAIL_MS):
+        # Sends pulses (+ high, uS) and returns what RX gpio saw from TX start tick:
+        # {"start_tick", "levels", "offsets" (uS from start), "pulses" (.sub polarity), "tx_edges", "plan"}
+        layout = framerepeat.split(pulses)
+        if not framerepeat.fits(self.pi, layout):
+            raise ValueError("pulse train does not fit into pigpiod wave memory")
+        self.drain()
+        rx_parts, tx_parts = [], []
+        clock = pi_clock(self.pi)
+        with profiler.stage("round_trip", pulses=len(pulses) * max(1, repeat)):
+            before = self.pi.get_current_tick()
+            plan = framerepeat.start(self.pi, self.tx_gpio, layout, repeat)
+            end = plan["started"] + plan["airtime_us"] / 1e6 + tail_ms / 1000
+            while True:
+                left = end - clock.monotonic()
+                rx, tx = self.read(max(0.0, min(POLL_S, left)))
+                rx_parts.append(rx)
+                tx_parts.append(tx)
+                if left <= 0:
+                    break
+            framerepeat.finish(self.pi, self.tx_gpio, plan)
+
+        tx_ticks = np.concatenate([t for _, t in tx_parts])
+        if len(tx_ticks):
+            start_tick = (int(tx_ticks[0]) - lead_us(pulses)) & 0xFFFFFFFF
+        else:
+            start_tick = before  # TX gpio not reported, tick read before sending is close
+        levels = np.concatenate([l for l, _ in rx_parts])
+        offsets = ((np.concatenate([t for _, t in rx_parts]) - np.uint32(start_tick)) & 0xFFFFFFFF).astype(np.int64)
+        offsets[offsets >= 1 << 31] -= 1 << 32  # Edges just before start
+        keep = offsets >= 0
+        levels, offsets = levels[keep], offsets[keep]
+        return {
+            "start_tick": start_tick,
+            "levels": levels,
+            "offsets": offsets,
+            "pulses": capture_pulses(levels, offsets, plan["airtime_us"] + tail_ms * 1000),
+            "tx_edges": len(tx_ticks),
+            "plan": plan,
+        }
+
+def soak(session, pulses, rounds, repeat=1, pause_ms=PAUSE_MS, on_round=None):
+    # Round trips in a row, every capture compared with what was sent. Returns (results, summary)
+    reference = normalize.merge_same_sign(np.tile(np.asarray(pulses), max(1, repeat)))
+    results = []
+    for i in range(rounds):
+        trip = session.round_trip(pulses, repeat)
+        if len(trip["pulses"]):
+            result, _, _ = fidelity.analyse(reference, trip["pulses"], lag=0)  # Capture starts at TX start
+        else:
+            result = {"reference_edges": len(reference), "capture_edges": 0, "matched": 0, "dropped": len(reference), "extra": 0}
+        result.update(round=i + 1, start_tick=trip["start_tick"], tx_edges=trip["tx_edges"],
+                      ok=result["matched"] >= MIN_MATCHED * result["reference_edges"])
+        results.append(result)
+        if on_round:
+            on_round(result)
+        if i + 1 < rounds:
+            time.sleep(pause_ms / 1000)
+    return results, summarize(results)
+
+def summarize(results):
+    jitter = [r["jitter_us"] for r in results if "jitter_us" in r]
+    lags = [r["lag_us"] for r in results if "lag_us" in r]
+    return {
+        "rounds": len(results),
+        "failed": sum(not r["ok"] for r in results),
+        "dropped": sum(r["dropped"] for r in results),
+        "extra": sum(r["extra"] for r in results),
+        "jitter_mean_us": round(float(np.mean(jitter)), 2) if jitter else None,
+        "jitter_max_us": max(jitter) if jitter else None,
+        "lag_min_us": min(lags) if lags else None,
+        "lag_max_us": max(lags) if lags else None,
+    }
+
+def round_text(r):
+    text = f"Round {r['round']}: {r['matched']}/{r['reference_edges']} edges, {r['dropped']} dropped, {r['extra']} extra"
+    if "jitter_us" in r:
+        text += f", lag {r['lag_us']} uS, jitter {r['jitter_us']} uS"
+    return text + ("" if r["ok"] else " FAILED")
+
+def main():
+    profiler.take_flag(sys.argv)
+    args = sys.argv[1:]
+    opts = {"--tx": TX_GPIO, "--rx": RX_GPIO, "--rounds": 10, "--repeat": 1, "--pause-ms": PAUSE_MS, "--glitch": 0}
+    for opt in opts:
+        if opt in args:
+            i = args.index(opt)
+            opts[opt] = int(args[i + 1])
+            del args[i:i + 2]
+    as_json = "--json" in args
+    args = [a for a in args if a != "--json"]
+    if len(args) != 1:
+        print("Usage: python3 duplex.py file.sub|saved_codes.db:NAME [--tx 13] [--rx 25] [--rounds 10] [--repeat 1]")
+        print("       [--pause-ms 200] [--glitch US] [--json] [--profile]")
+        sys.exit(1)
+    try:
+        pulses = load_source(args[0])
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Cannot load '{args[0]}': {e}")
+        sys.exit(1)
+
+    if txd.refuse_if_running():
+        sys.exit(1)
+    pi = CountingPi(pigpio.pi())
+    if not pi.connected:
+        print("Cannot connect to pigpiod!")
+        sys.exit(1)
+    show = (lambda r: print(json.dumps(r))) if as_json else (lambda r: print(round_text(r)))
+    if not as_json:
+        print(f"Sending {len(pulses)} pulses on GPIO {opts['--tx']}, receiving on GPIO {opts['--rx']}, {opts['--rounds']} rounds")
+    try:
+        with DuplexSession(pi, opts["--tx"], opts["--rx"], opts["--glitch"]) as session:
+            _, summary = soak(session, pulses, opts["--rounds"], opts["--repeat"], opts["--pause-ms"], show)
+    except KeyboardInterrupt:
+        print("\nStopped.")
+        return
+    except ValueError as e:
+        print(f"Cannot send: {e}")
+        sys.exit(1)
+    finally:
+        pi.stop()
+    if as_json:
+        print(json.dumps({"summary": summary}))
+    else:
+        print(f"{summary['rounds']} rounds, {summary['failed']} failed, {summary['dropped']} dropped and {summary['extra']} extra edges, "
+              f"jitter {summary['jitter_mean_us']} uS mean / {summary['jitter_max_us']} uS max, lag {summary['lag_min_us']}..{summary['lag_max_us']} uS")
+
+if __name__ == "__main__":
+    main()
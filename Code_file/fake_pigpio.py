@@ -0,0 +1,540 @@
+import sys
+import time
+import queue
+import struct
+import socketserver
+import threading
+import numpy as np
+import pigpio
+from waveform import compile_pulses
+from capture import REPORT
+# Fake pigpio for running the scripts without a Raspberry Pi.
+# FakePi can be used instead of pigpio.pi(), FakePigpiod speaks pigpiod socket protocol,
+# so real pigpio.pi("localhost", port) (and our packed wave upload) can talk to it.
+# Wave memory limits are enforced like in pigpiod and everything sent is kept as uS timeline,
+# with VirtualClock waiting for transmissions takes no real time (benchmarks, checks).
+# Usage: python3 fake_pigpio.py [port] [--wire TX:RX ...]
+
+# ==== CONFIG ====
+DEFAULT_PORT = 8889
+MAX_WAVE_PULSES = 12000
+MAX_WAVE_CBS = 25016
+MAX_WAVE_MICROS = 30 * 60 * 1000000
+MAX_WAVES = 250
+CBS_PER_PULSE = 2  # Control blocks one pulse takes from pigpiod wave memory (gpio on/off + delay)
+# ================
+
+class FakeError(pigpio.error):
+    # Raised like real pigpio does, code is what pigpiod would return
+    def __init__(self, code):
+        super().__init__(pigpio.error_text(code))
+        self.code = code
+
+class VirtualClock:
+    # Stands in for time module, sleep only moves the clock, so long transmissions take no real time
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+class FakeCallback:
+    # Same interface as pigpio callback object
+    def __init__(self, pi, gpio, edge, func):
+        self.pi = pi
+        self.gpio = gpio
+        self.edge = edge
+        self.func = func or self._tally
+        self.count = 0
+
+    def _tally(self, gpio, level, tick):
+        self.count += 1
+
+    def tally(self):
+        return self.count
+
+    def reset_tally(self):
+        self.count = 0
+
+    def cancel(self):
+        if self in self.pi.callbacks:
+            self.pi.callbacks.remove(self)
+
+class FakeNotifier:
+    # In-band notification (NOIB) of one client socket, reports are written by own thread,
+    # so daemon never waits for a client that is busy sending commands
+    def __init__(self, sock=None):
+        self.sock = sock
+        self.bits = 0
+        self.seqno = 0
+        self.queue = queue.Queue()
+        if sock is not None:
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def report(self, ticks, words):
+        reports = np.zeros(len(ticks), dtype=REPORT)
+        reports["seqno"] = (self.seqno + np.arange(len(ticks))) & 0xFFFF
+        reports["tick"] = ticks & 0xFFFFFFFF
+        reports["level"] = words
+        self.seqno = (self.seqno + len(ticks)) & 0xFFFF
+        self.queue.put(reports.tobytes())
+
+    def _run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            try:
+                self.sock.sendall(data)
+            except OSError:
+                return
+
+    def close(self):
+        self.queue.put(None)
+
+class FakePi:
+    def __init__(self, clock=None):
+        self.connected = True
+        self.clock = clock or time
+        self.t0 = self.clock.monotonic()
+        self.modes = {}
+        self.levels = {}
+        self.waves = {}
+        self.pending = np.empty((0, 3), dtype=np.uint32)
+        self.busy_until = 0.0
+        self.schedule = []  # (start, end, wave id) of waves sent with wave_send_*, for wave_tx_at
+        self.emitted = []   # (start uS, pulses) of everything put on the pins, see timeline()
+        self.callbacks = []
+        self.wires = {}     # tx gpio -> rx gpios seeing the same edges (loopback)
+        self.glitch = {}    # gpio -> glitch filter steady time (uS)
+        self.noise = {}     # gpio -> (steady, active), only remembered
+        self.notifiers = {} # handle -> FakeNotifier, reports of level changes go to socket clients
+        self.lock = threading.Lock()
+
+    # ===== GPIO =====
+    def set_mode(self, gpio, mode):
+        self.modes[gpio] = mode
+        return 0
+
+    def get_mode(self, gpio):
+        return self.modes.get(gpio, pigpio.INPUT)
+
+    def write(self, gpio, level):
+        if self.levels.get(gpio, 0) != level:
+            # Level change is reported like any other (callbacks, notifications, loopback)
+            mask = 1 << gpio
+            self._emit(self.clock.monotonic(), [np.array([[mask if level else 0, 0 if level else mask, 0]], dtype=np.uint32)])
+        self.levels[gpio] = level
+        return 0
+
+    def read(self, gpio):
+        return self.levels.get(gpio, 0)
+
+    def set_glitch_filter(self, user_gpio, steady):
+        self.glitch[user_gpio] = steady
+        return 0
+
+    def set_noise_filter(self, user_gpio, steady, active):
+        self.noise[user_gpio] = (steady, active)
+        return 0
+
+    # ===== Notifications =====
+    def notify_open_inband(self, sock):
+        handle = next(i for i in range(len(self.notifiers) + 1) if i not in self.notifiers)
+        self.notifiers[handle] = FakeNotifier(sock)
+        return handle
+
+    def notify_begin(self, handle, bits):
+        if handle not in self.notifiers:
+            raise FakeError(pigpio.PI_BAD_HANDLE)
+        self.notifiers[handle].bits = bits
+        return 0
+
+    def notify_close(self, handle):
+        notifier = self.notifiers.pop(handle, None)
+        if notifier is None:
+            raise FakeError(pigpio.PI_BAD_HANDLE)
+        notifier.close()
+        return 0
+
+    def get_current_tick(self):
+        return self.micros() & 0xFFFFFFFF
+
+    def micros(self, at=None):
+        # Simulation time in uS since this FakePi was made
+        return int(round(((self.clock.monotonic() if at is None else at) - self.t0) * 1e6))
+
+    # ===== Callbacks and timeline =====
+    def callback(self, user_gpio, edge=pigpio.RISING_EDGE, func=None):
+        # Edges are delivered as soon as a wave is sent (with their future ticks), not in real time
+        cb = FakeCallback(self, user_gpio, edge, func)
+        self.callbacks.append(cb)
+        return cb
+
+    def wire(self, tx_gpio, rx_gpio):
+        # Everything sent on tx_gpio also shows up on rx_gpio, like receiver next to transmitter
+        self.wires.setdefault(tx_gpio, set()).add(rx_gpio)
+
+    def play(self, gpio, pulses, at=None):
+        # Simulated incoming signal (signed durations) on gpio, starting now
+        self._emit(self.clock.monotonic() if at is None else at, [compile_pulses(pulses, gpio)])
+
+    def _emit(self, start, waves):
+        start_us = self.micros(start)
+        for wave in waves:
+            if len(wave) == 0:
+                continue
+            self.emitted.append((start_us, wave))
+            for gpio in self._touched(wave):
+                ticks, levels = level_changes(start_us, wave, gpio, self.levels.get(gpio, 0))
+                if len(levels):
+                    self.levels[gpio] = int(levels[-1])
+                self._notify(gpio, ticks, levels)
+                for rx in self.wires.get(gpio, ()):
+                    self.levels[rx] = self.levels[gpio]
+                    self._notify(rx, ticks, levels)
+            start_us += int(wave[:, 2].sum(dtype=np.uint64))
+
+    def _touched(self, wave):
+        mask = int(np.bitwise_or.reduce(wave[:, 0] | wave[:, 1]))
+        return [g for g in range(32) if mask >> g & 1]
+
+    def _notify(self, gpio, ticks, levels):
+        steady = self.glitch.get(gpio, 0)
+        if steady and len(ticks):
+            # Level has to stay for steady uS to be reported, short pulses vanish with the edges around them
+            stable = np.append(np.diff(ticks) >= steady, True)
+            ticks, levels = ticks[stable], levels[stable]
+            keep = np.append(True, np.diff(levels.astype(np.int8)) != 0)
+            ticks, levels = ticks[keep], levels[keep]
+        for notifier in list(self.notifiers.values()):
+            if notifier.bits >> gpio & 1 and len(ticks):
+                # Level word has other watched gpios at their current level
+                rest = sum(level << g for g, level in self.levels.items() if g != gpio and notifier.bits >> g & 1)
+                notifier.report(ticks, rest | (levels.astype(np.uint32) << gpio))
+        for cb in list(self.callbacks):
+            if cb.gpio != gpio:
+                continue
+            for tick, level in zip(ticks.tolist(), levels.tolist()):
+                if cb.edge == pigpio.EITHER_EDGE or cb.edge == (pigpio.FALLING_EDGE if level == 0 else pigpio.RISING_EDGE):
+                    cb.func(gpio, level, tick & 0xFFFFFFFF)
+
+    def timeline(self, gpio):
+        # (ticks uS since start, levels) of every level change on gpio
+        ticks, levels = [], []
+        level = 0
+        for start_us, wave in self.emitted:
+            t, l = level_changes(start_us, wave, gpio, level)
+            if len(l):
+                level = int(l[-1])
+            ticks.append(t)
+            levels.append(l)
+        if not ticks:
+            return np.empty(0, np.int64), np.empty(0, np.uint8)
+        return np.concatenate(ticks), np.concatenate(levels)
+
+    # ===== Waves =====
+    def wave_clear(self):
+        self.waves.clear()
+        self.pending = np.empty((0, 3), dtype=np.uint32)
+        return 0
+
+    def wave_add_new(self):
+        self.pending = np.empty((0, 3), dtype=np.uint32)
+        return 0
+
+    def wave_add_generic(self, pulses):
+        data = b"".join(struct.pack("III", p.gpio_on, p.gpio_off, p.delay) for p in pulses)
+        return self.wave_add_packed(data)
+
+    def wave_add_packed(self, data):
+        added = np.frombuffer(bytes(data), dtype=np.uint32).reshape(-1, 3)
+        merged = merge_pulses(self.pending, added) if len(self.pending) else added.copy()
+        if len(merged) > MAX_WAVE_PULSES:
+            raise FakeError(pigpio.PI_TOO_MANY_PULSES)
+        self.pending = merged
+        return len(merged)
+
+    def wave_create(self):
+        if len(self.waves) >= MAX_WAVES:
+            raise FakeError(pigpio.PI_NO_WAVEFORM_ID)
+        used = sum(len(w) for w in self.waves.values()) * CBS_PER_PULSE
+        if used + len(self.pending) * CBS_PER_PULSE > MAX_WAVE_CBS:
+            raise FakeError(pigpio.PI_TOO_MANY_CBS)
+        wave_id = next(i for i in range(MAX_WAVES + 1) if i not in self.waves)
+        self.waves[wave_id] = self.pending
+        self.pending = np.empty((0, 3), dtype=np.uint32)
+        return wave_id
+
+    def wave_delete(self, wave_id):
+        if wave_id not in self.waves:
+            raise FakeError(pigpio.PI_BAD_WAVE_ID)
+        del self.waves[wave_id]
+        return 0
+
+    def wave_micros(self, wave_id):
+        return int(self._wave(wave_id)[:, 2].sum(dtype=np.uint64))
+
+    def _wave(self, wave_id):
+        if wave_id not in self.waves:
+            raise FakeError(pigpio.PI_BAD_WAVE_ID)
+        return self.waves[wave_id]
+
+    def _start(self, micros, wave_id=None):
+        now = self.clock.monotonic()
+        self.busy_until = now + micros / 1e6
+        self.schedule = [(now, self.busy_until, wave_id)]
+
+    def wave_send_once(self, wave_id):
+        wave = self._wave(wave_id)
+        self._start(self.wave_micros(wave_id), wave_id)
+        self._emit(self.schedule[0][0], [wave])
+        return len(wave)
+
+    def wave_send_repeat(self, wave_id):
+        # Recorded in timeline once
+        wave = self._wave(wave_id)
+        self._start(float("inf"), wave_id)
+        self._emit(self.schedule[0][0], [wave])
+        return len(wave)
+
+    def wave_send_using_mode(self, wave_id, mode):
+        now = self.clock.monotonic()
+        if mode in (pigpio.WAVE_MODE_ONE_SHOT, pigpio.WAVE_MODE_REPEAT) or now >= self.busy_until:
+            if mode in (pigpio.WAVE_MODE_REPEAT, pigpio.WAVE_MODE_REPEAT_SYNC):
+                return self.wave_send_repeat(wave_id)
+            return self.wave_send_once(wave_id)
+        # Sync mode starts after current wave ends
+        wave = self._wave(wave_id)
+        start = self.busy_until
+        micros = float("inf") if mode == pigpio.WAVE_MODE_REPEAT_SYNC else self.wave_micros(wave_id)
+        self.busy_until = start + micros / 1e6
+        self.schedule = [s for s in self.schedule if s[1] > now] + [(start, self.busy_until, wave_id)]
+        self._emit(start, [wave])
+        return len(wave)
+
+    def wave_chain(self, data):
+        data = bytes(data)
+        micros = chain_micros(data, self.wave_micros)
+        self._start(micros)
+        self._emit(self.schedule[0][0], chain_waves(data, self._wave))
+        return 0
+
+    def wave_tx_at(self):
+        now = self.clock.monotonic()
+        for start, end, wave_id in self.schedule:
+            if start <= now < end:
+                return pigpio.WAVE_NOT_FOUND if wave_id is None else wave_id
+        return pigpio.NO_TX_WAVE
+
+    def wave_tx_busy(self):
+        return 1 if self.clock.monotonic() < self.busy_until else 0
+
+    def wave_tx_stop(self):
+        self.busy_until = 0.0
+        self.schedule = []
+        return 0
+
+    def wave_get_max_pulses(self):
+        return MAX_WAVE_PULSES
+
+    def wave_get_max_cbs(self):
+        return MAX_WAVE_CBS
+
+    def wave_get_max_micros(self):
+        return MAX_WAVE_MICROS
+
+    def stop(self):
+        self.connected = False
+
+def level_changes(start_us, wave, gpio, level):
+    # Ticks and new levels where wave changes gpio, level is what the pin had before
+    starts = start_us + np.concatenate(([0], np.cumsum(wave[:, 2], dtype=np.int64)[:-1]))
+    on = (wave[:, 0] >> gpio) & 1
+    off = (wave[:, 1] >> gpio) & 1
+    sel = (on | off).astype(bool)
+    ticks, levels = starts[sel], on[sel].astype(np.uint8)
+    changed = levels != np.concatenate(([level], levels[:-1]))
+    return ticks[changed], levels[changed]
+
+def merge_pulses(a, b):
+    # Same as pigpiod merging of wave_add_generic calls: both start at time 0, edges interleave in time
+    def events(p):
+        starts = np.concatenate(([0], np.cumsum(p[:, 2], dtype=np.uint64)[:-1]))
+        return starts, p[:, 0], p[:, 1], np.cumsum(p[:, 2], dtype=np.uint64)[-1]
+    sa, ona, offa, enda = events(a)
+    sb, onb, offb, endb = events(b)
+    times = np.concatenate((sa, sb))
+    order = np.argsort(times, kind="stable")
+    times = times[order]
+    on = np.concatenate((ona, onb))[order]
+    off = np.concatenate((offa, offb))[order]
+    # Pulses at the same time become one
+    keep = np.concatenate((np.diff(times) > 0, [True]))
+    groups = np.concatenate(([0], np.cumsum(keep)[:-1]))
+    merged_on = np.zeros(keep.sum(), dtype=np.uint32)
+    merged_off = np.zeros(keep.sum(), dtype=np.uint32)
+    np.bitwise_or.at(merged_on, groups, on)
+    np.bitwise_or.at(merged_off, groups, off)
+    t = times[keep]
+    end = max(enda, endb)
+    delays = np.diff(np.concatenate((t, [end])))
+    return np.stack((merged_on, merged_off, delays.astype(np.uint32)), axis=1)
+
+def chain_micros(data, wave_micros):
+    # Total time of wave_chain program, loops may be nested
+    stack = [0]  # micros per loop level
+    i = 0
+    while i < len(data):
+        if data[i] == 255:
+            cmd = data[i + 1]
+            if cmd == 0:
+                stack.append(0)
+                i += 2
+            elif cmd == 1:
+                repeat = data[i + 2] | (data[i + 3] << 8)
+                micros = stack.pop() * repeat
+                stack[-1] += micros
+                i += 4
+            elif cmd == 2:
+                stack[-1] += data[i + 2] | (data[i + 3] << 8)
+                i += 4
+            elif cmd == 3:
+                return float("inf")
+            else:
+                raise FakeError(pigpio.PI_BAD_CHAIN_CMD)
+        else:
+            stack[-1] += wave_micros(data[i])
+            i += 1
+    return stack[0]
+
+def chain_waves(data, wave):
+    # Pulses of wave_chain program in send order, delays become delay-only pulses. Endless loop is played once.
+    stack = [[]]
+    i = 0
+    while i < len(data):
+        if data[i] == 255:
+            cmd = data[i + 1]
+            if cmd == 0:
+                stack.append([])
+                i += 2
+            elif cmd == 1:
+                repeat = data[i + 2] | (data[i + 3] << 8)
+                body = stack.pop()
+                stack[-1] += body * repeat
+                i += 4
+            elif cmd == 2:
+                stack[-1].append(np.array([[0, 0, data[i + 2] | (data[i + 3] << 8)]], dtype=np.uint32))
+                i += 4
+            elif cmd == 3:
+                body = stack.pop()
+                stack[-1] += body
+                i += 2
+            else:
+                raise FakeError(pigpio.PI_BAD_CHAIN_CMD)
+        else:
+            stack[-1].append(wave(data[i]))
+            i += 1
+    return stack[0]
+
+# =======================
+# Fake pigpiod socket server
+# =======================
+C = pigpio
+COMMANDS = {
+    C._PI_CMD_MODES: lambda pi, p1, p2, ext: pi.set_mode(p1, p2),
+    C._PI_CMD_MODEG: lambda pi, p1, p2, ext: pi.get_mode(p1),
+    C._PI_CMD_READ: lambda pi, p1, p2, ext: pi.read(p1),
+    C._PI_CMD_WRITE: lambda pi, p1, p2, ext: pi.write(p1, p2),
+    C._PI_CMD_FG: lambda pi, p1, p2, ext: pi.set_glitch_filter(p1, p2),
+    C._PI_CMD_FN: lambda pi, p1, p2, ext: pi.set_noise_filter(p1, p2, struct.unpack("I", ext)[0]),
+    C._PI_CMD_BR1: lambda pi, p1, p2, ext: sum(level << g for g, level in pi.levels.items()),
+    C._PI_CMD_WVCLR: lambda pi, p1, p2, ext: pi.wave_clear(),
+    C._PI_CMD_WVNEW: lambda pi, p1, p2, ext: pi.wave_add_new(),
+    C._PI_CMD_WVAG: lambda pi, p1, p2, ext: pi.wave_add_packed(ext),
+    C._PI_CMD_WVCRE: lambda pi, p1, p2, ext: pi.wave_create(),
+    C._PI_CMD_WVDEL: lambda pi, p1, p2, ext: pi.wave_delete(p1),
+    C._PI_CMD_WVTX: lambda pi, p1, p2, ext: pi.wave_send_once(p1),
+    C._PI_CMD_WVTXR: lambda pi, p1, p2, ext: pi.wave_send_repeat(p1),
+    C._PI_CMD_WVTXM: lambda pi, p1, p2, ext: pi.wave_send_using_mode(p1, p2),
+    C._PI_CMD_WVCHA: lambda pi, p1, p2, ext: pi.wave_chain(ext),
+    C._PI_CMD_WVBSY: lambda pi, p1, p2, ext: pi.wave_tx_busy(),
+    C._PI_CMD_WVTAT: lambda pi, p1, p2, ext: pi.wave_tx_at(),
+    C._PI_CMD_WVHLT: lambda pi, p1, p2, ext: pi.wave_tx_stop(),
+    C._PI_CMD_WVSP: lambda pi, p1, p2, ext: pi.wave_get_max_pulses(),
+    C._PI_CMD_WVSC: lambda pi, p1, p2, ext: pi.wave_get_max_cbs(),
+    C._PI_CMD_WVSM: lambda pi, p1, p2, ext: pi.wave_get_max_micros(),
+    C._PI_CMD_TICK: lambda pi, p1, p2, ext: pi.get_current_tick(),
+    C._PI_CMD_NB: lambda pi, p1, p2, ext: pi.notify_begin(p1, p2),
+    C._PI_CMD_NC: lambda pi, p1, p2, ext: pi.notify_close(p1),
+}
+
+class _Handler(socketserver.BaseRequestHandler):
+    def recv_exact(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def handle(self):
+        pi = self.server.pi
+        notify = None  # After NOIB socket only carries reports, commands on it get no reply
+        try:
+            while True:
+                cmd, p1, p2, p3 = struct.unpack("IIII", self.recv_exact(16))
+                ext = self.recv_exact(p3) if p3 else b""
+                func = COMMANDS.get(cmd)
+                with pi.lock:
+                    try:
+                        if cmd == C._PI_CMD_NOIB:
+                            res = notify = pi.notify_open_inband(self.request)
+                        else:
+                            res = func(pi, p1, p2, ext) if func else 0
+                    except FakeError as e:
+                        res = e.code
+                if notify is None or cmd == C._PI_CMD_NOIB:
+                    self.request.sendall(struct.pack("IIIi", cmd, p1, p2, res))
+        except OSError:  # Also ConnectionError of recv_exact
+            pass
+        finally:
+            if notify is not None and notify in pi.notifiers:
+                with pi.lock:
+                    pi.notify_close(notify)
+
+class FakePigpiod(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=DEFAULT_PORT, pi=None):
+        self.pi = pi or FakePi()
+        super().__init__(("localhost", port), _Handler)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+def main():
+    args = sys.argv[1:]
+    wires = []
+    while "--wire" in args:
+        i = args.index("--wire")
+        wires.append(tuple(int(g) for g in args[i + 1].split(":")))
+        del args[i:i + 2]
+    port = int(args[0]) if args else DEFAULT_PORT
+    server = FakePigpiod(port)
+    for tx, rx in wires:
+        server.pi.wire(tx, rx)  # Loopback, receiver sees what transmitter sends
+    print(f"Fake pigpiod listening on localhost:{port}, use pigpio.pi('localhost', {port})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import sys
+import json
+import numpy as np
+import normalize
+import profiler
+from sub_parser import FlipperSubParser
+from sub_converter import load_pulses
+from code_store import CodeStore
+# Timing fidelity of TX -> RX chain: recorded capture is aligned with pulse train the .sub file should produce
+# (cross-correlation of both level timelines), then every reference edge is paired with nearest captured edge
+# of the same direction. Reports timing error histogram, jitter, dropped/extra edges and TE (clock) drift.
+# Capture can be RAW .sub, rfrp bulk --out file (int32) or code from store (saved_codes.db:NAME).
+# Usage: python3 fidelity.py reference.sub capture [--repeat N] [--invert] [--json] [--profile]
+
+# ==== CONFIG ====
+RESAMPLE_US = 10        # Timeline resolution for cross-correlation
+ALIGN_US = 2000000      # Start of reference used to find it in capture
+BLOCK_US = 1000000      # Lag is tracked per block of reference, so clock drift does not break pairing
+SEARCH_US = 5000
+MIN_BLOCK_SCORE = 0.5
+EARLIEST_SHARE = 0.99
+MATCH_FRACTION = 0.5    # Edge pairs further apart than this share of TE are not the same edge
+HIST_BIN_US = 10
+HIST_WIDTH = 40         # Characters of the longest histogram bar
+# ================
+
+# =======================
+# Loading
+# =======================
+def load_capture(path, invert=False):
+    # Everything ends as .sub polarity (+ high), rfrp codes are stored with level after the duration
+    if path.endswith(".sub"):
+        pulses = FlipperSubParser(path).pulses()
+    elif ":" in path:
+        store_path, name = path.rsplit(":", 1)
+        code = CodeStore(store_path).get(name)
+        if isinstance(code, dict):
+            raise ValueError(f"'{name}' is saved decoded, record it with --raw to keep timing")
+        pulses = -code
+    else:
+        pulses = -np.fromfile(path, dtype=np.int32)
+    return normalize.merge_same_sign(-pulses if invert else pulses)
+
+def edges(pulses):
+    # Start time and new level of every pulse
+    p = np.asarray(pulses, dtype=np.int64)
+    d = np.abs(p)
+    return np.concatenate(([0], np.cumsum(d)[:-1])), (p > 0), int(d.sum())
+
+# =======================
+# Analysis
+# =======================
+def timeline(times, levels, start, end, step=RESAMPLE_US):
+    # +1 / -1 level sampled every step uS between start and end, mean removed so idle parts do not count
+    grid = np.arange(start, end, step)
+    idx = np.searchsorted(times, grid, side="right") - 1
+    x = np.where((idx >= 0) & levels[np.maximum(idx, 0)], 1.0, -1.0)
+    return x - x.mean() if len(x) else x
+
+def correlate(r, c, earliest=None):
+    # Best shift of r inside c (0 .. len(c) - len(r), in samples) and normalised score,
+    # earliest=N takes first shift from N on close to the best one (repeated frames correlate the same at
+    # every repeat, also partly overlapped in padding before N, so those are only used when nothing after N is close)
+    if len(r) == 0 or len(c) < len(r):
+        return 0, 0.0
+    size = 1 << (len(r) + len(c)).bit_length()
+    corr = np.fft.irfft(np.fft.rfft(c, size) * np.conj(np.fft.rfft(r, size)), size)[:len(c) - len(r) + 1]
+    best = int(np.argmax(corr))
+    if earliest is not None:
+        close = np.flatnonzero(corr[earliest:] >= EARLIEST_SHARE * corr[best])
+        if len(close):
+            best = earliest + int(close[0])
+    norm = np.linalg.norm(r) * np.linalg.norm(c[best:best + len(r)])
+    return best, float(corr[best] / norm) if norm else 0.0
+
+def align(ref, cap):
+    # Start of reference in capture (uS) from FFT cross-correlation of first ALIGN_US of reference,
+    # capture is padded so reference may also start before it
+    ref_t, ref_l, ref_total = ref
+    cap_t, cap_l, cap_total = cap
+    head = min(ref_total, ALIGN_US)
+    r = timeline(ref_t, ref_l, 0, head)
+    c = timeline(cap_t, cap_l, -head // 2, cap_total)
+    pad = -(-(head // 2) // RESAMPLE_US)  # Samples before start of capture
+    shift, score = correlate(r, c, earliest=pad)
+    return shift * RESAMPLE_US - head // 2, score
+
+def track(ref, cap, lag):
+    # Lag of every BLOCK_US of reference, searched SEARCH_US around lag of previous block, so clock drift
+    # over long captures is followed. Returns (block middle times, lags, scores)
+    ref_t, ref_l, ref_total = ref
+    cap_t, cap_l, _ = cap
+    mids, lags, scores = [], [], []
+    for start in range(0, ref_total, BLOCK_US):
+        end = min(start + BLOCK_US, ref_total)
+        r = timeline(ref_t, ref_l, start, end)
+        lo = start + lag - SEARCH_US
+        c = timeline(cap_t, cap_l, lo, end + lag + SEARCH_US)
+        shift, score = correlate(r, c)
+        if score < MIN_BLOCK_SCORE:
+            continue
+        lag = lo + shift * RESAMPLE_US - start
+        mids.append((start + end) / 2)
+        lags.append(lag)
+        scores.append(score)
+    return np.array(mids), np.array(lags, dtype=np.float64), np.array(scores)
+
+def match(ref_t, cap_t, window):
+    # Nearest captured edge for every reference edge, every captured edge is used once (closest pair wins)
+    if len(cap_t) == 0:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    i = np.clip(np.searchsorted(cap_t, ref_t), 1, len(cap_t) - 1) if len(cap_t) > 1 else np.zeros(len(ref_t), np.int64)
+    left = np.maximum(i - 1, 0)
+    near = np.where(np.abs(cap_t[left] - ref_t) <= np.abs(cap_t[i] - ref_t), left, i)
+    err = np.abs(cap_t[near] - ref_t)
+    ok = np.flatnonzero(err <= window)
+    order = ok[np.lexsort((err[ok], near[ok]))]
+    if len(order) == 0:
+        return order, order
+    first = np.concatenate(([True], near[order][1:] != near[order][:-1]))
+    pairs = order[first]
+    return pairs, near[pairs]
+
+def analyse(ref_pulses, cap_pulses, lag=None):
+    # lag: start of reference in capture when it is known (duplex.py captures from TX start), only tracked then
+    ref = edges(ref_pulses)
+    cap = edges(cap_pulses)
+    with profiler.stage("align", pulses=len(ref_pulses) + len(cap_pulses)):
+        lag, score = align(ref, cap) if lag is None else (lag, 1.0)
+        mids, lags, scores = track(ref, cap, lag)
+    te = normalize.estimate_te(ref_pulses) or int(np.abs(ref_pulses).min())
+    window = te * MATCH_FRACTION
+
+    # Straight line through block lags is the clock, reference edges are moved onto it
+    if len(mids) >= 2:
+        slope, offset = np.polyfit(mids, lags, 1, w=scores)
+    else:
+        slope, offset = 0.0, float(lags[0]) if len(lags) else float(lag)
+    ref_t = ref[0] + offset + slope * ref[0]
+    cap_t, cap_rise = cap[0], cap[1]
+    with profiler.stage("match", pulses=len(ref_t)):
+        ref_idx, cap_idx = [], []
+        for rising in (True, False):  # Edge pairs must go the same direction
+            r = np.flatnonzero(ref[1] == rising)
+            c = np.flatnonzero(cap_rise == rising)
+            a, b = match(ref_t[r], cap_t[c], window)
+            ref_idx.append(r[a])
+            cap_idx.append(c[b])
+        ref_idx = np.concatenate(ref_idx)
+        cap_idx = np.concatenate(cap_idx)
+        order = np.argsort(ref_idx)
+        ref_idx, cap_idx = ref_idx[order], cap_idx[order]
+
+    # Captured edges inside reference span that were not paired are extra (noise, split pulses)
+    span = (cap_t >= ref_t[0] - window) & (cap_t <= ref_t[-1] + window)
+    extra = int(span.sum()) - len(cap_idx)
+    err = cap_t[cap_idx] - ref_t[ref_idx]
+    result = {
+        "reference_edges": len(ref_t),
+        "capture_edges": len(cap_t),
+        "lag_us": round(offset),
+        "correlation": round(float(np.average(scores)) if len(scores) else score, 3),
+        "te_us": te,
+        "matched": len(err),
+        "dropped": len(ref_t) - len(err),
+        "extra": extra,
+    }
+    if len(err) < 2:
+        return result, err, ref_idx
+
+    # What is left after the clock line: fixed offset per edge direction and jitter
+    t = ref[0][ref_idx].astype(np.float64)
+    rest_slope, rest_offset = np.polyfit(t, err, 1)
+    slope += rest_slope
+    err = err - (rest_slope * t + rest_offset)
+    rising = ref[1][ref_idx]
+    rise_mean = float(err[rising].mean()) if rising.any() else 0.0
+    fall_mean = float(err[~rising].mean()) if (~rising).any() else 0.0
+    jitter = err - np.where(rising, rise_mean, fall_mean)
+    result.update(
+        rising_error_us=round(rise_mean, 2),
+        falling_error_us=round(fall_mean, 2),
+        jitter_us=round(float(np.sqrt(np.mean(jitter ** 2))), 2),
+        p95_error_us=round(float(np.percentile(np.abs(err), 95)), 2),
+        drift_ppm=round(float(slope * 1e6), 1),
+        te_drift_us=round(float(slope * te), 3),
+    )
+    # Pulse width error, receivers usually stretch highs and shorten lows (or the other way around)
+    both = np.flatnonzero(np.diff(ref_idx) == 1)
+    if len(both):
+        width_err = np.diff(err)[both]
+        high = ref[1][ref_idx[both]]
+        result["high_width_error_us"] = round(float(width_err[high].mean()), 2) if high.any() else None
+        result["low_width_error_us"] = round(float(width_err[~high].mean()), 2) if (~high).any() else None
+    return result, err, ref_idx
+
+def histogram(err, window):
+    edges_us = np.arange(-window, window + HIST_BIN_US, HIST_BIN_US)
+    hist, _ = np.histogram(err, edges_us)
+    return edges_us, hist
+
+def print_report(result, err, window):
+    print(f"Aligned at {result['lag_us']} uS (correlation {result['correlation']}), TE {result['te_us']} uS")
+    print(f"Edges: {result['reference_edges']} expected, {result['capture_edges']} captured, {result['matched']} matched, "
+          f"{result['dropped']} dropped, {result['extra']} extra")
+    if "jitter_us" not in result:
+        return
+    print(f"Timing error: rising {result['rising_error_us']} uS, falling {result['falling_error_us']} uS, "
+          f"jitter {result['jitter_us']} uS RMS, p95 {result['p95_error_us']} uS")
+    print(f"Drift: {result['drift_ppm']} ppm, TE drift {result['te_drift_us']} uS per TE")
+    if "high_width_error_us" in result:
+        print(f"Pulse width error: high {result['high_width_error_us']} uS, low {result['low_width_error_us']} uS")
+    bins, hist = histogram(err, window)
+    scale = HIST_WIDTH / max(1, hist.max())
+    for start, count in zip(bins[:-1], hist):
+        if count:
+            print(f"{start:+7.0f} uS {'#' * max(1, int(count * scale)):<{HIST_WIDTH}} {count}")
+
+def main():
+    profiler.take_flag(sys.argv)
+    args = sys.argv[1:]
+    repeat = 1
+    if "--repeat" in args:
+        i = args.index("--repeat")
+        repeat = int(args[i + 1])
+        del args[i:i + 2]
+    flags = {flag: flag in args for flag in ("--invert", "--json")}
+    args = [a for a in args if a not in flags]
+    if len(args) != 2:
+        print("Usage: python3 fidelity.py reference.sub capture [--repeat N] [--invert] [--json] [--profile]")
+        print("       capture is RAW .sub, rfrp --bulk --out file or saved_codes.db:NAME")
+        sys.exit(1)
+
+    try:
+        ref = normalize.merge_same_sign(np.tile(load_pulses(args[0]), repeat))
+        cap = load_capture(args[1], flags["--invert"])
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Cannot load: {e}")
+        sys.exit(1)
+    if len(ref) == 0 or len(cap) == 0:
+        print("Reference or capture is empty!")
+        sys.exit(1)
+
+    result, err, _ = analyse(ref, cap)
+    if flags["--json"]:
+        bins, hist = histogram(err, result["te_us"] * MATCH_FRACTION)
+        result["histogram"] = {"bin_us": HIST_BIN_US, "start_us": float(bins[0]), "counts": hist.tolist()}
+        print(json.dumps(result))
+    else:
+        print_report(result, err, result["te_us"] * MATCH_FRACTION)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import os
+import sys
+import json
+import numpy as np
+import normalize
+import pulse_cache
+from pulsetrain import PulseTrain
+from sub_converter import load_pulses
+from code_store import CodeStore, signal_pulses
+# Fingerprint index for finding saved codes and .sub files similar to a capture.
+# Pulse train is quantised to durations in TE units (polarity and TE itself are ignored, so rfrp captures
+# match .sub files), shingles of SHINGLE symbols are MinHashed and signatures are split into LSH bands.
+# Band keys are kept sorted, lookup is binary search per band. Shingle sets do not keep order, so codes of one
+# protocol look alike: best candidates are scored again by edit distance of their repeated frame symbols.
+# Usage: python3 fingerprint.py add sub_dir|file.sub|saved_codes.db [...] [--index fingerprints]
+#        python3 fingerprint.py query file.sub|saved_codes.db:NAME [--top 5] [--index fingerprints]
+
+# ==== CONFIG ====
+DEFAULT_INDEX = "fingerprints"  # fingerprints.npz (signatures, band keys) + fingerprints.json (names, info)
+SHINGLE = 6
+MAX_UNITS = 16          # Longer durations (gaps) are one symbol
+NUM_HASHES = 64
+BANDS = 16              # 16 bands of 4 hashes, codes with similarity 0.7 are candidates with ~99% chance
+SEED = 20240521
+MIN_SCORE = 0.2
+MAX_FRAME = 128         # Symbols of the repeated frame kept per fingerprint
+RERANK = 256            # Best MinHash candidates compared symbol by symbol
+# ================
+
+_rng = np.random.default_rng(SEED)
+_MUL = _rng.integers(1, 2 ** 63, NUM_HASHES, dtype=np.uint64) | np.uint64(1)  # Odd multipliers
+_ADD = _rng.integers(0, 2 ** 63, NUM_HASHES, dtype=np.uint64)
+ROWS = NUM_HASHES // BANDS
+
+# =======================
+# Signatures
+# =======================
+def symbols(pulses):
+    # Durations in TE units, 1..MAX_UNITS, and TE they were measured with
+    p = normalize.drop_glitches(np.asarray(pulses))
+    te = normalize.estimate_te(p) or (int(np.abs(p).min()) if len(p) else 0)
+    if not te:
+        return np.empty(0, dtype=np.uint64), 0
+    units = np.clip(np.rint(np.abs(p) / te), 1, MAX_UNITS).astype(np.uint64)
+    return units, te
+
+def shingles(units):
+    # Every SHINGLE symbols packed into one uint64 (5 bits per symbol), duplicates removed
+    if len(units) < SHINGLE:
+        return np.empty(0, dtype=np.uint64)
+    n = len(units) - SHINGLE + 1
+    ids = np.zeros(n, dtype=np.uint64)
+    for j in range(SHINGLE):
+        ids |= units[j:j + n] << np.uint64(5 * j)
+    return np.unique(ids)
+
+def frame(units):
+    # Most common run of symbols between gaps (MAX_UNITS) as one hex digit per symbol, partial frames at
+    # start and end of captures lose the vote
+    cut = np.flatnonzero(units >= MAX_UNITS)
+    seen = {}
+    for part in np.split(units, cut):
+        part = part[1:] if len(part) and part[0] >= MAX_UNITS else part
+        if len(part):
+            text = "".join("%x" % (u - 1) for u in part[:MAX_FRAME])
+            seen[text] = seen.get(text, 0) + 1
+    return max(seen, key=seen.get) if seen else ""
+
+def frame_similarity(a, frames):
+    # 1 - Levenshtein distance / longer length of frame a against every frame in frames, all rows in one go
+    if not frames:
+        return np.empty(0)
+    lens = np.array([len(f) for f in frames])
+    width = int(lens.max())
+    b = np.zeros((len(frames), width), dtype=np.uint8)  # 0 pads, symbols are hex digits
+    for i, f in enumerate(frames):
+        b[i, :len(f)] = np.frombuffer(f.encode(), dtype=np.uint8)
+    col = np.arange(width + 1)
+    d = np.tile(col, (len(frames), 1))
+    for k, sym in enumerate(a.encode(), 1):
+        row = np.empty_like(d)
+        row[:, 0] = k
+        row[:, 1:] = np.minimum(d[:, 1:] + 1, d[:, :-1] + (b != sym))
+        d = np.minimum.accumulate(row - col, axis=1) + col  # Insertions run along the row
+    dist = d[np.arange(len(frames)), lens]
+    return 1 - dist / np.maximum(np.maximum(lens, len(a)), 1)
+
+def signature(pulses):
+    # (MinHash signature (uint32 x NUM_HASHES) with multiply-shift hashing, TE, frame), None for too short trains
+    units, te = symbols(pulses)
+    ids = shingles(units)
+    if len(ids) == 0:
+        return None, te, ""
+    h = (ids[:, None] * _MUL + _ADD) >> np.uint64(32)
+    return h.min(axis=0).astype(np.uint32), te, frame(units)
+
+def band_keys(sigs):
+    # (n, NUM_HASHES) signatures -> (n, BANDS) uint64 keys
+    s = np.asarray(sigs, dtype=np.uint64).reshape(-1, BANDS, ROWS)
+    keys = np.zeros(s.shape[:2], dtype=np.uint64)
+    for r in range(ROWS):
+        keys = keys * np.uint64(0x9E3779B97F4A7C15) + s[:, :, r]
+    return keys
+
+# =======================
+# Index
+# =======================
+class FingerprintIndex:
+    def __init__(self, path=DEFAULT_INDEX):
+        self.path = path
+        self.names = []
+        self.info = []   # {"te", "pulses", "frame", "mtime", "size"} per name
+        self.sigs = np.empty((0, NUM_HASHES), dtype=np.uint32)
+        self.keys = np.empty((0, BANDS), dtype=np.uint64)
+        self.order = np.empty((BANDS, 0), dtype=np.int64)
+        self.rows = {}   # name -> row
+        self.pending = []  # Signatures added since last flush, stacked in one go
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path + ".json", "r") as f:
+                meta = json.load(f)
+            with np.load(self.path + ".npz") as data:
+                sigs, keys, order = data["sigs"], data["keys"], data["order"]
+        except (OSError, ValueError, KeyError):
+            return
+        if len(meta["names"]) == len(sigs):
+            self.names, self.info = meta["names"], meta["info"]
+            self.sigs, self.keys, self.order = sigs, keys, order
+            self.rows = {name: i for i, name in enumerate(self.names)}
+
+    def flush(self):
+        # Pending signatures are stacked and band keys sorted, queries then only do binary search
+        if self.pending:
+            sigs = np.array(self.pending, dtype=np.uint32)
+            self.sigs = np.vstack((self.sigs, sigs))
+            self.keys = np.vstack((self.keys, band_keys(sigs)))
+            self.pending = []
+        if self.order.shape[1] != len(self.keys):
+            self.order = np.argsort(self.keys, axis=0, kind="stable").T.copy()
+
+    def save(self):
+        self.flush()
+        tmp = self.path + ".tmp.npz"
+        np.savez(tmp, sigs=self.sigs, keys=self.keys, order=self.order)
+        os.replace(tmp, self.path + ".npz")
+        tmp = self.path + ".json.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"names": self.names, "info": self.info}, f)
+        os.replace(tmp, self.path + ".json")
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def add(self, name, pulses, **info):
+        # Replaces earlier fingerprint of the same name, returns False when train is too short
+        sig, te, frame_text = signature(pulses)
+        if sig is None:
+            return False
+        info.update(te=te, pulses=len(pulses), frame=frame_text)
+        i = self.rows.get(name)
+        if i is None:
+            self.rows[name] = len(self.names)
+            self.names.append(name)
+            self.info.append(info)
+            self.pending.append(sig)
+            return True
+        self.flush()
+        self.sigs[i] = sig
+        self.keys[i] = band_keys(sig)[0]
+        self.info[i] = info
+        self.order = np.empty((BANDS, 0), dtype=np.int64)  # Sorted again on next flush
+        return True
+
+    def remove(self, name):
+        i = self.rows.get(name)
+        if i is None:
+            return
+        self.flush()
+        del self.names[i], self.info[i]
+        self.sigs = np.delete(self.sigs, i, axis=0)
+        self.keys = np.delete(self.keys, i, axis=0)
+        self.rows = {n: j for j, n in enumerate(self.names)}
+        self.order = np.empty((BANDS, 0), dtype=np.int64)
+
+    def candidates(self, keys):
+        self.flush()
+        found = []
+        for b in range(BANDS):
+            column = self.keys[self.order[b], b]
+            lo, hi = np.searchsorted(column, keys[b], "left"), np.searchsorted(column, keys[b], "right")
+            found.append(self.order[b][lo:hi])
+        return np.unique(np.concatenate(found)) if found else np.empty(0, np.int64)
+
+    def query(self, pulses, top=5, exclude=()):
+        # [(name, similarity, info), ...] best first, similarity is edit similarity of repeated frames
+        # (estimated Jaccard of shingle sets for fingerprints saved without frame)
+        sig, te, frame_text = signature(pulses)
+        if sig is None or not self.names:
+            return []
+        idx = self.candidates(band_keys(sig)[0])
+        jaccard = (self.sigs[idx] == sig).mean(axis=1)
+        order = np.argsort(-jaccard, kind="stable")
+        order = order[jaccard[order] >= MIN_SCORE][:RERANK]
+        idx, jaccard = idx[order], jaccard[order]
+        scores = jaccard.copy()
+        framed = [i for i, row in enumerate(idx) if self.info[row].get("frame")]
+        if frame_text and framed:
+            scores[framed] = frame_similarity(frame_text, [self.info[idx[i]]["frame"] for i in framed])
+        results = []
+        for i in np.lexsort((-jaccard, -scores)):
+            name = self.names[idx[i]]
+            if name in exclude or scores[i] < MIN_SCORE:
+                continue
+            results.append((name, round(float(scores[i]), 3), self.info[idx[i]]))
+            if len(results) >= top:
+                break
+        return results
+
+# =======================
+# Sources
+# =======================
+def add_sub(index, path):
+    st = os.stat(path)
+    info = index.info[index.rows[path]] if path in index else {}
+    if info.get("mtime") == st.st_mtime_ns and info.get("size") == st.st_size and "frame" in info:
+        return False
+    return index.add(path, load_pulses(path, evict=False), mtime=st.st_mtime_ns, size=st.st_size)
+
+def add_store(index, store_path):
+    store = CodeStore(store_path)
+    added = 0
+    for name in store.names():
+        added += index.add(f"{store_path}:{name}", signal_pulses(store.get(name)))
+    return added
+
+def load_source(source):
+    # .sub file or saved_codes.db:NAME -> PulseTrain
+    if source.endswith(".sub"):
+        return load_pulses(source)
+    store_path, name = source.rsplit(":", 1)
+    return PulseTrain(signal_pulses(CodeStore(store_path).get(name)))
+
+def main():
+    args = sys.argv[1:]
+    path = DEFAULT_INDEX
+    top = 5
+    if "--index" in args:
+        i = args.index("--index")
+        path = args[i + 1]
+        del args[i:i + 2]
+    if "--top" in args:
+        i = args.index("--top")
+        top = int(args[i + 1])
+        del args[i:i + 2]
+    if len(args) < 2 or args[0] not in ("add", "query"):
+        print("Usage: python3 fingerprint.py add sub_dir|file.sub|saved_codes.db [...] [--index fingerprints]")
+        print("       python3 fingerprint.py query file.sub|saved_codes.db:NAME [--top 5] [--index fingerprints]")
+        sys.exit(1)
+
+    index = FingerprintIndex(path)
+    if args[0] == "add":
+        added = 0
+        for source in args[1:]:
+            if os.path.isdir(source):
+                for root, _, files in os.walk(source):
+                    for f in sorted(files):
+                        if f.endswith(".sub"):
+                            added += add_sub(index, os.path.join(root, f))
+            elif source.endswith(".sub"):
+                added += add_sub(index, source)
+            else:
+                added += add_store(index, source)
+        index.save()
+        pulse_cache.evict()  # .sub files are encoded with evict=False, size limit is applied once here
+        print(f"Added {added} fingerprints, index has {len(index)}")
+        return
+
+    try:
+        pulses = load_source(args[1])
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Cannot load '{args[1]}': {e}")
+        sys.exit(1)
+    results = index.query(pulses, top, exclude=(args[1],))
+    if not results:
+        print("No similar codes found.")
+    for name, score, info in results:
+        print(f"{score:.3f}  {name}  (TE {info['te']} uS, {info['pulses']} pulses)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import numpy as np
+import pigpio
+import profiler
+import squelch
+from waveform import compile_pulses, create_compiled_wave, airtime_us, wait_tx_done, pi_clock
+# Frame repeat engine: RAW captures and .sub files usually hold the same frame several times, separated by
+# the same long gap. The train is split into head + frame x count + tail, only one copy of the frame is
+# uploaded and wave_chain loops it with the gap as chain delay, so pigpiod memory and upload time do not
+# grow with number of repeats. Works with either polarity, gap keeps the sign it has in the train.
+# Only frames that are the same to TOLERANCE_US (gap included) are looped, so encoded and snapped trains are,
+# jittery RAW captures are sent as recorded.
+
+# ==== CONFIG ====
+MIN_GAP_US = squelch.FRAME_GAP_US  # Durations this long end a frame
+MIN_REPEATS = 2
+TOLERANCE_US = 2        # Frames are the same when every duration is this close
+GAP_IN_WAVE_US = 100    # Start of the gap stays in the wave, pin is then at gap level during chain delay
+MAX_DELAY_US = 0xFFFF   # One chain delay command, longer gaps use more of them
+CBS_PER_PULSE = 2
+# ================
+
+def longest_run(ok):
+    # (start, length) of longest run of True
+    if not ok.any():
+        return 0, 0
+    edges = np.diff(np.concatenate(([0], ok.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    best = int(np.argmax(ends - starts))
+    return int(starts[best]), int(ends[best] - starts[best])
+
+def split(pulses):
+    # {"head", "frame", "count", "gap_us", "tail"}, frame does not include its gap (gap_us is signed).
+    # count is 0 when nothing repeats, head is then the whole train.
+    p = np.asarray(pulses, dtype=np.int64)
+    whole = {"head": p.astype(np.int32), "frame": np.empty(0, np.int32), "count": 0, "gap_us": 0, "tail": np.empty(0, np.int32)}
+    long = np.abs(p) >= MIN_GAP_US
+    if long.sum() < MIN_REPEATS:
+        return whole
+    sign = 1 if (p[long] > 0).sum() * 2 > long.sum() else -1
+    gaps = np.flatnonzero(long & (np.sign(p) == sign))
+    if len(gaps) < MIN_REPEATS:
+        return whole
+
+    # Frame length is the most common distance between gaps, every run of gaps that far apart is a candidate
+    steps = np.diff(gaps)
+    values, counts = np.unique(steps, return_counts=True)
+    period = int(values[np.argmax(counts)])
+    best = None
+    run_edges = np.diff(np.concatenate(([0], (steps == period).astype(np.int8), [0])))
+    for lo, hi in zip(np.flatnonzero(run_edges == 1), np.flatnonzero(run_edges == -1)):
+        ends = gaps[lo:hi + 1]
+        ends = ends[ends - period + 1 >= 0]
+        if len(ends) < MIN_REPEATS:
+            continue
+        frames = p[(ends - period + 1)[:, None] + np.arange(period)]
+        # Every frame is compared with the first one of its run, so a run of the same frame is found among
+        # other codes and small differences do not add up along the run
+        same = np.zeros(len(frames) - 1, dtype=bool)
+        i = 0
+        while i < len(frames) - 1:
+            rest = frames[i + 1:]
+            ok = ((np.abs(rest - frames[i]) <= TOLERANCE_US) & (np.sign(rest) == np.sign(frames[i]))).all(axis=1)
+            n = int(np.argmin(ok)) if not ok.all() else len(ok)
+            same[i:i + n] = True
+            i += n + 1
+        start, count = longest_run(same)
+        count += 1
+        if count >= MIN_REPEATS and (best is None or count > best[1]):
+            best = (frames[start:start + count], count, int(ends[start]) - period + 1)
+    if best is None:
+        return whole
+
+    frames, count, first = best
+    return {
+        "head": p[:first].astype(np.int32),
+        "frame": frames[0, :-1].astype(np.int32),
+        "count": count,
+        "gap_us": int(frames[0, -1]),
+        "tail": p[first + count * period:].astype(np.int32),
+    }
+
+def layout_airtime(layout):
+    return airtime_us(layout["head"]) + layout["count"] * (airtime_us(layout["frame"]) + abs(layout["gap_us"])) + airtime_us(layout["tail"])
+
+def played_pulses(layout):
+    return len(layout["head"]) + layout["count"] * (len(layout["frame"]) + 1) + len(layout["tail"])
+
+def uploaded_pulses(layout):
+    # Pulses that go to pigpiod (frame once, plus start of its gap)
+    return len(layout["head"]) + (len(layout["frame"]) + 1 if layout["count"] else 0) + len(layout["tail"])
+
+def fits(pi, layout, max_chunk_len=None):
+    # All waves must be in pigpiod at once, each one also has to fit into one wave
+    parts = [len(layout["head"]), len(layout["frame"]) + 1 if layout["count"] else 0, len(layout["tail"])]
+    limit = min(pi.wave_get_max_pulses(), max_chunk_len or pi.wave_get_max_pulses())
+    return max(parts) <= limit and sum(parts) * CBS_PER_PULSE <= pi.wave_get_max_cbs()
+
+def chain_delay(us):
+    cmds = []
+    while us > 0:
+        d = min(us, MAX_DELAY_US)
+        cmds += [255, 2, d & 255, d >> 8]
+        us -= d
+    return cmds
+
+def build_chain(head_id, frame_id, tail_id, count, delay_us, repeat=1):
+    # Wave ids (None when part is empty) -> wave_chain program, loops are nested when repeat > 1
+    chain = [] if head_id is None else [head_id]
+    if count:
+        chain += [255, 0, frame_id] + chain_delay(delay_us) + [255, 1, count & 255, count >> 8]
+    if tail_id is not None:
+        chain.append(tail_id)
+    if repeat > 1:
+        chain = [255, 0] + chain + [255, 1, repeat & 255, (repeat >> 8) & 255]
+    return chain
+
+def start(pi, pin, layout, repeat=1):
+    # Uploads head, one frame and tail and starts wave_chain, returns plan
+    # {"waves", "pulses", "uploaded", "airtime_us", "started", "ids"}, finish() waits for the end
+    repeat = max(1, repeat)
+    gap = layout["gap_us"]
+    keep = min(abs(gap), GAP_IN_WAVE_US) * (1 if gap > 0 else -1)
+    plan = {
+        "pulses": played_pulses(layout) * repeat,
+        "uploaded": uploaded_pulses(layout),
+        "airtime_us": layout_airtime(layout) * repeat,
+    }
+    pi.set_mode(pin, pigpio.OUTPUT)
+    pi.write(pin, 0)
+    pi.wave_clear()
+    ids = []
+    for part in (layout["head"], np.append(layout["frame"], keep) if layout["count"] else (), layout["tail"]):
+        if len(part) == 0:
+            ids.append(None)
+            continue
+        wave_id = create_compiled_wave(pi, compile_pulses(part, pin))
+        if wave_id < 0:
+            raise RuntimeError("No more control blocks available")
+        ids.append(wave_id)
+    chain = build_chain(*ids, layout["count"], abs(gap) - abs(keep), repeat)
+    plan["waves"] = sum(i is not None for i in ids)
+    plan["ids"] = [i for i in ids if i is not None]
+    plan["started"] = pi_clock(pi).monotonic()
+    pi.wave_chain(chain)
+    return plan
+
+def finish(pi, pin, plan, stop=None):
+    wait_tx_done(pi, plan["airtime_us"], plan["started"], stop)
+    for wave_id in plan.pop("ids"):
+        pi.wave_delete(wave_id)
+    pi.write(pin, 0)
+    return plan
+
+def send(pi, pin, layout, repeat=1):
+    # Whole transmission, returns plan without wave ids
+    with profiler.stage("transmit", pulses=played_pulses(layout) * max(1, repeat)):
+        return finish(pi, pin, start(pi, pin, layout, repeat))
+
+def describe(layout):
+    if not layout["count"]:
+        return "no repeating frame"
+    return (f"frame of {len(layout['frame'])} pulses x{layout['count']} with {abs(layout['gap_us']) / 1000:.1f} ms gap "
+            f"(+{len(layout['head'])} head, {len(layout['tail'])} tail pulses)")
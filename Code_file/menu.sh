@@ -3,13 +3,17 @@
 
 # === File and GPIO configuration ===
 RFRP_SCRIPT="rfrp.py"
-RFRP_FILE="saved_codes.json"
+RFRP_FILE="saved_codes.db"
+RFRP_JSON="saved_codes.json"
+STORE_SCRIPT="code_store.py"
 BRUTE_SCRIPT="sub_bruteforce.py"
 SUBRUTE_DIR="./sub_brute_files"
 JAM_SCRIPT="jammer.py"
 JAM_FILE="jammer.sub"
 SUBSEND_SCRIPT="sub_converter.py"
 SUBCUSTOM_DIR="./sub_custom_files"
+CATALOG_SCRIPT="catalog.py"
+MONITOR_SCRIPT="monitor.py"
 TX_GPIO=13
 RX_GPIO=25
 # ===================================
@@ -17,6 +21,11 @@ RX_GPIO=25
 whiptail --msgbox "Hello!\nActivating pigpiod!" 10 50
 sudo pigpiod
 
+# One-shot import of codes saved by older versions
+if [ ! -e "$RFRP_FILE" ] && [ -s "$RFRP_JSON" ]; then
+  python3 "$STORE_SCRIPT" import "$RFRP_JSON" --store "$RFRP_FILE"
+fi
+
 while true; do
   CHOICE=$(whiptail --title "433MHz Control Menu" --menu "Select an option:" 20 60 10 \
     "1" "Record 433MHz code (rfrp)" \
@@ -25,7 +34,8 @@ while true; do
     "4" ".sub file bruteforce" \
     "5" "Custom .sub file" \
     "6" "Jam 433MHz band" \
-    "7" "Exit" 3>&1 1>&2 2>&3)
+    "7" "Monitor receiver activity" \
+    "8" "Exit" 3>&1 1>&2 2>&3)
 
   case "$CHOICE" in
     "1")
@@ -38,14 +48,15 @@ while true; do
       python3 "$RFRP_SCRIPT" --record --name "$CODE_NAME" --time "$RECORD_TIME" --file "$RFRP_FILE" --rx "$RX_GPIO" || whiptail --msgbox "Error running Python script." 10 50
       ;;
     "2")
-      if [ ! -s "$RFRP_FILE" ] || [ "$(jq -r 'keys | length' "$RFRP_FILE")" -eq 0 ]; then
+      CODE_NAMES=$(python3 "$STORE_SCRIPT" list --store "$RFRP_FILE")
+      if [ -z "$CODE_NAMES" ]; then
         whiptail --msgbox "No 433 MHz codes found in $RFRP_FILE" 10 50
         continue
       fi
       MENU_ITEMS=""
       while IFS= read -r name; do
         MENU_ITEMS+=" $name $name"
-      done < <(jq -r 'keys[]' "$RFRP_FILE")
+      done <<< "$CODE_NAMES"
 
       CODE_TO_PLAY=$(whiptail --title "Send 433MHz Code" --menu "Choose a code to send:" 20 60 10 $MENU_ITEMS 3>&1 1>&2 2>&3)
       if [ -n "$CODE_TO_PLAY" ]; then
@@ -55,20 +66,21 @@ while true; do
       fi
       ;;
     "3")
-      if [ ! -s "$RFRP_FILE" ] || [ "$(jq -r 'keys | length' "$RFRP_FILE")" -eq 0 ]; then
+      CODE_NAMES=$(python3 "$STORE_SCRIPT" list --store "$RFRP_FILE")
+      if [ -z "$CODE_NAMES" ]; then
         whiptail --msgbox "No 433 MHz codes found in $RFRP_FILE" 10 50
         continue
       fi
       MENU_ITEMS=""
       while IFS= read -r name; do
         MENU_ITEMS+=" $name $name"
-      done < <(jq -r 'keys[]' "$RFRP_FILE")
+      done <<< "$CODE_NAMES"
 
       CODE_TO_DELETE=$(whiptail --title "Delete 433MHz Code" --menu "Select a code to delete:" 20 60 10 $MENU_ITEMS 3>&1 1>&2 2>&3)
       if [ -n "$CODE_TO_DELETE" ]; then
         whiptail --yesno "Are you sure you want to delete '$CODE_TO_DELETE'?" 10 50
         if [ $? -eq 0 ]; then
-          jq "del(.\"$CODE_TO_DELETE\")" "$RFRP_FILE" > /tmp/ask_tmp.json && mv /tmp/ask_tmp.json "$RFRP_FILE"
+          python3 "$STORE_SCRIPT" delete "$CODE_TO_DELETE" --store "$RFRP_FILE"
           whiptail --msgbox "Code '$CODE_TO_DELETE' deleted." 10 50
         fi
       else
@@ -81,12 +93,12 @@ while true; do
         continue
       fi
 
-      SUB_MENU_ITEMS=""
-      for file in "$SUBRUTE_DIR"/*.sub; do
-        [ -e "$file" ] || continue
-        filename=$(basename "$file")
-        SUB_MENU_ITEMS+=" $filename $filename"
-      done
+      # Catalog only parses files that changed since last time
+      SUB_MENU_ITEMS=$(python3 "$CATALOG_SCRIPT" "$SUBRUTE_DIR" --protocol RAW --menu)
+      if [ -z "$SUB_MENU_ITEMS" ]; then
+        whiptail --msgbox "No RAW .sub files found in $SUBRUTE_DIR" 10 50
+        continue
+      fi
 
       SELECTED_SUB=$(whiptail --title "Select .sub File" --menu "Choose a .sub file to send:" 20 60 10 $SUB_MENU_ITEMS 3>&1 1>&2 2>&3)
       if [ -z "$SELECTED_SUB" ]; then
@@ -106,12 +118,11 @@ while true; do
         continue
       fi
 
-      SUB_MENU_ITEMS=""
-      for file in "$SUBCUSTOM_DIR"/*.sub; do
-        [ -e "$file" ] || continue
-        filename=$(basename "$file")
-        SUB_MENU_ITEMS+=" $filename $filename"
-      done
+      SUB_MENU_ITEMS=$(python3 "$CATALOG_SCRIPT" "$SUBCUSTOM_DIR" --sort frequency --menu)
+      if [ -z "$SUB_MENU_ITEMS" ]; then
+        whiptail --msgbox "No .sub files found in $SUBCUSTOM_DIR" 10 50
+        continue
+      fi
 
       SELECTED_SUB=$(whiptail --title "Select .sub File" --menu "Choose a .sub file to send:" 20 60 10 $SUB_MENU_ITEMS 3>&1 1>&2 2>&3)
       if [ -z "$SELECTED_SUB" ]; then
@@ -121,7 +132,7 @@ while true; do
       CHAIN_LENGHT=$(whiptail --inputbox "Lengh of a chain (prevent crashing)?" 10 60 "10000000000" 3>&1 1>&2 2>&3)
       REPEAT=$(whiptail --inputbox "Repeat times?" 10 60 "5" 3>&1 1>&2 2>&3)
       whiptail --msgbox "Sending custom file with name $SELECTED_SUB using wave_chaining with repeat $REPEAT X times" 10 60
-      python3 "$SUBSEND_SCRIPT" "$SUBCUSTOM_DIR/$SELECTED_SUB" "$CHAIN_LENGHT" "$TX_GPIO" "$REPEAT" || whiptail --msgbox "Error running Python script. 
+      python3 "$SUBSEND_SCRIPT" "$SUBCUSTOM_DIR/$SELECTED_SUB" "$CHAIN_LENGHT" "$TX_GPIO" "$REPEAT" || whiptail --msgbox "Error running Python script." 10 50
       whiptail --msgbox "Going back to menu!" 10 50
       ;;
     "6")
@@ -130,6 +141,11 @@ while true; do
       whiptail --msgbox "Going back to menu!" 10 50
       ;;
     "7")
+      whiptail --msgbox "Monitoring started... Press Ctrl+C to return." 10 50
+      python3 "$MONITOR_SCRIPT" "$RX_GPIO"
+      whiptail --msgbox "Going back to menu!" 10 50
+      ;;
+    "8")
       whiptail --msgbox "Deactivating pigpiod!\nGood bye!" 10 50
       sudo pigpiod kill
       break
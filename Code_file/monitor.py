@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import numpy as np
+import pigpio
+import profiler
+import squelch
+from capture import BulkCapture
+# Live receiver activity, edges come in bulk from pigpio notification pipe (no callback per edge) and are
+# binned per window with numpy: edge rate, bursts that look like a code (squelch.py) and duration histogram.
+# One line per window on screen and in rolling log (JSON lines), memory does not grow with run time.
+# Usage: python3 monitor.py [rx_gpio] [--window S] [--time S] [--log monitor.log] [--profile]
+
+# ==== CONFIG ====
+RX_GPIO = 25
+WINDOW_S = 1.0
+POLL_S = 0.1            # Pipe is read this often, sleeping in between keeps CPU low on busy noise
+LOG_PATH = "monitor.log"
+LOG_MAX_BYTES = 1 << 20  # Rotated to .1, .2 ... when bigger
+LOG_KEEP = 3
+HIST_EDGES_US = [50, 100, 200, 400, 800, 1600, 3200, 6400, 12800, 25600]  # Duration histogram bins
+SHADES = " .:-=+*#%@"
+# ================
+
+class RollingLog:
+    def __init__(self, path=LOG_PATH, max_bytes=LOG_MAX_BYTES, keep=LOG_KEEP):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.f = open(path, "a")
+
+    def write(self, entry):
+        self.f.write(json.dumps(entry) + "\n")
+        self.f.flush()
+        if self.f.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.f.close()
+        for i in range(self.keep - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self.f = open(self.path, "a")
+
+    def close(self):
+        self.f.close()
+
+class ActivityMonitor:
+    # Counters of current window only, everything else is fixed size
+    def __init__(self, window_s=WINDOW_S):
+        self.window_s = window_s
+        self.bins = np.array(HIST_EDGES_US, dtype=np.uint32)
+        self.segmenter = squelch.BurstSegmenter()
+        self.reset()
+
+    def reset(self):
+        self.edges = 0
+        self.bursts = 0
+        self.hist = np.zeros(len(self.bins) + 1, dtype=np.int64)
+        self.longest = 0
+
+    def feed(self, levels, durations):
+        if len(durations) == 0:
+            return
+        self.edges += len(durations)
+        self.hist += np.bincount(np.searchsorted(self.bins, durations, side="right"), minlength=len(self.hist))
+        self.longest = max(self.longest, int(durations.max()))
+        self.bursts += self.segmenter.feed(levels, durations)
+        self.segmenter.bursts.clear()  # Only counted here
+
+    def close_window(self, now, dropped):
+        entry = {
+            "time": round(now, 3),
+            "edges": self.edges,
+            "edge_rate": round(self.edges / self.window_s),
+            "bursts": self.bursts,
+            "active": self.segmenter.active,
+            "longest_us": self.longest,
+            "dropped": dropped,
+            "histogram": self.hist.tolist(),
+        }
+        self.reset()
+        return entry
+
+def histogram_text(hist):
+    # One character per bin, darker is more edges
+    h = np.asarray(hist, dtype=np.float64)
+    if h.max() == 0:
+        return " " * len(h)
+    idx = np.ceil(h / h.max() * (len(SHADES) - 1)).astype(int)
+    return "".join(SHADES[i] for i in idx)
+
+def line(entry):
+    stamp = time.strftime("%H:%M:%S", time.localtime(entry["time"]))
+    busy = "BURST" if entry["active"] or entry["bursts"] else ""
+    return (f"{stamp} {entry['edge_rate']:>7} edges/s {entry['bursts']:>3} bursts |{histogram_text(entry['histogram'])}| "
+            f"{entry['dropped']} dropped {busy}")
+
+def monitor(pi, gpio, window_s=WINDOW_S, seconds=None, log_path=LOG_PATH):
+    act = ActivityMonitor(window_s)
+    log = RollingLog(log_path)
+    labels = ["<50"] + [f"{b}" for b in HIST_EDGES_US]
+    print(f"Monitoring GPIO {gpio}, {window_s} s windows, log in '{log_path}'. Ctrl+C to stop.")
+    print(f"Histogram bins (uS, from): {' '.join(labels)}")
+    pi.set_mode(gpio, pigpio.INPUT)
+    try:
+        with BulkCapture(pi, gpio) as cap:
+            end = cap.started + seconds if seconds else None
+            window_end = cap.started + window_s
+            dropped = 0
+            while end is None or time.monotonic() < end:
+                time.sleep(POLL_S)
+                levels, durations, _ = cap.read(0)
+                act.feed(levels, durations)
+                now = time.monotonic()
+                if now >= window_end:
+                    entry = act.close_window(time.time(), cap.dropped - dropped)
+                    dropped = cap.dropped
+                    log.write(entry)
+                    print(line(entry))
+                    window_end += window_s * (int((now - window_end) // window_s) + 1)  # Skip windows missed while busy
+    finally:
+        log.close()
+
+def main():
+    profiler.take_flag(sys.argv)
+    args = sys.argv[1:]
+    opts = {"--window": WINDOW_S, "--time": None, "--log": LOG_PATH}
+    for opt in opts:
+        if opt in args:
+            i = args.index(opt)
+            opts[opt] = args[i + 1]
+            del args[i:i + 2]
+    if len(args) > 1:
+        print("Usage: python3 monitor.py [rx_gpio] [--window S] [--time S] [--log monitor.log] [--profile]")
+        sys.exit(1)
+    gpio = int(args[0]) if args else RX_GPIO
+
+    pi = pigpio.pi()
+    if not pi.connected:
+        print("Cannot connect to pigpiod!")
+        sys.exit(1)
+    try:
+        monitor(pi, gpio, float(opts["--window"]), float(opts["--time"]) if opts["--time"] else None, opts["--log"])
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    finally:
+        pi.stop()
+
+if __name__ == "__main__":
+    main()
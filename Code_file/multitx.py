@@ -0,0 +1,114 @@
+import sys
+import numpy as np
+import pigpio
+import profiler
+import txd
+from waveform import airtime_us, CountingPi, TxMeter
+from sub_converter import load_pulses, send_compiled
+# Sends several pulse trains on different GPIOs (e.g. 433.92 MHz and 315 MHz modules) at the same time.
+# Edges of all jobs are sort-merged by time into one wave with combined gpio masks, so one DMA timeline
+# drives every module and the whole batch takes as long as the longest job instead of their sum.
+# Usage: python3 multitx.py GPIO:file.sub[:start_ms[:repeat]] [GPIO:file.sub...] [--profile]
+
+# ==== CONFIG ====
+CBS_PER_PULSE = 3  # Merged pulse can switch some pins on and others off, that is one more control block
+# ================
+
+def job_events(gpio, pulses, start_us=0, repeat=1):
+    # Start time, on mask and off mask of every pulse, plus final low when the job ends
+    p = np.tile(np.asarray(pulses, dtype=np.int64), max(1, repeat))
+    d = np.abs(p)
+    mask = 1 << gpio
+    times = start_us + np.concatenate(([0], np.cumsum(d)[:-1]))
+    end = start_us + int(d.sum())
+    on = np.where(p > 0, mask, 0)
+    off = np.where(p > 0, 0, mask)
+    return np.append(times, end), np.append(on, 0), np.append(off, mask), end
+
+def check_overlap(jobs):
+    spans = {}
+    for gpio, pulses, start_us, repeat in jobs:
+        end = start_us + airtime_us(pulses) * max(1, repeat)
+        for other_start, other_end in spans.get(gpio, []):
+            if start_us < other_end and other_start < end:
+                raise ValueError(f"jobs on GPIO {gpio} overlap in time")
+        spans.setdefault(gpio, []).append((start_us, end))
+
+def merge_jobs(jobs):
+    # jobs: [(gpio, pulses, start_us, repeat), ...] -> compiled (n, 3) buffer, report
+    check_overlap(jobs)
+    events = [job_events(*job) for job in jobs]
+    times = np.concatenate([e[0] for e in events])
+    on = np.concatenate([e[1] for e in events])
+    off = np.concatenate([e[2] for e in events])
+    order = np.argsort(times, kind="stable")
+    times, on, off = times[order], on[order], off[order]
+
+    # Events at the same time become one pulse, next job on the same pin wins over final low of previous one
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(times) > 0)))
+    on = np.bitwise_or.reduceat(on, starts)
+    off = np.bitwise_or.reduceat(off, starts) & ~on
+    times = times[starts]
+    delays = np.diff(times, append=times[-1])
+    buf = np.stack((on, off, delays), axis=1).astype(np.uint32)
+    if times[0] > 0:  # Nothing happens before the first job starts
+        buf = np.concatenate((np.array([[0, 0, times[0]]], dtype=np.uint32), buf))
+
+    sequential = sum(airtime_us(pulses) * max(1, repeat) for _, pulses, _, repeat in jobs)
+    merged = int(times[-1])
+    return buf, {
+        "jobs": len(jobs),
+        "pulses": len(buf),
+        "sequential_us": sequential,
+        "merged_us": merged,
+        "saved_us": sequential - merged,
+    }
+
+def send_jobs(pi, jobs):
+    buf, report = merge_jobs(jobs)
+    gpios = sorted({job[0] for job in jobs})
+    for gpio in gpios:
+        pi.set_mode(gpio, pigpio.OUTPUT)
+        pi.write(gpio, 0)
+    with profiler.stage("transmit", pulses=len(buf)):
+        max_chunk_len = pi.wave_get_max_cbs() // (2 * CBS_PER_PULSE)
+        report["plan"] = send_compiled(pi, buf, max_chunk_len, 1 << 30, 1)
+    for gpio in gpios:
+        pi.write(gpio, 0)
+    return report
+
+def parse_job(text):
+    parts = text.split(":")
+    if len(parts) < 2 or len(parts) > 4:
+        raise ValueError(f"bad job '{text}', use GPIO:file.sub[:start_ms[:repeat]]")
+    gpio, path = int(parts[0]), parts[1]
+    start_us = int(float(parts[2]) * 1000) if len(parts) > 2 else 0
+    repeat = int(parts[3]) if len(parts) > 3 else 1
+    return gpio, load_pulses(path), start_us, repeat
+
+def main():
+    profiler.take_flag(sys.argv)
+    if len(sys.argv) < 2:
+        print("Usage: python3 multitx.py GPIO:file.sub[:start_ms[:repeat]] [GPIO:file.sub...] [--profile]")
+        sys.exit(1)
+    try:
+        jobs = [parse_job(arg) for arg in sys.argv[1:]]
+        buf, report = merge_jobs(jobs)
+    except ValueError as e:
+        print(f"Cannot send: {e}")
+        sys.exit(1)
+
+    print(f"{report['jobs']} jobs merged into {report['pulses']} pulses, {report['merged_us'] / 1e6:.2f} s airtime "
+          f"instead of {report['sequential_us'] / 1e6:.2f} s ({report['saved_us'] / 1e6:.2f} s saved)")
+    if txd.refuse_if_running():
+        sys.exit(1)
+    pi = CountingPi(pigpio.pi())
+    try:
+        with TxMeter(pi) as meter:
+            send_jobs(pi, jobs)
+        print(f"Done, {meter.summary()}")
+    finally:
+        pi.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import numpy as np
+import profiler
+from pulsetrain import PulseTrain
+# Pulse train clean-up shared by sub_converter and rfrp.
+# Every edge costs one pigpio pulse and DMA control blocks, noise edges (~100 uS on Flipper RAW captures)
+# and runs of same-sign durations only make the wave longer, so they are removed before sending or saving.
+
+# ==== CONFIG ====
+GLITCH_US = 120         # Shorter pulses are noise, they are given to the pulse before them
+TE_MIN_US = 150         # TE is looked for in this range
+TE_MAX_US = 2000
+TE_BIN_US = 10
+TE_MIN_SHARE = 0.05     # Histogram peak must hold at least this share of pulses to be TE
+SNAP_TOLERANCE = 0.3    # Only durations this close to the grid (in TE) are snapped
+SNAP_MAX_UNITS = 32     # Longer durations (gaps between frames) are kept as they are
+# ================
+
+def merge_same_sign(pulses):
+    # +300 +200 -100 -50 -> +500 -150, zero durations are dropped
+    p = np.asarray(pulses, dtype=np.int64)
+    p = p[p != 0]
+    if len(p) == 0:
+        return np.empty(0, dtype=np.int32)
+    starts = np.flatnonzero(np.concatenate(([True], (p[1:] > 0) != (p[:-1] > 0))))
+    return np.add.reduceat(p, starts).astype(np.int32)
+
+def drop_glitches(pulses, glitch_us=GLITCH_US):
+    # Glitch takes polarity of the last good pulse before it, so total time stays the same
+    p = np.asarray(pulses, dtype=np.int64)
+    good = np.abs(p) >= glitch_us
+    if glitch_us <= 0 or not good.any():
+        return merge_same_sign(p)
+    idx = np.where(good, np.arange(len(p)), -1)
+    np.maximum.accumulate(idx, out=idx)
+    idx[idx < 0] = np.flatnonzero(good)[0]  # Leading glitches go to the first good pulse
+    return merge_same_sign(np.where(p[idx] > 0, np.abs(p), -np.abs(p)))
+
+def estimate_te(pulses):
+    # Lowest strong peak of duration histogram, refined with median of durations around it
+    a = np.abs(np.asarray(pulses, dtype=np.int64))
+    a = a[(a >= TE_MIN_US) & (a <= TE_MAX_US)]
+    if len(a) < 8:
+        return None
+    bins = np.arange(TE_MIN_US, TE_MAX_US + TE_BIN_US, TE_BIN_US)
+    hist, _ = np.histogram(a, bins)
+    smooth = np.convolve(hist, np.ones(3), "same")
+    peaks = np.flatnonzero((smooth >= TE_MIN_SHARE * len(a))
+                           & (smooth >= np.roll(smooth, 1)) & (smooth >= np.roll(smooth, -1)))
+    if len(peaks) == 0:
+        return None
+    centre = bins[peaks[0]] + TE_BIN_US / 2
+    return int(np.median(a[np.abs(a - centre) <= centre * SNAP_TOLERANCE]))
+
+def snap_to_grid(pulses, te):
+    p = np.asarray(pulses, dtype=np.int64)
+    a = np.abs(p)
+    units = np.rint(a / te)
+    snap = (units >= 1) & (units <= SNAP_MAX_UNITS) & (np.abs(a - units * te) <= SNAP_TOLERANCE * te)
+    a = np.where(snap, units * te, a)
+    return np.where(p > 0, a, -a).astype(np.int32)
+
+def normalize(pulses, glitch_us=GLITCH_US, snap=False, te=None):
+    # Returns cleaned PulseTrain and report {edges_before, edges_after, reduction, te}
+    before = len(pulses)
+    with profiler.stage("normalize", pulses=before):
+        out = drop_glitches(pulses, glitch_us)
+        if snap:
+            te = te or estimate_te(out)
+            if te:
+                out = merge_same_sign(snap_to_grid(out, te))
+        else:
+            te = None
+    return PulseTrain(out), {
+        "edges_before": before,
+        "edges_after": len(out),
+        "reduction": round(1 - len(out) / before, 3) if before else 0.0,
+        "te": te,
+    }
+
+def describe(report):
+    text = f"{report['edges_before']} -> {report['edges_after']} edges ({report['reduction'] * 100:.0f}% fewer)"
+    if report["te"]:
+        text += f", snapped to TE {report['te']} uS"
+    return text
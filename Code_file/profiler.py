@@ -0,0 +1,85 @@
+import sys
+import json
+import time
+import atexit
+# Hot path instrumentation, off unless a script is started with --profile.
+# Stages are timed with perf_counter and counted with pulses and bytes they handled,
+# pigpio calls going through waveform.CountingPi show up as "pigpio.<method>".
+# Disabled stage() is just one flag check returning shared no-op object.
+# Usage: with profiler.stage("encode") as st: pulses = ...; st.pulses = len(pulses)
+
+enabled = False
+stages = {}   # name -> [calls, seconds, pulses, bytes]
+started = None
+output = sys.stderr
+
+class _Stage:
+    __slots__ = ("name", "pulses", "nbytes", "start")
+
+    def __init__(self, name, pulses, nbytes):
+        self.name = name
+        self.pulses = pulses
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start, self.pulses, self.nbytes)
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NULL = _NullStage()
+
+def stage(name, pulses=0, nbytes=0):
+    if not enabled:
+        return _NULL
+    return _Stage(name, pulses, nbytes)
+
+def record(name, seconds, pulses=0, nbytes=0):
+    s = stages.get(name)
+    if s is None:
+        s = stages[name] = [0, 0.0, 0, 0]
+    s[0] += 1
+    s[1] += seconds
+    s[2] += pulses
+    s[3] += nbytes
+
+def enable(report_at_exit=True):
+    global enabled, started
+    enabled = True
+    started = time.perf_counter()
+    if report_at_exit:
+        atexit.register(report)
+
+def summary():
+    result = {}
+    for name, (calls, seconds, pulses, nbytes) in sorted(stages.items()):
+        entry = {"calls": calls, "wall_ms": round(seconds * 1000, 3)}
+        if pulses:
+            entry["pulses"] = pulses
+            entry["pulses_per_s"] = round(pulses / seconds) if seconds else 0
+        if nbytes:
+            entry["bytes"] = nbytes
+            entry["bytes_per_s"] = round(nbytes / seconds) if seconds else 0
+        result[name] = entry
+    total = time.perf_counter() - started if started else 0.0
+    return {"wall_ms": round(total * 1000, 3), "stages": result}
+
+def report():
+    # One JSON line on stderr, so it does not mix with normal output
+    print(json.dumps(summary()), file=output)
+
+def take_flag(argv, flag="--profile"):
+    # For scripts parsing sys.argv by hand: removes flag and enables profiling when it was there
+    if flag in argv:
+        argv.remove(flag)
+        enable()
+        return True
+    return False
@@ -0,0 +1,54 @@
+import os
+import hashlib
+import numpy as np
+# Content-addressed cache of encoded pulse trains, one .npy file (int32) per key.
+# Files are loaded memory-mapped, least recently used ones are removed when cache gets too big.
+
+# ==== CONFIG ====
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pulse_cache")
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+# ================
+
+def cache_key(path, te_override, encoder_version):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    h.update(f"|te={te_override or 0}|v={encoder_version}".encode())
+    return h.hexdigest()
+
+def _path(key):
+    return os.path.join(CACHE_DIR, key + ".npy")
+
+def load(key):
+    path = _path(key)
+    try:
+        pulses = np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    os.utime(path)  # mtime is the LRU clock
+    return pulses
+
+def store(key, pulses):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _path(key)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, np.asarray(pulses, dtype=np.int32))
+    os.replace(tmp, path)  # Atomic, parallel precompile workers never see half written file
+
+def evict(max_bytes=MAX_CACHE_BYTES):
+    try:
+        entries = [e for e in os.scandir(CACHE_DIR) if e.name.endswith(".npy")]
+    except FileNotFoundError:
+        return
+    stats = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in entries]
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in sorted(stats):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -0,0 +1,142 @@
+import re
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+# Signed pulse train (+ high, - low, uS) passed between parser, encoders, cache, store and wave building.
+# Backed by int32 buffer, slices are views, concatenation and repeat only keep list of parts until
+# the data is really needed (np.asarray(train), len() does not need it). numpy functions and operators
+# work on it directly, results of arithmetic are plain arrays.
+# rfrp codes use level after the duration as sign (+ when line went high), see from_levels().
+
+RAW_LINE = re.compile(r"^[ \t]*RAW_Data:(.*)$", re.M)
+RAW_PER_LINE = 512
+
+class PulseTrain(NDArrayOperatorsMixin):
+    __slots__ = ("_parts", "_data", "_len")
+
+    def __init__(self, data=()):
+        if isinstance(data, PulseTrain):
+            self._parts, self._data, self._len = data._parts, data._data, data._len
+            return
+        self._data = np.asarray(data, dtype=np.int32).reshape(-1)
+        self._parts = None
+        self._len = len(self._data)
+
+    @classmethod
+    def concat(cls, *trains):
+        # No copy, parts are joined on first access to the data
+        train = cls.__new__(cls)
+        train._parts = []
+        for t in trains:
+            if isinstance(t, PulseTrain) and t._parts is not None:
+                train._parts.extend(t._parts)
+            elif len(t):
+                train._parts.append(t.array if isinstance(t, PulseTrain) else np.asarray(t, dtype=np.int32).reshape(-1))
+        train._data = None
+        train._len = sum(len(p) for p in train._parts)
+        return train
+
+    # ===== Buffer =====
+    @property
+    def array(self):
+        if self._data is None:
+            self._data = np.concatenate(self._parts) if self._parts else np.empty(0, dtype=np.int32)
+            self._parts = None
+        return self._data
+
+    def __array__(self, dtype=None, copy=None):
+        a = self.array
+        return a if dtype is None else a.astype(dtype, copy=False)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(x.array if isinstance(x, PulseTrain) else x for x in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def memoryview(self):
+        return memoryview(self.array)
+
+    def tobytes(self):
+        return self.array.tobytes()
+
+    @property
+    def dtype(self):
+        return np.dtype(np.int32)
+
+    @property
+    def nbytes(self):
+        return self._len * 4
+
+    @property
+    def ndim(self):
+        return 1
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PulseTrain(self.array[index])  # View into the same buffer
+        return int(self.array[index])
+
+    def __iter__(self):
+        return iter(self.array.tolist())
+
+    def __add__(self, other):
+        return PulseTrain.concat(self, other)
+
+    def __radd__(self, other):
+        return PulseTrain.concat(other, self)
+
+    def __repr__(self):
+        return f"PulseTrain({self._len} pulses, {self.airtime()} uS)"
+
+    # ===== Pulse operations =====
+    def airtime(self):
+        return int(np.abs(self.array.astype(np.int64)).sum())
+
+    def repeat(self, count, gap_us=0):
+        # count copies with gap_us of low after every copy, only references to the same buffer are kept
+        gap = [np.array([-gap_us], dtype=np.int32)] if gap_us else []
+        return PulseTrain.concat(*([self.array] + gap) * max(0, count))
+
+    def rescale(self, te_from, te_to):
+        # Same code with different TE, durations are scaled and rounded
+        a = np.rint(np.abs(self.array) * (te_to / te_from))
+        return PulseTrain(np.where(self.array > 0, a, -a))
+
+    def normalized(self, invert=False):
+        # Polarity normalised train: no zero durations, signs alternate, starts with high (leading silence dropped)
+        p = self.array[self.array != 0]
+        if invert:
+            p = -p
+        if len(p) == 0:
+            return PulseTrain()
+        starts = np.flatnonzero(np.concatenate(([True], (p[1:] > 0) != (p[:-1] > 0))))
+        p = np.add.reduceat(p.astype(np.int64), starts)
+        return PulseTrain(p[np.argmax(p > 0):] if (p > 0).any() else p[:0])
+
+    # ===== Formats =====
+    @classmethod
+    def from_sub_raw(cls, text):
+        # RAW_Data lines of .sub file (other lines are skipped), values are kept as they are
+        body = " ".join(m.group(1) for m in RAW_LINE.finditer(text))
+        return cls(np.array(body.split(), dtype=np.int32))
+
+    def to_sub_raw(self, per_line=RAW_PER_LINE):
+        a = self.array
+        return "".join("RAW_Data: " + " ".join(map(str, a[i:i + per_line].tolist())) + "\n"
+                       for i in range(0, len(a), per_line))
+
+    @classmethod
+    def from_levels(cls, levels, durations=None):
+        # rfrp [[level, duration], ...] or two arrays -> + duration when level is 1.
+        # Zero duration has no sign, its level is lost (to_levels gives it back as 0)
+        if durations is None:
+            s = np.asarray(levels, dtype=np.int64).reshape(-1, 2)
+            levels, durations = s[:, 0], s[:, 1]
+        d = np.asarray(durations, dtype=np.int32)
+        return cls(np.where(np.asarray(levels) == 1, d, -d))
+
+    def to_levels(self):
+        # (levels uint8, durations uint32), inverse of from_levels except for zero durations (level 0)
+        a = self.array
+        return (a > 0).astype(np.uint8), np.abs(a).astype(np.uint32)
@@ -0,0 +1,198 @@
+import os
+import sys
+import glob
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import normalize
+import profiler
+from sub_parser import FlipperSubParser
+from sub_converter import encode_protocol, resolve_protocol
+from decoder import ProtocolDecoder, most_common, GAP_MIN_US
+# Batch RAW -> Key converter. RAW captures of a plain fixed code (Princeton, CAME, ...) repeated many times
+# are rewritten as small Key .sub files, which sub_converter.py encodes again when sending.
+# Usage: python3 raw2key.py /path/to/sub_dir [out_dir] [--min-confidence 0.6] [--workers N] [--profile]
+#        out_dir defaults to sub_dir + "_key", directory tree is kept, files that do not match are not written
+
+# ==== CONFIG ====
+MIN_CONFIDENCE = 0.6    # Share of frames in capture decoding to the same key (halved when frame length does not fit)
+MIN_FRAMES = 2          # Same key has to be decoded at least this many times
+HIST_MIN_US = 50        # Duration histogram range and resolution (log spaced bins)
+HIST_MAX_US = 20000
+HIST_BINS = 200
+CLUSTER_MIN_SHARE = 0.02
+MAX_UNITS = 64          # Gaps are capped at this many TE for autocorrelation
+MIN_FRAME_PULSES = 8
+# ================
+
+# =======================
+# Analysis
+# =======================
+def duration_clusters(pulses):
+    # Peaks of log-spaced duration histogram, split at valleys, [(median, count), ...] shortest first
+    a = np.abs(np.asarray(pulses, dtype=np.int64))
+    a = a[(a >= HIST_MIN_US) & (a <= HIST_MAX_US)]
+    if len(a) == 0:
+        return []
+    bins = np.geomspace(HIST_MIN_US, HIST_MAX_US, HIST_BINS + 1)
+    hist, _ = np.histogram(a, bins)
+    smooth = np.convolve(hist, np.ones(3), "same")
+    peaks = np.flatnonzero((smooth >= CLUSTER_MIN_SHARE * len(a))
+                           & (smooth >= np.roll(smooth, 1)) & (smooth > np.roll(smooth, -1)))
+    if len(peaks) == 0:
+        return []
+    # Cluster borders at the lowest bin between two neighbouring peaks
+    borders = [bins[p + np.argmin(smooth[p:q + 1])] for p, q in zip(peaks[:-1], peaks[1:])]
+    labels = np.digitize(a, borders)
+    clusters = []
+    for i in range(len(peaks)):
+        members = a[labels == i]
+        if len(members):
+            clusters.append((int(np.median(members)), len(members)))
+    return clusters
+
+def frame_period(pulses, te):
+    # Autocorrelation of pulse train in TE units, smallest lag close to the best one is the frame length.
+    # Lag is picked on biased estimate (long lags have few terms and are too noisy unbiased), reported unbiased
+    p = np.asarray(pulses, dtype=np.int64)
+    n = len(p)
+    if n < 2 * MIN_FRAME_PULSES:
+        return 0, 0.0
+    units = np.minimum(np.rint(np.abs(p) / te), MAX_UNITS) * np.sign(p)
+    x = units - units.mean()
+    size = 1 << (2 * n - 1).bit_length()
+    f = np.fft.rfft(x, size)
+    ac = np.fft.irfft(f * np.conj(f), size)[:n]
+    if ac[0] <= 0:
+        return 0, 0.0
+    biased = ac / ac[0]
+    lags = np.arange(MIN_FRAME_PULSES, n // 2 + 1)
+    if len(lags) == 0:
+        return 0, 0.0
+    best = biased[lags].max()
+    lag = int(lags[np.argmax(biased[lags] >= 0.9 * best)])
+    return lag, float(biased[lag] * n / (n - lag))
+
+def decode_pulses(pulses):
+    # .sub polarity (+ high), decoder wants pigpio callback order (new level after duration)
+    p = np.asarray(pulses)
+    decoder = ProtocolDecoder()
+    decoder.feed_many(zip((p < 0).tolist(), np.abs(p).tolist()))
+    return decoder.frames
+
+def frame_pulses(frame):
+    return encode_protocol(resolve_protocol(frame["protocol"], frame["bit"]), frame["key"], frame["te"])
+
+def analyse(pulses):
+    pulses = normalize.drop_glitches(pulses)
+    clusters = duration_clusters(pulses)
+    result = {
+        "pulses": len(pulses),
+        "short": clusters[0][0] if clusters else None,
+        "long": clusters[1][0] if len(clusters) > 1 else None,
+        "frames": int(np.sum(pulses <= -GAP_MIN_US)),
+    }
+    if not clusters:
+        return result
+    result["period"], result["autocorrelation"] = frame_period(pulses, clusters[0][0])
+
+    frame, seen = most_common(decode_pulses(pulses))
+    if frame is None:
+        return result
+    result.update(frame=frame, seen=seen)
+
+    # Encoded frame has to decode to the same key and be as long as the repeating unit found above
+    # (stop of one frame merges with header of the next one on air)
+    encoded = frame_pulses(frame)
+    check, _ = most_common(decode_pulses(normalize.merge_same_sign(np.tile(encoded, 3))))
+    result["verified"] = bool(check) and check["key"] == frame["key"] and check["protocol"] == frame["protocol"]
+    on_air = len(normalize.merge_same_sign(np.tile(encoded, 2))) - len(normalize.merge_same_sign(encoded))
+    fits = result["period"] == on_air
+    confidence = min(1.0, seen / max(1, result["frames"]))
+    result["confidence"] = round(confidence if fits else confidence / 2, 3)
+    return result
+
+# =======================
+# Conversion
+# =======================
+def key_sub_text(meta, frame):
+    lines = [
+        "Filetype: Flipper SubGhz Key File",
+        "Version: 1",
+        f"Frequency: {meta.get('Frequency', '433920000')}",
+        f"Preset: {meta.get('Preset', 'FuriHalSubGhzPresetOok650Async')}",
+        f"Protocol: {frame['protocol']}",
+        f"Bit: {frame['bit']}",
+        f"Key: {frame['key']}",
+        f"TE: {frame['te']}",
+    ]
+    return "\n".join(lines) + "\n"
+
+def convert_one(job):
+    src, dst, min_confidence = job
+    try:
+        parser = FlipperSubParser(src)
+        if parser.meta.get("Protocol", "RAW") != "RAW":
+            return {"path": src, "status": "not raw"}
+        result = analyse(parser.pulses())
+    except Exception as e:
+        return {"path": src, "status": "error", "error": str(e)}
+    result["path"] = src
+    if "frame" not in result or result["seen"] < MIN_FRAMES or not result["verified"]:
+        result["status"] = "no match"
+    elif result["confidence"] < min_confidence:
+        result["status"] = "low confidence"
+    else:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        with open(dst, "w") as f:
+            f.write(key_sub_text(parser.meta, result["frame"]))
+        result["status"] = "converted"
+        result["out"] = dst
+    return result
+
+def convert_tree(src_dir, out_dir, min_confidence=MIN_CONFIDENCE, workers=None):
+    paths = sorted(glob.glob(os.path.join(src_dir, "**", "*.sub"), recursive=True))
+    jobs = [(p, os.path.join(out_dir, os.path.relpath(p, src_dir)), min_confidence) for p in paths]
+    results = []
+    # Workers are other processes, with --profile only the whole batch is timed
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            profiler.stage("raw2key", nbytes=sum(os.path.getsize(p) for p in paths) if profiler.enabled else 0) as st:
+        for result in pool.map(convert_one, jobs, chunksize=4):
+            results.append(result)
+            name = os.path.relpath(result["path"], src_dir)
+            if "frame" in result:
+                frame = result["frame"]
+                print(f"{name}: {result['status']}, {frame['protocol']} {frame['bit']} bit key {frame['key']} TE {frame['te']}, "
+                      f"{result['seen']}/{result['frames']} frames, period {result['period']} pulses, confidence {result['confidence']}")
+            elif result["status"] == "error":
+                print(f"{name}: error, {result['error']}")
+            else:
+                print(f"{name}: {result['status']}")
+        st.pulses = sum(r.get("pulses", 0) for r in results)
+    converted = sum(r["status"] == "converted" for r in results)
+    raw = sum(r["status"] != "not raw" for r in results)
+    print(f"Converted {converted} of {raw} RAW files into {out_dir}")
+    return results
+
+def main():
+    profiler.take_flag(sys.argv)
+    args = sys.argv[1:]
+    min_confidence = MIN_CONFIDENCE
+    workers = None
+    if "--min-confidence" in args:
+        i = args.index("--min-confidence")
+        min_confidence = float(args[i + 1])
+        del args[i:i + 2]
+    if "--workers" in args:
+        i = args.index("--workers")
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+    if len(args) not in (1, 2):
+        print("Usage: python3 raw2key.py /path/to/sub_dir [out_dir] [--min-confidence 0.6] [--workers N] [--profile]")
+        sys.exit(1)
+
+    src_dir = args[0].rstrip("/")
+    out_dir = args[1] if len(args) == 2 else src_dir + "_key"
+    convert_tree(src_dir, out_dir, min_confidence, workers)
+
+if __name__ == "__main__":
+    main()
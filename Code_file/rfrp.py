@@ -1,26 +1,47 @@
+import sys
 import argparse
-import json
 import pigpio
 import time
 import os
+import numpy as np
+from pulsetrain import PulseTrain
+from waveform import CountingPi, TxMeter
+from code_store import CodeStore, signal_pulses
+import txd
+from decoder import ProtocolDecoder, most_common
+from capture import capture, signed_durations
+import normalize
+import profiler
+import squelch
+import fingerprint
+import framerepeat
 # ========== CONFIG =========
-DEFAULT_FILENAME = "saved_codes.json"
+DEFAULT_FILENAME = "saved_codes.db"
 DEFAULT_RECORD_MS = 500
 MAX_PULSES = 5400
+MIN_DECODE_REPEATS = 2 # Decoded frame has to be seen this many times before it is saved instead of raw data
+SQUELCH_RECORD_MS = 30000 # Longest wait for bursts with --squelch
+IDENTIFY_TOP = 5 # Matches shown by --identify
 # ===========================
-def record(pi, filename, name, rx_gpio, record_time_ms):
+def record(pi, filename, name, rx_gpio, record_time_ms, keep_raw=False, glitch_us=normalize.GLITCH_US, snap=False):
     print(f"Recording '{name}' on GPIO {rx_gpio} for {record_time_ms} ms (max {MAX_PULSES} transitions)...")
 
     last_tick = None
-    recording = []
+    levels = np.zeros(MAX_PULSES, dtype=np.uint8)  # Filled in place, no list per edge
+    durations = np.zeros(MAX_PULSES, dtype=np.int32)
+    count = 0
     error = False
+    decoder = ProtocolDecoder()
 
     def cb_func(gpio, level, tick):
-        nonlocal last_tick, error
+        nonlocal last_tick, error, count
         if last_tick is not None:
             duration = pigpio.tickDiff(last_tick, tick)
-            if len(recording) < MAX_PULSES:
-                recording.append([level, duration])
+            decoder.feed(level, duration)
+            if count < MAX_PULSES:
+                levels[count] = level
+                durations[count] = duration
+                count += 1
             else:
                 error = True
         last_tick = tick
@@ -30,85 +51,247 @@ def record(pi, filename, name, rx_gpio, record_time_ms):
     time.sleep(record_time_ms / 1000.0)
     cb.cancel()
 
-    if not recording:
+    if not count:
         print("No signal recorded, check you receiver or connection!")
         return
 
     if error:
         print(f"Max pulse limit ({MAX_PULSES}) exceeded! Recording was cut off.")
 
-    data = {}
-    if os.path.exists(filename) and os.path.getsize(filename) > 0:
-     try:
-        with open(filename, "r") as f:
-            data = json.load(f)
-     except json.JSONDecodeError:
-         print(f"Warning: '{filename}' is invalid or empty. JSON error!")
+    save_code(filename, name, PulseTrain.from_levels(levels[:count], durations[:count]), decoder.frames, keep_raw, glitch_us, snap)
 
+def save_code(filename, name, recording, frames, keep_raw=False, glitch_us=normalize.GLITCH_US, snap=False, split=False):
+    # recording is PulseTrain in rfrp convention (+ when line went high after the duration)
+    store = CodeStore(filename)
 
-    data[name] = recording[:MAX_PULSES]
+    frame, seen = most_common(frames)
+    if frame and seen >= MIN_DECODE_REPEATS and not keep_raw:
+        # Recognised code is saved as protocol + key, it is encoded again when sent
+        store.put(name, frame)
+    else:
+        # Raw code is cleaned before saving, decoder above still saw every edge
+        pulses, report = normalize.normalize(recording, glitch_us, snap)
+        print(f"Normalised {normalize.describe(report)}")
+        recording = pulses
+        # split: frame boundaries (after every long low) are saved with the code
+        store.put(name, pulses, squelch.frame_starts(pulses > 0, np.abs(pulses)) if split else None)
+
+    if frame:
+        print(f"Recognised {frame['protocol']} key {frame['key']} ({frame['bit']} bit, TE {frame['te']} uS) {seen}X")
+    if frame and seen >= MIN_DECODE_REPEATS and not keep_raw:
+        print(f"[+] Saved decoded code to '{name}'.")
+    else:
+        print(f"[+] Saved {len(recording)} transitions to '{name}'.")
+
+    # Fingerprint index follows the store, so --identify finds new codes too
+    index = fingerprint.FingerprintIndex()
+    if index.add(f"{filename}:{name}", signal_pulses(store.get(name))):
+        index.save()
+
+def record_bulk(pi, filename, name, rx_gpio, record_time_ms, out=None, keep_raw=False, glitch_us=normalize.GLITCH_US, snap=False):
+    # Reads pigpio notification pipe in chunks, whole capture can be streamed to out file
+    # (int32 uS, rfrp convention: sign is level after the duration, + is a low that ended with rising edge)
+    print(f"Bulk recording '{name}' on GPIO {rx_gpio} for {record_time_ms} ms...")
+
+    parts = []
+    kept = 0
+    decoder = ProtocolDecoder()
+    sink = open(out, "wb") if out else None
+
+    def on_edges(levels, durations, ticks):
+        nonlocal kept
+        decoder.feed_many(zip(levels.tolist(), durations.tolist()))
+        if sink:
+            sink.write(signed_durations(levels, durations).tobytes())
+        n = MAX_PULSES - kept  # Stored code keeps only what fits into one wave
+        if n > 0:
+            parts.append(PulseTrain.from_levels(levels[:n], durations[:n]))
+            kept += len(parts[-1])
+
+    pi.set_mode(rx_gpio, pigpio.INPUT)
+    try:
+        stats = capture(pi, rx_gpio, record_time_ms / 1000.0, on_edges)
+    finally:
+        if sink:
+            sink.close()
+
+    print(f"Captured {stats['edges']} edges in {stats['seconds']} s ({stats['edge_rate']} edges/s), {stats['dropped']} dropped reports")
+    if out:
+        print(f"Full capture streamed to '{out}'.")
+    if not kept:
+        print("No signal recorded, check you receiver or connection!")
+        return
+
+    save_code(filename, name, PulseTrain.concat(*parts), decoder.frames, keep_raw, glitch_us, snap)
+
+def record_squelch(pi, filename, name, rx_gpio, record_time_ms, bursts=1, keep_raw=False, glitch_us=normalize.GLITCH_US, snap=False):
+    # Bulk capture with pigpio filters on, receiver noise is dropped and only bursts of signal are saved
+    # as name, name_2, ... Capture stops after given number of bursts or record time.
+    print(f"Waiting for {bursts} burst(s) on GPIO {rx_gpio}, up to {record_time_ms} ms...")
+
+    segmenter = squelch.BurstSegmenter()
+    pi.set_mode(rx_gpio, pigpio.INPUT)
+    pi.set_glitch_filter(rx_gpio, squelch.GLITCH_FILTER_US)
+    if squelch.NOISE_STEADY_US:
+        pi.set_noise_filter(rx_gpio, squelch.NOISE_STEADY_US, squelch.NOISE_ACTIVE_US)
+    try:
+        stats = capture(pi, rx_gpio, record_time_ms / 1000.0, lambda levels, durations, ticks: segmenter.feed(levels, durations),
+                        stop=lambda: len(segmenter.bursts) >= bursts)
+    finally:
+        pi.set_glitch_filter(rx_gpio, 0)
+        if squelch.NOISE_STEADY_US:
+            pi.set_noise_filter(rx_gpio, 0, 0)
+    found = segmenter.flush()[:bursts]
+
+    kept = sum(len(b["durations"]) for b in found)
+    print(f"Captured {stats['edges']} edges in {stats['seconds']} s, {len(found)} burst(s) kept {kept} of them")
+    if not found:
+        print("No signal recorded, check you receiver or connection!")
+        return
+
+    for i, burst in enumerate(found):
+        code_name = name if i == 0 else f"{name}_{i + 1}"
+        print(f"Burst {i + 1}: {len(burst['durations'])} edges, {len(burst['frames'])} frame(s) from edge {burst['first_edge']}")
+        recording = PulseTrain.from_levels(burst["levels"], burst["durations"])[:MAX_PULSES]
+        decoder = ProtocolDecoder()
+        decoder.feed_many(zip(burst["levels"].tolist(), burst["durations"].tolist()))
+        save_code(filename, code_name, recording, decoder.frames, keep_raw, glitch_us, snap, split=True)
 
-    with open(filename, "w") as f:
-        json.dump(data, f, indent=2)
+def decode(filename, name):
+    store = CodeStore(filename)
+    if name not in store:
+        print(f"No code named '{name}' found!")
+        return
+    signal = store.get(name)
+    if isinstance(signal, dict):
+        print(f"'{name}' is already decoded: {signal}")
+        return
+    frames = ProtocolDecoder().feed_many(zip((signal > 0).tolist(), np.abs(signal).tolist()))
+    frame, seen = most_common(frames)
+    if frame:
+        print(f"'{name}' is {frame['protocol']} key {frame['key']} ({frame['bit']} bit, TE {frame['te']} uS), seen {seen}X")
+    else:
+        print(f"'{name}' does not match any known protocol.")
 
-    print(f"[+] Saved {len(recording[:MAX_PULSES])} transitions to '{name}'.")
+def identify(filename, name, top=IDENTIFY_TOP):
+    # Saved codes and indexed .sub files most similar to saved code (or .sub file given as name)
+    store = CodeStore(filename)
+    if name.endswith(".sub"):
+        own = name
+        pulses = fingerprint.load_source(name)
+    elif name in store:
+        own = f"{filename}:{name}"
+        pulses = signal_pulses(store.get(name))
+    else:
+        print(f"No code named '{name}' found!")
+        return
+
+    start = time.perf_counter()
+    index = fingerprint.FingerprintIndex()
+    matches = []
+    for match in index.query(pulses, 2 * top, exclude=(own,)):
+        # Codes deleted from store stay in index until they are saved again
+        source, _, code = match[0].rpartition(":")
+        if source == filename and code not in store:
+            continue
+        matches.append(match)
+    elapsed = (time.perf_counter() - start) * 1000
+    if not matches:
+        print(f"No similar code among {len(index)} fingerprints ({elapsed:.1f} ms).")
+        return
+    print(f"Closest to '{name}' among {len(index)} fingerprints ({elapsed:.1f} ms):")
+    for match_name, score, info in matches[:top]:
+        print(f"  {score:.3f}  {match_name}  (TE {info['te']} uS, {info['pulses']} pulses)")
 
-def send(pi, filename, name, tx_gpio):
+def send(pi, filename, name, tx_gpio, use_daemon=False, repeat=1):
     if not os.path.exists(filename):
         print(f"File '{filename}' not found, check your directory!")
         return
 
-    with open(filename, "r") as f:
-        data = json.load(f)
-
-    if name not in data:
+    store = CodeStore(filename)
+    if name not in store:
         print(f"No code named '{name}' found!")
         return
 
-    signal = data[name]
-    wf = []
+    signal = store.get(name)
 
-    for level, duration in signal:
-        if level == 1:
-            wf.append(pigpio.pulse(1 << tx_gpio, 0, duration))
-        else:
-            wf.append(pigpio.pulse(0, 1 << tx_gpio, duration))
-
-    pi.set_mode(tx_gpio, pigpio.OUTPUT)
-    pi.wave_add_new()
-    pi.wave_add_generic(wf)
-    wave_id = pi.wave_create()
-    if wave_id >= 0:
-        pi.wave_send_once(wave_id)
-        print(f"Sending '{name}' on GPIO {tx_gpio}...")
-        while pi.wave_tx_busy():
-            pass
-        pi.wave_delete(wave_id)
-    else:
-        print("Failed to create waveform.")
+    if use_daemon:
+        print(f"Sending '{name}' on GPIO {tx_gpio} via transmit daemon...")
+        try:
+            txd.send_pulses(signal_pulses(signal), tx_gpio, repeat)
+        except OSError:
+            print("Transmit daemon not running, start txd.py")
+            sys.exit(1)
+        except RuntimeError as e:
+            print(f"Transmit daemon failed: {e}")
+            sys.exit(1)
+        return
+
+    # Repeated frame of the recording is uploaded once, whole code is looped repeat times by pigpiod
+    pulses = signal_pulses(signal)
+    layout = framerepeat.split(pulses)
+    if not framerepeat.fits(pi, layout):
+        print("Failed to create waveform, code is too long.")
+        return
+    print(f"Sending '{name}' on GPIO {tx_gpio} {repeat}X ({framerepeat.describe(layout)})...")
+    with TxMeter(pi) as meter:
+        framerepeat.send(pi, tx_gpio, layout, repeat)
+    print(f"Done, {meter.summary()}")
 
 def main():
     parser = argparse.ArgumentParser(description="433 MHz ASK recorder/player")
     parser.add_argument("--record", action="store_true", help="Record a signal")
     parser.add_argument("--send", action="store_true", help="Send a signal")
+    parser.add_argument("--decode", action="store_true", help="Identify protocol of a saved raw signal")
+    parser.add_argument("--identify", action="store_true", help="Find saved codes and indexed .sub files similar to this one (with --record: after recording)")
+    parser.add_argument("--bulk", action="store_true", help="Record from notification pipe, no edge limit")
+    parser.add_argument("--out", help="Stream whole bulk recording to this file (int32 uS, + = low that ended going high, - = high that ended going low)")
+    parser.add_argument("--squelch", action="store_true", help="Bulk record until signal bursts show up, save only the bursts")
+    parser.add_argument("--bursts", type=int, default=1, help="Number of bursts to save with --squelch")
+    parser.add_argument("--repeat", type=int, default=1, help="Send the code this many times")
+    parser.add_argument("--daemon", action="store_true", help="Send through running transmit daemon (txd.py)")
+    parser.add_argument("--raw", action="store_true", help="Always save raw transitions, even when protocol is recognised")
+    parser.add_argument("--glitch", type=int, default=normalize.GLITCH_US, help="Drop raw pulses shorter than this (uS), 0 keeps all")
+    parser.add_argument("--snap", action="store_true", help="Snap raw durations to estimated TE grid")
+    parser.add_argument("--profile", action="store_true", help="Print JSON timing summary of every stage on exit")
     parser.add_argument("--name", required=True, help="Name of signal")
-    parser.add_argument("--file", default=DEFAULT_FILENAME, help="JSON file")
+    parser.add_argument("--file", default=DEFAULT_FILENAME, help="Code store file")
     parser.add_argument("--time", type=int,  help="Recording time (ms)")
     parser.add_argument("--tx", type=int, help="TX GPIO pin")
     parser.add_argument("--rx", type=int, help="RX GPIO pin")
     args = parser.parse_args()
+    if args.profile:
+        profiler.enable()
+
+    if args.decode:
+        decode(args.file, args.name)
+        return
+    if args.identify and not args.record:
+        identify(args.file, args.name)
+        return
+    if args.send and args.daemon:
+        send(None, args.file, args.name, args.tx, use_daemon=True, repeat=args.repeat)
+        return
+    if args.send and txd.refuse_if_running(" or send with --daemon"):
+        return
 
-    pi = pigpio.pi()
+    pi = CountingPi(pigpio.pi())
 
     try:
-        if args.record:
-            record(pi, args.file, args.name, args.rx, args.time)
+        if args.record and args.squelch:
+            record_squelch(pi, args.file, args.name, args.rx, args.time or SQUELCH_RECORD_MS, args.bursts, args.raw, args.glitch, args.snap)
+        elif args.record and args.bulk:
+            record_bulk(pi, args.file, args.name, args.rx, args.time, args.out, args.raw, args.glitch, args.snap)
+        elif args.record:
+            record(pi, args.file, args.name, args.rx, args.time, args.raw, args.glitch, args.snap)
         elif args.send:
-            send(pi, args.file, args.name, args.tx)
+            send(pi, args.file, args.name, args.tx, repeat=args.repeat)
         else:
-            print("Use --record or --send.")
+            print("Use --record, --send or --identify.")
     finally:
         pi.stop()
+    if args.record and args.identify:
+        identify(args.file, args.name)
 
 if __name__ == "__main__":
     main()
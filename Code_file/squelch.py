@@ -0,0 +1,125 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+# Squelch for continuous recording: receiver noise between button presses is thrown away,
+# only bursts of real signal are kept. Edge is "active" when the window of last WINDOW_EDGES durations
+# looks like a code (plausible pulse lengths, few distinct lengths, high enough edge rate).
+# Burst starts at first active window (plus pre-trigger edges before it) and ends HANG_US after the last one.
+# Edges use pigpio callback convention, (levels, durations): line went to level after duration.
+
+# ==== CONFIG ====
+GLITCH_FILTER_US = 100     # pigpio set_glitch_filter on RX pin, shorter pulses never reach us
+NOISE_STEADY_US = 0        # pigpio set_noise_filter (0 = off), can cut codes when set too high
+NOISE_ACTIVE_US = 0
+WINDOW_EDGES = 24
+PRE_TRIGGER_EDGES = 32     # Kept from before the trigger, start of code is usually a bit noisy
+MIN_PULSE_US = 150
+MAX_PULSE_US = 30000       # Gaps between repeated frames are still part of burst
+PLAUSIBLE_SHARE = 0.9
+BINS_PER_OCTAVE = 4        # Duration histogram resolution for counting distinct lengths (~19% wide bins)
+MAX_DISTINCT = 6
+MAX_WINDOW_US = 200000     # Window has to fit in this time, sparse noise never triggers
+HANG_US = 100000           # Burst ends this long after last active edge
+MAX_BURST_EDGES = 200000
+FRAME_GAP_US = 5000        # Low longer than this separates frames inside burst
+# ================
+
+def activity(durations):
+    # Flag per window of WINDOW_EDGES durations, window i ends at durations[i + WINDOW_EDGES - 1]
+    win = sliding_window_view(np.asarray(durations, dtype=np.float64), WINDOW_EDGES)
+    plausible = ((win >= MIN_PULSE_US) & (win <= MAX_PULSE_US)).mean(axis=1) >= PLAUSIBLE_SHARE
+    fast = win.sum(axis=1) <= MAX_WINDOW_US
+    bins = np.sort(np.rint(np.log2(np.maximum(win, 1)) * BINS_PER_OCTAVE), axis=1)
+    distinct = 1 + np.count_nonzero(np.diff(bins, axis=1), axis=1)
+    last = win[:, -1] <= MAX_PULSE_US  # Edge after long silence is never active itself
+    return plausible & fast & last & (distinct <= MAX_DISTINCT)
+
+def frame_starts(levels, durations, gap_us=FRAME_GAP_US):
+    # Index of first edge of every frame, frames are split after long lows (rising edge after gap)
+    levels = np.asarray(levels)
+    durations = np.asarray(durations)
+    return np.concatenate(([0], np.flatnonzero((levels == 1) & (durations >= gap_us)) + 1)).astype(np.int64)
+
+class BurstSegmenter:
+    def __init__(self):
+        # Pre-trigger ring when idle, current burst when active, activity flag of every edge in it
+        self.levels = np.empty(0, dtype=np.uint8)
+        self.durations = np.empty(0, dtype=np.uint32)
+        self.flags = np.empty(0, dtype=bool)
+        self.active = False
+        self.last_active = -1   # Index of last active edge in current burst
+        self.seen = 0
+        self.bursts = []        # {"levels", "durations", "frames", "first_edge"}
+
+    def feed(self, levels, durations):
+        # Edges of one capture chunk, returns number of bursts finished by it
+        done = len(self.bursts)
+        keep = len(self.durations)
+        self.levels = np.concatenate((self.levels, np.asarray(levels, dtype=np.uint8)))
+        self.durations = np.concatenate((self.durations, np.asarray(durations, dtype=np.uint32)))
+        self.seen += len(durations)
+
+        # Windows ending at new edges, they may start in older edges
+        flags = np.zeros(len(self.durations) - keep, dtype=bool)
+        first = max(keep, WINDOW_EDGES - 1)
+        if len(self.durations) > first:
+            flags[first - keep:] = activity(self.durations[first - WINDOW_EDGES + 1:])
+        self.flags = np.concatenate((self.flags, flags))
+
+        pos = keep
+        while pos < len(self.durations):
+            pos = self._burst(pos) if self.active else self._idle(pos)
+        if not self.active:
+            self._drop(max(0, len(self.durations) - PRE_TRIGGER_EDGES - WINDOW_EDGES))
+        return len(self.bursts) - done
+
+    def _idle(self, pos):
+        hits = np.flatnonzero(self.flags[pos:])
+        if len(hits) == 0:
+            return len(self.durations)
+        trigger = pos + hits[0]
+        start = max(0, trigger - WINDOW_EDGES + 1 - PRE_TRIGGER_EDGES)
+        self._drop(start)
+        self.active = True
+        self.last_active = trigger - start
+        return self.last_active + 1
+
+    def _burst(self, pos):
+        # Time since last active edge, burst ends once it is over HANG_US
+        d = self.durations[pos:].astype(np.int64)
+        idx = np.where(self.flags[pos:], np.arange(len(d)), -1)
+        np.maximum.accumulate(idx, out=idx)
+        elapsed = np.cumsum(d)
+        quiet_before = int(self.durations[self.last_active + 1:pos].sum(dtype=np.int64))
+        quiet = np.where(idx >= 0, elapsed - elapsed[np.maximum(idx, 0)], elapsed + quiet_before)
+        over = np.flatnonzero(quiet > HANG_US)
+        stop = over[0] if len(over) else len(d) - 1
+        if idx[stop] >= 0:
+            self.last_active = pos + idx[stop]
+        if len(over) or len(self.durations) >= MAX_BURST_EDGES:
+            self._finish()
+            return 0
+        return len(self.durations)
+
+    def _finish(self):
+        end = self.last_active + 1
+        levels, durations = self.levels[:end], self.durations[:end]
+        self.bursts.append({
+            "levels": levels,
+            "durations": durations,
+            "frames": frame_starts(levels, durations),
+            "first_edge": self.seen - len(self.durations),
+        })
+        self._drop(end)
+        self.active = False
+        self.last_active = -1
+
+    def _drop(self, count):
+        self.levels = self.levels[count:]
+        self.durations = self.durations[count:]
+        self.flags = self.flags[count:]
+
+    def flush(self):
+        # End of capture, open burst is closed at its last active edge
+        if self.active:
+            self._finish()
+        return self.bursts
@@ -1,9 +1,24 @@
 import sys
 import os
+import glob
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pigpio
+import pulse_cache
+import normalize
+import profiler
+import txd
+import framerepeat
+from waveform import compile_pulses, create_compiled_wave, airtime_us, wait_tx_done, pi_clock, CountingPi, TxMeter
+from sub_parser import FlipperSubParser
+from pulsetrain import PulseTrain
 # More advanced version of sub converter, now supports various range of protocols, some are maybe not ASK or on 433.92MHz, but I added them just to be sure anyway.
 # ==== CONFIG ====
-MAX_PULSES_PER_WAVE = 5400
+CBS_PER_PULSE = 2 # pigpiod DMA control blocks per pulse (gpio on/off + delay), for sizing stream chunks
+ENCODER_VERSION = 4 # Bump when encoders change, old cached pulse trains are then ignored
+NORMALIZE_GLITCH_US = 0 # RAW pulses shorter than this are dropped as noise (e.g. normalize.GLITCH_US), 0 keeps them
+NORMALIZE_SNAP = False # Snap durations to estimated TE grid
 # ================
 
 # =======================
@@ -176,133 +191,260 @@ PROTOCOLS = {
 # Maybe will add more in the future
 
 # =======================
-# Parsers
+# Protocol registry
 # =======================
-class FlipperSubParser:
-    def __init__(self, path):
-        self.path = path
-        self.meta = {}
-        self.raw_blocks = []
-        self.parse_file()
-
-    def parse_file(self):
-        with open(self.path, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                if ":" in line:
-                    key, val = line.split(":", 1)
-                    self.meta[key.strip()] = val.strip()
-
-                if line.startswith("RAW_Data:"):
-                    raw_line = line.split(":", 1)[1].strip()
-                    pulses = [int(x) for x in raw_line.split()]
-                    self.raw_blocks.append(pulses)
-                elif line.startswith("+") or line.startswith("-"):
-                    pulses = [int(x) for x in line.split()]
-                    if self.raw_blocks:
-                        self.raw_blocks[-1].extend(pulses)
-
+class UnsupportedProtocolError(ValueError):
+    pass
+
+# CAME files only say "CAME", variant is picked by Bit
+CAME_VARIANTS = {12: "Came12", 18: "Came18", 24: "Came24", 25: "Came25"}
+
+class ProtocolEncoder:
+    # PROTOCOLS entry precompiled into byte lookup table: row = byte value, columns = segments of its 8 bits.
+    # Tables are scaled by TE once, encoding a key is then just header + table rows + stop.
+    def __init__(self, name, proto_def):
+        self.name = name
+        self.short = proto_def["short"]
+        self.bit_len = proto_def["bit_len"]
+
+        def flat(segs):
+            return [val for seg in segs for val in seg]
+
+        self.header = np.array(flat(proto_def.get("header", [])), dtype=np.int32)
+        self.stop = np.array(flat(proto_def.get("stop", [])), dtype=np.int32)
+        bits = [flat(proto_def["bit_map"].get(b, [])) for b in "01"]
+        if len(bits[0]) != len(bits[1]):
+            raise ValueError(f"{name}: bit_map segments for 0 and 1 must have same length")
+        self.seg_len = len(bits[0])
+        bit_table = np.array(bits, dtype=np.int32)
+        byte_bits = (np.arange(256)[:, None] >> np.arange(7, -1, -1)) & 1  # MSB first, like the key string
+        self.byte_table = bit_table[byte_bits].reshape(256, 8 * self.seg_len)
+        self._scaled = {}
+        self.tables(self.short)
+
+    def tables(self, te):
+        scaled = self._scaled.get(te)
+        if scaled is None:
+            scaled = (self.header * te, self.byte_table * te, self.stop * te)
+            self._scaled[te] = scaled
+        return scaled
+
+    def encode(self, key_hex, te_override=None):
+        te = te_override if te_override else self.short  # Princeton often has TE, this is for better precision
+        header, byte_table, stop = self.tables(te)
+
+        # Key padded to protocol's bit_len (longer keys keep all their bits), then to whole bytes
+        key = int(key_hex.replace(" ", ""), 16)
+        bit_len = max(self.bit_len, key.bit_length())
+        nbytes = (bit_len + 7) // 8
+        key_bytes = np.frombuffer(key.to_bytes(nbytes, "big"), dtype=np.uint8)
+        body = byte_table[key_bytes].ravel()[(nbytes * 8 - bit_len) * self.seg_len:]
+
+        # Stop - eventhough some protocol dont have stop bit, it is mandatory to make last bit low to prevent trailing of the last bit from key.
+        # Header and stop are the cached scaled tables, they are joined with body only when the train is used
+        return PulseTrain.concat(header, body, stop)
+
+REGISTRY = {name: ProtocolEncoder(name, proto_def) for name, proto_def in PROTOCOLS.items()}
+
+def resolve_protocol(proto, bit_len=0):
+    # Protocol name from .sub file -> registry name
+    if proto == "CAME":
+        if bit_len not in CAME_VARIANTS:
+            raise UnsupportedProtocolError(f"CAME with {bit_len} bits is not supported (only {sorted(CAME_VARIANTS)})")
+        return CAME_VARIANTS[bit_len]
+    if proto not in REGISTRY:
+        raise UnsupportedProtocolError(f"Protocol '{proto}' is not supported")
+    return proto
 
 # =======================
 # Encoders
 # =======================
-def encode_protocol(proto_def, key_hex, te_override=None):
-    pulses = []
-
-    short = te_override if te_override else proto_def["short"] # Princeton often has TE, this is for better precision, not sure about others... but just to be sure
+def encode_protocol(name, key_hex, te_override=None):
+    return REGISTRY[name].encode(key_hex, te_override)
 
-    # Multiplying based on constant short lenght for each protocol
-    def apply_multiplier(seg):
-        return [val * short for val in seg]
+def encode_binraw(bit_len, te, data_raw): # BinRAW encoding, just to be complete
+    data_bits = "".join(f"{int(x,16):04b}" for x in data_raw.split())[:bit_len]
+    bits = np.frombuffer(data_bits.encode(), dtype=np.uint8) == ord("1")
+    return PulseTrain(np.where(bits, te, -te))
+
+def encode_file(parser, te_override=None):
+    with profiler.stage("encode") as st:
+        pulses = _encode_file(parser, te_override)
+        st.pulses = len(pulses)
+    return pulses
 
-    # Header (optional)
-    if "header" in proto_def:
-        for h in proto_def["header"]:
-            pulses.extend(apply_multiplier(h))
+def _encode_file(parser, te_override):
+    meta = parser.meta
+    proto = meta.get("Protocol", "RAW")
 
-    # Convert hex key to binary string, padded to protocol's bit_len to match the bits exactly
-    bit_len = proto_def["bit_len"]
-    key_bin = bin(int(key_hex.replace(" ", ""), 16))[2:].zfill(bit_len)
+    if proto == "RAW":
+        return parser.pulses()
 
-    # Bit encoding for precision
-    for b in key_bin:
-        for seg in proto_def["bit_map"].get(b, []):
-            pulses.extend(apply_multiplier(seg))
+    try:
+        if proto == "BinRAW":
+            te = te_override or int(meta["TE"])
+            return encode_binraw(int(meta["Bit_RAW"]), te, meta["Data_RAW"])
 
-    # Stop - eventhough some protocol dont have stop bit, it is mandatory to make last bit low to prevent trailing of the last bit from key.
-    if "stop" in proto_def:
-        for s in proto_def["stop"]:
-            pulses.extend(apply_multiplier(s))
+        name = resolve_protocol(proto, int(meta.get("Bit", 0)))
+        te = te_override or int(meta.get("TE", 0)) or None
+        return encode_protocol(name, meta["Key"], te)
+    except KeyError as e:
+        raise ValueError(f"{proto} file is missing {e.args[0]} field") from None
 
+# =======================
+# Cached pulse trains
+# =======================
+def load_pulses(path, te_override=None, evict=True, report=None):
+    # Encoded train comes from cache when the file did not change, otherwise it is encoded, normalised and stored.
+    # report dict gets normalisation result, it stays empty on cache hit.
+    version = f"{ENCODER_VERSION}|glitch={NORMALIZE_GLITCH_US}|snap={NORMALIZE_SNAP}"
+    with profiler.stage("cache_load") as st:
+        key = pulse_cache.cache_key(path, te_override, version)
+        pulses = pulse_cache.load(key)
+        st.pulses = 0 if pulses is None else len(pulses)
+    if pulses is not None:
+        return PulseTrain(pulses)  # Memory-mapped cache file, not read until used
+    parser = FlipperSubParser(path)
+    pulses = encode_file(parser, te_override)
+    if parser.meta.get("Protocol", "RAW") == "RAW":
+        # Only captures are cleaned, encoded Key/BinRAW trains are exact and their short TE is not noise
+        meta_te = parser.meta.get("TE", "")
+        te = te_override or (int(meta_te) if meta_te.isdigit() else None)
+        glitch = min(NORMALIZE_GLITCH_US, te) if te else NORMALIZE_GLITCH_US
+        pulses, stats = normalize.normalize(pulses, glitch, NORMALIZE_SNAP)
+        if report is not None:
+            report.update(stats)
+    else:
+        pulses = PulseTrain(normalize.merge_same_sign(pulses))
+    if len(pulses):
+        with profiler.stage("cache_store", pulses=len(pulses), nbytes=pulses.nbytes):
+            pulse_cache.store(key, pulses)
+            if evict:
+                pulse_cache.evict()
     return pulses
 
-def encode_binraw(bit_len, te, data_raw): # BinRAW encoding, just to be complete
-    pulses = []
-    data_bits = "".join(f"{int(x,16):04b}" for x in data_raw.split())
-    data_bits = data_bits[:bit_len]
-
-    for bit in data_bits:
-        if bit == "1":
-            pulses.append(te)
-        else:
-            pulses.append(-te)
-    return pulses
+def precompile(directory, workers=None):
+    paths = sorted(glob.glob(os.path.join(directory, "**", "*.sub"), recursive=True))
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, count in zip(paths, pool.map(_precompile_one, paths, chunksize=16)):
+            if count <= 0:
+                print(f"Skipped {path}, unsupported or broken file")
+            else:
+                total += count
+    pulse_cache.evict()
+    print(f"Precompiled {len(paths)} files ({total} pulses) into {pulse_cache.CACHE_DIR}")
+
+def _precompile_one(path):
+    try:
+        return len(load_pulses(path, evict=False))
+    except Exception:
+        return -1
 
 # =======================
 # Wave sending
 # =======================
-def send_wave_chained(pi, pin, pulses, max_chunk_len, max_chain_length, repeat):
-    pi.set_mode(pin, pigpio.OUTPUT)
-    pi.write(pin, 0)
+def chunk_limit(pi, max_chunk_len=None):
+    # Two waves live in pigpiod at once (one on air, next one queued), each may use half of wave memory
+    limit = min(pi.wave_get_max_pulses() // 2, pi.wave_get_max_cbs() // (2 * CBS_PER_PULSE))
+    if max_chunk_len:
+        limit = min(limit, max_chunk_len)
+    return max(1, limit)
+
+def preflight(pi, pulses, max_chunk_len=None, repeat=1):
+    # What the transmission will need, before anything is uploaded (pulses may be compiled buffer too)
+    chunk_len = chunk_limit(pi, max_chunk_len)
+    chunks = -(-len(pulses) // chunk_len)
+    return {
+        "chunk_len": chunk_len,
+        "chunks": chunks,
+        "cbs_per_chunk": min(chunk_len, len(pulses)) * CBS_PER_PULSE,
+        "max_cbs": pi.wave_get_max_cbs(),
+        "airtime_us": airtime_us(pulses) * max(1, repeat),
+    }
+
+def wait_wave(pi, wave_id, end):
+    # Waits until wave is no longer on air, then frees it
+    wait_tx_done(pi, 0, end, busy=lambda: pi.wave_tx_at() == wave_id)
+    pi.wave_delete(wave_id)
+
+def stream_waves(pi, buf, chunk_len, repeat):
+    # Chunk N+1 is uploaded while chunk N is on air and queued with sync mode,
+    # pigpiod switches to it when N ends, so there is no gap and never more than two waves.
+    on_air = deque()  # (wave id, expected end)
+    clock = pi_clock(pi)
+    end = clock.monotonic()
+    for _ in range(repeat):
+        for idx in range(0, len(buf), chunk_len):
+            chunk = buf[idx:idx + chunk_len]
+            if len(on_air) == 2:
+                wait_wave(pi, *on_air.popleft())
+            wave_id = create_compiled_wave(pi, chunk)
+            if wave_id < 0:
+                raise RuntimeError("No more control blocks available")
+            pi.wave_send_using_mode(wave_id, pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+            end = max(clock.monotonic(), end) + airtime_us(chunk) / 1e6
+            on_air.append((wave_id, end))
+    while on_air:
+        wait_wave(pi, *on_air.popleft())
+
+def send_wave_chained(pi, pin, pulses, max_chunk_len, max_chain_length, repeat, layout=None):
+    # Returns preflight plan, signal needing more waves than max_chain_length is refused.
+    # Repeating frame (framerepeat.split) is uploaded once and looped by pigpiod when it fits.
+    layout = framerepeat.split(pulses) if layout is None else layout
+    if layout["count"] and framerepeat.fits(pi, layout, max_chunk_len):
+        plan = preflight(pi, pulses, max_chunk_len, repeat)
+        plan.update(framerepeat.send(pi, pin, layout, repeat))
+        return plan
+    with profiler.stage("transmit", pulses=len(pulses) * max(1, repeat)):
+        pi.set_mode(pin, pigpio.OUTPUT)
+        pi.write(pin, 0)
+        plan = send_compiled(pi, compile_pulses(pulses, pin), max_chunk_len, max_chain_length, repeat)
+        pi.write(pin, 0)
+        return plan
+
+def send_compiled(pi, buf, max_chunk_len, max_chain_length, repeat):
+    # Same for already compiled buffer (any gpio masks), pins must be outputs already
+    plan = preflight(pi, buf, max_chunk_len, repeat)
+    if plan["chunks"] > max_chain_length:
+        raise ValueError(f"signal needs {plan['chunks']} waves, chain length limit is {max_chain_length}")
+    repeat = max(1, repeat)
     pi.wave_clear()
 
-    idx = 0
-    wave_ids = []
-    total_len = len(pulses)
-
-    while idx < total_len:
-        chunk = pulses[idx:idx + max_chunk_len]
-        waveform = []
-        for pulse in chunk:
-            duration = abs(pulse)
-            if pulse > 0:
-                waveform.append(pigpio.pulse(1 << pin, 0, duration))
-            else:
-                waveform.append(pigpio.pulse(0, 1 << pin, duration))
-
-        pi.wave_add_generic(waveform)
-        wave_id = pi.wave_create()
+    if plan["chunks"] == 1 and repeat <= 0xFFFF:
+        # Whole signal is one wave, pigpiod repeats it by itself
+        wave_id = create_compiled_wave(pi, buf)
         if wave_id < 0:
             raise RuntimeError("No more control blocks available")
-        wave_ids.append(wave_id)
-        idx += len(chunk)
-
-        chain = []
-        for wid in wave_ids:
-            chain += [255, 0, wid]
-
+        chain = [wave_id]
         if repeat > 1:
-            chain = [255, 0] + chain + [255, 1, repeat & 255, (repeat >> 8) & 255]
-
+            chain = [255, 0, wave_id, 255, 1, repeat & 255, (repeat >> 8) & 255]
+        started = pi_clock(pi).monotonic()
         pi.wave_chain(chain)
-        while pi.wave_tx_busy():
-          pass
-
-        for wid in wave_ids:
-          pi.wave_delete(wid)
-
-        pi.wave_clear()
-        pi.write(pin, 0)
+        wait_tx_done(pi, plan["airtime_us"], started)
+        pi.wave_delete(wave_id)
+    else:
+        stream_waves(pi, buf, plan["chunk_len"], repeat)
+    return plan
 
 
 # =======================
 # Main
 # =======================
 def main():
+    profiler.take_flag(sys.argv)
+    if len(sys.argv) in (3, 4) and sys.argv[1] == "precompile":
+        precompile(sys.argv[2], int(sys.argv[3]) if len(sys.argv) == 4 else None)
+        return
+
+    # --daemon sends through running txd.py instead of own pigpio connection
+    use_daemon = "--daemon" in sys.argv
+    if use_daemon:
+        sys.argv.remove("--daemon")
+
     if len(sys.argv) != 5:
-        print("Usage: python3 sub_converter.py /path/to/file.sub <chain_length> <gpio_pin> <repeat_count>")
+        print("Usage: python3 sub_converter.py /path/to/file.sub <chain_length> <gpio_pin> <repeat_count> [--daemon] [--profile]")
+        print("       python3 sub_converter.py precompile /path/to/sub_dir [workers]")
         sys.exit(1)
 
     sub_path, chain_length, gpio_pin, repeat = sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4]
@@ -310,99 +452,50 @@ def main():
     PIN = int(gpio_pin)
     REPEAT =int(repeat)
 
-    parser = FlipperSubParser(sub_path)
-    meta = parser.meta
-    pulses = []
-    # Main decision logic
+    proto = FlipperSubParser(sub_path).meta.get("Protocol", "RAW")
+    report = {}
     try:
-        proto = meta.get("Protocol", "RAW")
-
-        if proto == "RAW":
-            for block in parser.raw_blocks:
-                pulses.extend(block)
-
-        elif proto == "BinRAW":
-            te = int(meta["TE"])
-            bit_len = int(meta["Bit_RAW"])
-            data_raw = meta["Data_RAW"]
-            pulses = encode_binraw(bit_len, te, data_raw)
-
-        elif proto == "Princeton":
-            te = int(meta.get("TE", 0)) or None
-            key = meta["Key"]
-            pulses = encode_protocol(PROTOCOLS["Princeton"], key, te)
-
-        elif proto == "Ansonic":
-            te = int(meta.get("TE", 0)) or None
-            key = meta["Key"]
-            pulses = encode_protocol(PROTOCOLS["Ansonic"], key, te)
-
-        elif proto == "GateTX":
-            te = int(meta.get("TE", 0)) or None
-            key = meta["Key"]
-            pulses = encode_protocol(PROTOCOLS["GateTX"], key, te)
-
-        elif proto == "Holtek":
-            te = int(meta.get("TE", 0)) or None
-            key = meta["Key"]
-            pulses = encode_protocol(PROTOCOLS["Holtek"], key, te)
-
-        elif proto == "Holtek_HT12X":
-            te = int(meta.get("TE", 0)) or None
-            key = meta["Key"]
-            pulses = encode_protocol(PROTOCOLS["Holtek_HT12X"], key, te)
-        
-        elif proto == "SMC5326":
-            te = int(meta.get("TE", 0)) or None
-            key = meta["Key"]
-            pulses = encode_protocol(PROTOCOLS["SMC5326"], key, te)    
-                  
-        elif proto == "Hormann HSM":
-            te = int(meta.get("TE", 0)) or None
-            key = meta["Key"]
-            pulses = encode_protocol(PROTOCOLS["Hormann HSM"], key, te)    
-        
-        elif proto == "Phoenix_V2":
-            te = int(meta.get("TE", 0)) or None
-            key = meta["Key"]
-            pulses = encode_protocol(PROTOCOLS["Phoenix_V2"], key, te)
-        
-        elif proto == "Honeywell":
-            te = int(meta.get("TE", 0)) or None
-            key = meta["Key"]
-            pulses = encode_protocol(PROTOCOLS["Honeywell"], key, te)  
-                        
-        elif proto == "Ansonic":
-            te = int(meta.get("TE", 0)) or None
-            key = meta["Key"]
-            pulses = encode_protocol(PROTOCOLS["Ansonic"], key, te)
-
-        elif proto == "Nice FLO":
-            te = int(meta.get("TE", 0)) or None
-            key = meta["Key"]
-            pulses = encode_protocol(PROTOCOLS["Nice FLO"], key, te)
-
-        elif proto == "CAME":
-            bit_len = int(meta.get("Bit", 0))
-            te = int(meta.get("TE", 0)) or None
-            key = meta["Key"]
-
-            if bit_len == 12:
-                pulses = encode_protocol(PROTOCOLS["Came12"], key, te)
-            elif bit_len == 18:
-                pulses = encode_protocol(PROTOCOLS["Came18"], key, te)
-            elif bit_len == 24:
-                pulses = encode_protocol(PROTOCOLS["Came24"], key, te)
-            elif bit_len == 25:
-                pulses = encode_protocol(PROTOCOLS["Came25"], key, te)
-
-    except:
-            print(f"Sub file contains unsupported protocol!")
-
-    pi = pigpio.pi()
+        pulses = load_pulses(sub_path, report=report)
+    except ValueError as e:
+        print(f"Sub file cannot be sent: {e}")
+        sys.exit(1)
+    if report:
+        print(f"Normalised {normalize.describe(report)}")
+
+    if use_daemon:
+        print(f"Transmitting {len(pulses)} pulses via {proto} protocol with {repeat}X repeat (daemon)")
+        try:
+            result = txd.send_pulses(pulses, PIN, REPEAT)
+        except OSError:
+            print("Transmit daemon not running, start txd.py")
+            sys.exit(1)
+        except RuntimeError as e:
+            print(f"Transmit daemon failed: {e}")
+            sys.exit(1)
+        print(f"Sent in {result['elapsed_ms']} ms, wave {'reused' if result['cached'] else 'uploaded'}")
+        return
+    if txd.refuse_if_running(" or send with --daemon"):
+        sys.exit(1)
+
+    pi = CountingPi(pigpio.pi())
+    plan = preflight(pi, pulses, repeat=REPEAT)
+    layout = framerepeat.split(pulses)
     print(f"Transmitting {len(pulses)} pulses via {proto} protocol with {repeat}X repeat")
-    send_wave_chained(pi, PIN, pulses, MAX_PULSES_PER_WAVE, MAX_CHAIN_LENGTH, REPEAT)
-    pi.stop()
+    if layout["count"] and framerepeat.fits(pi, layout):
+        print(f"Repeating {framerepeat.describe(layout)}, uploading {framerepeat.uploaded_pulses(layout)} pulses, "
+              f"{plan['airtime_us'] / 1e6:.2f} s airtime")
+    else:
+        print(f"{plan['chunks']} waves of up to {plan['chunk_len']} pulses, ~{plan['cbs_per_chunk']} of {plan['max_cbs']} control blocks each, "
+              f"{plan['airtime_us'] / 1e6:.2f} s airtime")
+    try:
+        with TxMeter(pi) as meter:
+            send_wave_chained(pi, PIN, pulses, None, MAX_CHAIN_LENGTH, REPEAT, layout)
+        print(f"Done, {meter.summary()}")
+    except ValueError as e:
+        print(f"Sub file cannot be sent: {e}")
+        sys.exit(1)
+    finally:
+        pi.stop()
 
 if __name__ == "__main__":
     main()
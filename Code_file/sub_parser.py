@@ -0,0 +1,62 @@
+import mmap
+import re
+import numpy as np
+import profiler
+from pulsetrain import PulseTrain
+# Shared Flipper .sub parser, file is memory-mapped and RAW data goes straight into int32 arrays.
+# Header (Protocol, TE, Key, Bit, Frequency...) is parsed once on open, pulse payload only when asked for.
+# Every RAW_Data block is a PulseTrain, whole file is their concatenation (joined when first used).
+
+RAW_MARKER = b"RAW_Data:"
+RAW_LINE = re.compile(rb"^[ \t]*RAW_Data:", re.M)
+TEXT_LINE = re.compile(rb"\n[ \t]*[A-Za-z]")  # Anything that is not a +/- continuation line ends the block
+
+class FlipperSubParser:
+    def __init__(self, path):
+        self.path = path
+        self.meta = {}
+        self.parse_header()
+
+    def _map(self):
+        with open(self.path, "rb") as f:
+            try:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # Empty file cannot be mapped
+                return None
+
+    def parse_header(self):
+        mm = self._map()
+        if mm is None:
+            return
+        with mm, profiler.stage("parse_header"):
+            end = mm.find(RAW_MARKER)
+            header = mm[:end if end >= 0 else len(mm)]
+        for line in header.decode("utf-8", "replace").splitlines():
+            if ":" in line:
+                key, val = line.split(":", 1)
+                self.meta[key.strip()] = val.strip()
+
+    def iter_blocks(self):
+        # Lazy, one RAW_Data block (with its continuation lines) at a time
+        mm = self._map()
+        if mm is None:
+            return
+        with mm:
+            starts = [m.end() for m in RAW_LINE.finditer(mm)]
+            for i, start in enumerate(starts):
+                end = starts[i + 1] - len(RAW_MARKER) if i + 1 < len(starts) else len(mm)
+                text = TEXT_LINE.search(mm, start, end)
+                if text:
+                    end = text.start()
+                with profiler.stage("parse_raw", nbytes=end - start) as st:
+                    block = np.array(mm[start:end].split(), dtype=np.int32)  # Bad token raises ValueError
+                    st.pulses = len(block)
+                yield PulseTrain(block)
+
+    @property
+    def raw_blocks(self):
+        return list(self.iter_blocks())
+
+    def pulses(self):
+        # All RAW blocks as one train
+        return PulseTrain.concat(*self.iter_blocks())
@@ -0,0 +1,258 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import hashlib
+import argparse
+from collections import OrderedDict
+import numpy as np
+import pigpio
+import profiler
+from pulsetrain import PulseTrain
+from waveform import create_wave, airtime_us, wait_tx_done, pi_clock, CountingPi, TxMeter, MAX_PULSES_PER_WAVE
+# Transmit daemon, keeps one pigpio connection open and serves transmit requests over Unix socket.
+# Requests are queued and sent one by one (pigpiod has only one wave transmitter),
+# waves of recently sent codes stay in pigpiod so sending them again skips upload and wave_create.
+# Usage: python3 txd.py [--socket PATH] [--host HOST] [--port PORT]
+# Request: one JSON line {"op": "send", "gpio": 13, "repeat": 1, "nbytes": N} followed by N bytes of int32 pulses.
+
+# ==== CONFIG ====
+SOCKET_PATH = "/tmp/subghz_txd.sock"
+WAVE_CACHE_SIZE = 32  # Codes kept as ready waves in pigpiod
+# ================
+
+class WaveCache:
+    # LRU of code key -> wave ids (one per chunk), evicted waves are deleted from pigpiod
+    def __init__(self, pi, size=WAVE_CACHE_SIZE):
+        self.pi = pi
+        self.size = size
+        self.waves = OrderedDict()
+
+    def get(self, key):
+        ids = self.waves.get(key)
+        if ids is not None:
+            self.waves.move_to_end(key)
+        return ids
+
+    def evict_oldest(self):
+        if not self.waves:
+            return False
+        _, ids = self.waves.popitem(last=False)
+        for wid in ids:
+            self.pi.wave_delete(wid)
+        return True
+
+    def build(self, key, gpio, pulses):
+        ids = []
+        idx = 0
+        while idx < len(pulses):
+            chunk = pulses[idx:idx + MAX_PULSES_PER_WAVE]
+            try:
+                self.pi.wave_add_new()
+                wave_id = create_wave(self.pi, gpio, chunk)
+            except pigpio.error:
+                wave_id = -1
+            if wave_id < 0:
+                # pigpiod is full, make room from least recently used codes
+                if self.evict_oldest():
+                    continue
+                for wid in ids:
+                    self.pi.wave_delete(wid)
+                raise RuntimeError("No more control blocks available")
+            ids.append(wave_id)
+            idx += len(chunk)
+        self.waves[key] = ids
+        while len(self.waves) > self.size:
+            self.evict_oldest()
+        return ids
+
+    def clear(self):
+        while self.evict_oldest():
+            pass
+
+    def forget(self):
+        # Waves were cleared by someone else, ids are not ours any more and must not be deleted
+        self.waves.clear()
+
+def chain_program(ids, repeat):
+    chain = list(ids)
+    if repeat > 1:
+        chain = [255, 0] + chain + [255, 1, repeat & 255, (repeat >> 8) & 255]
+    return chain
+
+class Transmitter:
+    def __init__(self, pi):
+        self.pi = pi
+        self.cache = WaveCache(pi)
+        self.outputs = set()
+        self.sent = 0
+        self.hits = 0
+        self.flushed = 0  # Cache lost to wave_clear of other scripts
+        pi.wave_clear()
+
+    def send(self, gpio, pulses, repeat=1):
+        with TxMeter(self.pi) as meter, profiler.stage("txd_send", pulses=len(pulses) * max(1, repeat)):
+            result = self._send(gpio, pulses, repeat)
+        result["pigpio_calls"] = sum(meter.calls.values())
+        result["cpu_ms"] = round(meter.cpu * 1000, 2)
+        return result
+
+    def _send(self, gpio, pulses, repeat):
+        start = time.monotonic()
+        pulses = PulseTrain(pulses)
+        digest = hashlib.sha1(gpio.to_bytes(1, "little"))
+        digest.update(pulses.memoryview())  # Hashed straight from request buffer
+        key = digest.hexdigest()
+        ids = self.cache.get(key)
+        cached = ids is not None
+        if not cached:
+            ids = self.cache.build(key, gpio, pulses)
+        if gpio not in self.outputs:
+            self.pi.set_mode(gpio, pigpio.OUTPUT)
+            self.outputs.add(gpio)
+
+        airtime = airtime_us(pulses) * max(1, repeat)
+        chain_start = pi_clock(self.pi).monotonic()
+        try:
+            self.pi.wave_chain(chain_program(ids, repeat))
+        except pigpio.error:
+            if not cached:
+                raise
+            # Another script called wave_clear on this pigpiod, cached ids are gone: upload again
+            self.cache.forget()
+            self.flushed += 1
+            ids = self.cache.build(key, gpio, pulses)
+            cached = False
+            chain_start = pi_clock(self.pi).monotonic()
+            self.pi.wave_chain(chain_program(ids, repeat))
+        wait_tx_done(self.pi, airtime, chain_start)
+        self.pi.write(gpio, 0)
+
+        self.sent += 1
+        self.hits += cached
+        return {"ok": True, "pulses": len(pulses), "cached": cached,
+                "airtime_ms": round(airtime / 1000, 1), "elapsed_ms": round((time.monotonic() - start) * 1000, 1)}
+
+    def stats(self):
+        return {"ok": True, "sent": self.sent, "cache_hits": self.hits, "cached_codes": len(self.cache.waves),
+                "cache_flushed": self.flushed}
+
+# =======================
+# Server
+# =======================
+async def serve(tx, socket_path):
+    queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+
+    async def worker():
+        while True:
+            request, pulses, future = await queue.get()
+            try:
+                result = await loop.run_in_executor(None, tx.send, request["gpio"], pulses, request.get("repeat", 1))
+                future.set_result(result)
+            except Exception as e:
+                future.set_result({"ok": False, "error": str(e)})
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    op = request.get("op")
+                    if op == "send":
+                        payload = await reader.readexactly(request["nbytes"])
+                        future = loop.create_future()
+                        await queue.put((request, PulseTrain(np.frombuffer(payload, dtype=np.int32)), future))
+                        response = await future
+                    elif op == "stats":
+                        response = tx.stats()
+                    elif op == "ping":
+                        response = {"ok": True}
+                    else:
+                        response = {"ok": False, "error": f"Unknown op '{op}'"}
+                except (ValueError, KeyError) as e:
+                    response = {"ok": False, "error": f"Bad request: {e}"}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    worker_task = asyncio.create_task(worker())
+    print(f"Transmit daemon listening on {socket_path}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        worker_task.cancel()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+# =======================
+# Client
+# =======================
+def request(header, payload=b"", socket_path=SOCKET_PATH):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall((json.dumps(header) + "\n").encode() + payload)
+        with s.makefile("rb") as f:
+            response = json.loads(f.readline())
+    if not response.get("ok"):
+        raise RuntimeError(response.get("error", "Transmit daemon failed"))
+    return response
+
+def running(socket_path=SOCKET_PATH):
+    try:
+        request({"op": "ping"}, socket_path=socket_path)
+        return True
+    except (OSError, ValueError, RuntimeError):
+        return False
+
+def refuse_if_running(hint="", socket_path=SOCKET_PATH):
+    # Scripts with own waves call wave_clear, which takes the waves daemon keeps in pigpiod (ids are then
+    # reused for other waves and a cached code could send the wrong signal). Returns True when caller must stop.
+    if not running(socket_path):
+        return False
+    print(f"Transmit daemon (txd.py) is running, stop it first{hint}.")
+    return True
+
+def send_pulses(pulses, gpio, repeat=1, socket_path=SOCKET_PATH):
+    # Client side, raises ConnectionError (FileNotFoundError) when daemon is not running
+    payload = PulseTrain(pulses).tobytes()
+    return request({"op": "send", "gpio": gpio, "repeat": repeat, "nbytes": len(payload)}, payload, socket_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="433 MHz transmit daemon")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Unix socket path")
+    parser.add_argument("--host", default="localhost", help="pigpiod host")
+    parser.add_argument("--port", type=int, default=8888, help="pigpiod port (fake_pigpio.py for testing)")
+    parser.add_argument("--profile", action="store_true", help="Print JSON timing summary of every stage on exit")
+    args = parser.parse_args()
+    if args.profile:
+        profiler.enable()
+
+    pi = pigpio.pi(args.host, args.port)
+    if not pi.connected:
+        print("Cannot connect to pigpiod!")
+        sys.exit(1)
+    pi = CountingPi(pi)
+    tx = Transmitter(pi)
+    try:
+        asyncio.run(serve(tx, args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tx.cache.clear()
+        pi.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import time
+from collections import Counter
+import numpy as np
+import pigpio
+import profiler
+from pulsetrain import PulseTrain
+# Shared waveform compiler, turns signed pulse train (+ high, - low, in uS) straight into packed buffer for pigpiod.
+# No pigpio.pulse object per edge, whole train is done with few numpy operations.
+
+# ==== CONFIG ====
+MAX_PULSES_PER_WAVE = 5400  # One wave_add_generic message, pigpiod socket extension is limited to 64 kB (12 bytes per pulse)
+TX_POLL_MARGIN = 0.002      # Start polling wave_tx_busy this long before expected end of transmission
+TX_POLL_START = 0.0005
+TX_POLL_MAX = 0.01
+# ================
+
+def compile_pulses(pulses, pin):
+    # pulses can be list, array or numpy array of signed durations
+    p = np.asarray(pulses, dtype=np.int32)
+    with profiler.stage("compile", pulses=len(p)):
+        mask = np.uint32(1 << pin)
+        high = p > 0
+        buf = np.empty((len(p), 3), dtype=np.uint32)  # gpio_on, gpio_off, delay - same layout as struct.pack("III") in pigpio
+        buf[:, 0] = np.where(high, mask, 0)
+        buf[:, 1] = np.where(high, 0, mask)
+        buf[:, 2] = np.abs(p)
+    return buf
+
+def wave_add_compiled(pi, buf):
+    # Same message as pi.wave_add_generic, but buffer is already packed
+    if len(buf) == 0:
+        return 0
+    data = np.ascontiguousarray(buf, dtype=np.uint32).tobytes()
+    with profiler.stage("wave_upload", pulses=len(buf), nbytes=len(data)):
+        add_packed = getattr(pi, "wave_add_packed", None)
+        if add_packed is not None:  # fake_pigpio.FakePi
+            return add_packed(data)
+        note = getattr(pi, "note_call", None)
+        if note is not None:  # CountingPi, raw command below does not go through it
+            note("wave_add_generic")
+        return pigpio._u2i(pigpio._pigpio_command_ext(pi.sl, pigpio._PI_CMD_WVAG, 0, 0, len(data), [data]))
+
+def create_wave(pi, pin, pulses):
+    # Compile, upload and create one wave, returns wave id (<0 on error)
+    return create_compiled_wave(pi, compile_pulses(pulses, pin))
+
+def create_compiled_wave(pi, buf):
+    # Trains longer than one message are uploaded in parts, pigpiod merges every part from time 0,
+    # so each part starts with delay-only pulse shifting it behind the previous ones.
+    if len(buf) <= MAX_PULSES_PER_WAVE:
+        wave_add_compiled(pi, buf)
+        return pi.wave_create()
+    offset = 0
+    for idx in range(0, len(buf), MAX_PULSES_PER_WAVE - 1):
+        part = buf[idx:idx + MAX_PULSES_PER_WAVE - 1]
+        if offset:
+            part = np.concatenate((np.array([[0, 0, offset]], dtype=np.uint32), part))
+        wave_add_compiled(pi, part)
+        offset += int(buf[idx:idx + MAX_PULSES_PER_WAVE - 1, 2].sum(dtype=np.uint64))
+    return pi.wave_create()
+
+# =======================
+# Transmission completion
+# =======================
+def pi_clock(pi):
+    # fake_pigpio.FakePi may run on virtual clock, waits then take no real time
+    return getattr(pi, "clock", time)
+
+def airtime_us(pulses):
+    # Signed pulse train or compiled (n, 3) buffer
+    p = np.asarray(pulses)
+    if p.ndim == 2:
+        return int(p[:, 2].sum(dtype=np.int64))
+    return int(np.abs(p.astype(np.int64)).sum())
+
+def wait_tx_done(pi, airtime, started=None, stop=None, busy=None):
+    with profiler.stage("tx_wait"):
+        return _wait_tx_done(pi, airtime, started, stop, busy)
+
+def _wait_tx_done(pi, airtime, started, stop, busy):
+    # pigpio has no "wave finished" event, so sleep for the expected airtime (uS)
+    # and only poll wave_tx_busy near the end, with growing interval. Returns number of polls.
+    # stop() lets caller abort wait (Ctrl+C in jammer), waveform keeps going in pigpiod.
+    # busy() replaces wave_tx_busy, e.g. to wait for one wave of a stream.
+    busy = pi.wave_tx_busy if busy is None else busy
+    clock = pi_clock(pi)
+    started = clock.monotonic() if started is None else started
+    deadline = started + airtime / 1e6 - TX_POLL_MARGIN
+    while True:
+        left = deadline - clock.monotonic()
+        if left <= 0:
+            break
+        if stop is not None:
+            if stop():
+                return 0
+            left = min(left, 0.05)
+        clock.sleep(left)
+
+    polls = 0
+    delay = TX_POLL_START
+    while busy():
+        polls += 1
+        if stop is not None and stop():
+            break
+        clock.sleep(delay)
+        delay = min(delay * 2, TX_POLL_MAX)
+    return polls
+
+class CountingPi:
+    # Wraps pigpio.pi and counts calls per method, each one is a socket round trip to pigpiod (timed with --profile)
+    def __init__(self, pi):
+        self._pi = pi
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        attr = getattr(self._pi, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self.calls[name] += 1
+            if profiler.enabled:
+                with profiler.stage("pigpio." + name):
+                    return attr(*args, **kwargs)
+            return attr(*args, **kwargs)
+        return counted
+
+    def note_call(self, name):
+        self.calls[name] += 1
+
+class TxMeter:
+    # Calls and CPU time of one transmission: with TxMeter(pi) as m: ... then m.summary()
+    def __init__(self, pi):
+        self.pi = pi if isinstance(pi, CountingPi) else None
+        self.calls = Counter()
+
+    def __enter__(self):
+        self.start_calls = Counter(self.pi.calls) if self.pi else Counter()
+        self.start_cpu = time.process_time()
+        self.start_wall = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.cpu = time.process_time() - self.start_cpu
+        self.wall = time.monotonic() - self.start_wall
+        if self.pi:
+            self.calls = self.pi.calls - self.start_calls
+
+    def summary(self):
+        return f"{sum(self.calls.values())} pigpio calls, {self.cpu * 1000:.1f} ms CPU in {self.wall * 1000:.0f} ms"